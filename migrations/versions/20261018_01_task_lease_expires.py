@@ -0,0 +1,38 @@
+"""Add lease deadline to tasks
+
+Revision ID: 20261018_01
+Create Date: 2026-10-18
+
+Leased tasks carry the moment their lease runs out, stuck task recovery
+requeues them after that instead of guessing from task_started.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_01"
+down_revision = "20250905_01"
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        # fresh database, create_all() will build the table with the column
+        return True
+    return column in [c["name"] for c in inspector.get_columns(table)]
+
+
+def upgrade():
+    if _has_column("tasks", "task_lease_expires"):
+        return
+
+    with op.batch_alter_table("tasks") as batch:
+        batch.add_column(sa.Column("task_lease_expires", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("tasks") as batch:
+        batch.drop_column("task_lease_expires")
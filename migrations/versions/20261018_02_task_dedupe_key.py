@@ -0,0 +1,63 @@
+"""Add dedupe key to tasks
+
+Revision ID: 20261018_02
+Create Date: 2026-10-18
+
+task_dedupe_key holds "{task_type}:{task_job}" while a task is queued or
+running and NULL otherwise. The unique index allows many NULLs, so it only
+prevents two active tasks doing the same job.
+
+Existing active duplicates are left without a key (only the oldest one per
+type/job gets it) instead of being deleted.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_02"
+down_revision = "20261018_01"
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        # fresh database, create_all() will build the table with the column
+        return True
+    return column in [c["name"] for c in inspector.get_columns(table)]
+
+
+def upgrade():
+    if _has_column("tasks", "task_dedupe_key"):
+        return
+
+    with op.batch_alter_table("tasks") as batch:
+        batch.add_column(sa.Column("task_dedupe_key", sa.String(length=321), nullable=True))
+        batch.create_unique_constraint("uq_tasks_task_dedupe_key", ["task_dedupe_key"])
+
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.text(
+            "SELECT task_id, task_type, task_job FROM tasks "
+            "WHERE task_status IN ('queued', 'running') ORDER BY task_created, task_id"
+        )
+    ).fetchall()
+
+    seen = set()
+    for task_id, task_type, task_job in rows:
+        key = f"{task_type}:{task_job}"
+        if key in seen:
+            continue
+        seen.add(key)
+        conn.execute(
+            sa.text("UPDATE tasks SET task_dedupe_key = :key WHERE task_id = :task_id"),
+            {"key": key, "task_id": task_id},
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("tasks") as batch:
+        batch.drop_constraint("uq_tasks_task_dedupe_key", type_="unique")
+        batch.drop_column("task_dedupe_key")
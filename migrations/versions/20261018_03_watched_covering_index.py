@@ -0,0 +1,41 @@
+"""Add covering indexes for watched ids lookups
+
+Revision ID: 20261018_03
+Create Date: 2026-10-18
+
+(filmweb_id, id_media, rate) lets "ids (and rates) watched by user" be
+answered from the index alone, without reading the table rows.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_03"
+down_revision = "20261018_02"
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    "filmweb_user_watched_movies": "ix_filmweb_user_watched_movies_filmweb_id_id_media_rate",
+    "filmweb_user_watched_series": "ix_filmweb_user_watched_series_filmweb_id_id_media_rate",
+}
+
+
+def _has_index(table: str, index: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        # fresh database, create_all() will build the table with the index
+        return True
+    return index in [i["name"] for i in inspector.get_indexes(table)]
+
+
+def upgrade():
+    for table, index in INDEXES.items():
+        if not _has_index(table, index):
+            op.create_index(index, table, ["filmweb_id", "id_media", "rate"])
+
+
+def downgrade():
+    for table, index in INDEXES.items():
+        op.drop_index(index, table_name=table)
@@ -0,0 +1,42 @@
+"""Add (filmweb_id, date, id_media) indexes for watched history pagination
+
+Revision ID: 20261018_04
+Create Date: 2026-10-18
+
+get_all is paginated newest first by (date, id_media), the index gives
+both the filter and the order, a page reads only `limit` rows. It is
+scanned backwards for order=desc.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_04"
+down_revision = "20261018_03"
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    "filmweb_user_watched_movies": "ix_filmweb_user_watched_movies_filmweb_id_date",
+    "filmweb_user_watched_series": "ix_filmweb_user_watched_series_filmweb_id_date",
+}
+
+
+def _has_index(table: str, index: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        # fresh database, create_all() will build the table with the index
+        return True
+    return index in [i["name"] for i in inspector.get_indexes(table)]
+
+
+def upgrade():
+    for table, index in INDEXES.items():
+        if not _has_index(table, index):
+            op.create_index(index, table, ["filmweb_id", "date", "id_media"])
+
+
+def downgrade():
+    for table, index in INDEXES.items():
+        op.drop_index(index, table_name=table)
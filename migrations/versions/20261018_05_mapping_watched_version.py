@@ -0,0 +1,39 @@
+"""Add watched_version to filmweb user mapping
+
+Revision ID: 20261018_05
+Create Date: 2026-10-18
+
+Counter bumped with every change of a user's watched movies/series (and
+of media they watched). It is the ETag of the watched list endpoints, so
+a poll with If-None-Match is answered without reading the watched tables.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_05"
+down_revision = "20261018_04"
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        # fresh database, create_all() will build the table with the column
+        return True
+    return column in [c["name"] for c in inspector.get_columns(table)]
+
+
+def upgrade():
+    if _has_column("filmweb_user_mapping", "watched_version"):
+        return
+
+    with op.batch_alter_table("filmweb_user_mapping") as batch:
+        batch.add_column(sa.Column("watched_version", sa.Integer(), nullable=False, server_default="0"))
+
+
+def downgrade():
+    with op.batch_alter_table("filmweb_user_mapping") as batch:
+        batch.drop_column("watched_version")
@@ -0,0 +1,38 @@
+"""Add filmweb_user_id to filmweb user mapping
+
+Revision ID: 20261018_06
+Create Date: 2026-10-18
+
+Numeric filmweb.pl userId of the mapped nick. The server resolves it
+once when the mapping is set, so nothing has to look it up again.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_06"
+down_revision = "20261018_05"
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        # fresh database, create_all() will build the table with the column
+        return True
+    return column in [c["name"] for c in inspector.get_columns(table)]
+
+
+def upgrade():
+    if _has_column("filmweb_user_mapping", "filmweb_user_id"):
+        return
+
+    with op.batch_alter_table("filmweb_user_mapping") as batch:
+        batch.add_column(sa.Column("filmweb_user_id", sa.BIGINT(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table("filmweb_user_mapping") as batch:
+        batch.drop_column("filmweb_user_id")
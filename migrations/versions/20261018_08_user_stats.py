@@ -0,0 +1,70 @@
+"""Add filmweb user stats tables
+
+Revision ID: 20261018_08
+Create Date: 2026-10-18
+
+Per-user watched counters (count, rates, histogram, favorites, first/last
+watched) and counts per month, updated together with the watched tables.
+Existing watched history is not copied here, run POST /stats/rebuild
+once after upgrading.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_08"
+down_revision = "20261018_07"
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table: str) -> bool:
+    return table in sa.inspect(op.get_bind()).get_table_names()
+
+
+def _counter(name: str) -> sa.Column:
+    return sa.Column(name, sa.Integer(), nullable=False, server_default="0")
+
+
+def _filmweb_id() -> sa.Column:
+    return sa.Column(
+        "filmweb_id",
+        sa.String(128),
+        sa.ForeignKey("filmweb_user_mapping.filmweb_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+
+
+def upgrade():
+    # fresh database, create_all() will build the tables
+    if not _has_table("filmweb_user_mapping"):
+        return
+
+    if not _has_table("filmweb_user_stats"):
+        op.create_table(
+            "filmweb_user_stats",
+            _filmweb_id(),
+            sa.Column("media_type", sa.String(16), primary_key=True),
+            _counter("watched"),
+            _counter("rated"),
+            _counter("rate_sum"),
+            *[_counter(f"rate_{rate}") for rate in range(1, 11)],
+            _counter("favorites"),
+            sa.Column("first_watched", sa.DateTime(), nullable=True),
+            sa.Column("last_watched", sa.DateTime(), nullable=True),
+        )
+
+    if not _has_table("filmweb_user_stats_monthly"):
+        op.create_table(
+            "filmweb_user_stats_monthly",
+            _filmweb_id(),
+            sa.Column("media_type", sa.String(16), primary_key=True),
+            sa.Column("month", sa.String(7), primary_key=True),
+            _counter("watched"),
+        )
+
+
+def downgrade():
+    op.drop_table("filmweb_user_stats_monthly")
+    op.drop_table("filmweb_user_stats")
@@ -0,0 +1,87 @@
+"""Add per user per day activity rollup and guild stats indexes
+
+Revision ID: 20261018_09
+Create Date: 2026-10-18
+
+Guild leaderboards and the activity heatmap sum this table over the
+guild members instead of scanning their watched history. Existing
+history is not copied here, run POST /stats/rebuild once after upgrading.
+
+The (filmweb_id, date, id_media) watched indexes get rate appended, the
+guild title stats of a period are then read from the index alone.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_09"
+down_revision = "20261018_08"
+branch_labels = None
+depends_on = None
+
+DESTINATIONS_INDEX = "ix_discord_destinations_discord_guild_id"
+WATCHED_DATE_INDEXES = {
+    "filmweb_user_watched_movies": "ix_filmweb_user_watched_movies_filmweb_id_date",
+    "filmweb_user_watched_series": "ix_filmweb_user_watched_series_filmweb_id_date",
+}
+
+
+def _has_table(table: str) -> bool:
+    return table in sa.inspect(op.get_bind()).get_table_names()
+
+
+def _index_columns(table: str, index: str) -> list[str] | None:
+    for i in sa.inspect(op.get_bind()).get_indexes(table):
+        if i["name"] == index:
+            return i["column_names"]
+    return None
+
+
+def _counter(name: str) -> sa.Column:
+    return sa.Column(name, sa.Integer(), nullable=False, server_default="0")
+
+
+def upgrade():
+    # fresh database, create_all() will build the tables
+    if not _has_table("filmweb_user_mapping"):
+        return
+
+    if not _has_table("filmweb_user_activity_daily"):
+        op.create_table(
+            "filmweb_user_activity_daily",
+            sa.Column(
+                "filmweb_id",
+                sa.String(128),
+                sa.ForeignKey("filmweb_user_mapping.filmweb_id", ondelete="CASCADE"),
+                primary_key=True,
+            ),
+            sa.Column("day", sa.Date(), primary_key=True),
+            sa.Column("media_type", sa.String(16), primary_key=True),
+            _counter("watched"),
+            _counter("rated"),
+            _counter("rate_sum"),
+            sqlite_with_rowid=False,
+        )
+
+    if _has_table("discord_destinations") and _index_columns("discord_destinations", DESTINATIONS_INDEX) is None:
+        op.create_index(DESTINATIONS_INDEX, "discord_destinations", ["discord_guild_id", "user_id"])
+
+    for table, index in WATCHED_DATE_INDEXES.items():
+        if not _has_table(table):
+            continue
+        columns = _index_columns(table, index)
+        if columns is not None and "rate" in columns:
+            continue
+        if columns is not None:
+            op.drop_index(index, table_name=table)
+        op.create_index(index, table, ["filmweb_id", "date", "id_media", "rate"])
+
+
+def downgrade():
+    for table, index in WATCHED_DATE_INDEXES.items():
+        op.drop_index(index, table_name=table)
+        op.create_index(index, table, ["filmweb_id", "date", "id_media"])
+
+    op.drop_index(DESTINATIONS_INDEX, table_name="discord_destinations")
+    op.drop_table("filmweb_user_activity_daily")
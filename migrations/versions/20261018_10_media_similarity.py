@@ -0,0 +1,41 @@
+"""Add title similarity table for recommendations
+
+Revision ID: 20261018_10
+Create Date: 2026-10-18
+
+Top K most similar titles of each title, computed from user rates in a
+background worker. Filled by GET /recommend/rebuild (cron).
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_10"
+down_revision = "20261018_09"
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table: str) -> bool:
+    return table in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade():
+    # fresh database, create_all() will build the table
+    if not _has_table("filmweb_user_mapping"):
+        return
+
+    if not _has_table("filmweb_media_similarity"):
+        op.create_table(
+            "filmweb_media_similarity",
+            sa.Column("id_media", sa.Integer(), primary_key=True),
+            sa.Column("media_type", sa.String(16), primary_key=True),
+            sa.Column("id_similar", sa.Integer(), primary_key=True),
+            sa.Column("similarity", sa.Float(), nullable=False),
+            sqlite_with_rowid=False,
+        )
+
+
+def downgrade():
+    op.drop_table("filmweb_media_similarity")
@@ -0,0 +1,59 @@
+"""Add notification outbox
+
+Revision ID: 20261018_11
+Create Date: 2026-10-18
+
+Discord notifications of new watched titles move from send_discord_notification
+tasks to this table, written in the transaction of the watched insert. Queued
+send_discord_notification tasks left from before are no longer read, they are
+removed by the old tasks cleanup.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_11"
+down_revision = "20261018_10"
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table: str) -> bool:
+    return table in sa.inspect(op.get_bind()).get_table_names()
+
+
+def upgrade():
+    # fresh database, create_all() will build the table
+    if not _has_table("filmweb_user_mapping"):
+        return
+
+    if not _has_table("notification_outbox"):
+        op.create_table(
+            "notification_outbox",
+            sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column(
+                "filmweb_id",
+                sa.String(128),
+                sa.ForeignKey("filmweb_user_mapping.filmweb_id", ondelete="CASCADE"),
+                nullable=False,
+            ),
+            sa.Column("media_type", sa.String(16), nullable=False),
+            sa.Column("media_id", sa.Integer(), nullable=False),
+            sa.Column("payload", sa.JSON(), nullable=False),
+            sa.Column("status", sa.String(16), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("created", sa.DateTime(), nullable=False),
+            sqlite_autoincrement=True,
+        )
+        op.create_index(
+            "ix_notification_outbox_filmweb_id_media",
+            "notification_outbox",
+            ["filmweb_id", "media_type", "media_id"],
+            unique=True,
+        )
+        op.create_index("ix_notification_outbox_status_id", "notification_outbox", ["status", "id"])
+
+
+def downgrade():
+    op.drop_table("notification_outbox")
@@ -0,0 +1,44 @@
+"""Add priority to tasks
+
+Revision ID: 20261018_12
+Create Date: 2026-10-18
+
+Claims serve the highest task_priority first, task types take turns by weight
+within a priority. Tasks queued before this are normal priority. The index
+lets a claim seek the oldest queued tasks of one type at its highest priority.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_12"
+down_revision = "20261018_11"
+branch_labels = None
+depends_on = None
+
+
+def _has_column(table: str, column: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        # fresh database, create_all() will build the table with the column
+        return True
+    return column in [c["name"] for c in inspector.get_columns(table)]
+
+
+def upgrade():
+    if _has_column("tasks", "task_priority"):
+        return
+
+    with op.batch_alter_table("tasks") as batch:
+        batch.add_column(sa.Column("task_priority", sa.Integer(), nullable=False, server_default="1"))
+        batch.create_index(
+            "ix_tasks_type_status_priority_created",
+            ["task_type", "task_status", "task_priority", "task_created"],
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("tasks") as batch:
+        batch.drop_index("ix_tasks_type_status_priority_created")
+        batch.drop_column("task_priority")
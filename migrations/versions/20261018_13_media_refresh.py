@@ -0,0 +1,47 @@
+"""Add refresh schedule to movies and series
+
+Revision ID: 20261018_13
+Create Date: 2026-10-18
+
+Titles are refreshed when next_refresh_at is due instead of all of them every
+6 hours. Existing titles start with NULL and are due, the planner spreads that
+first pass over its window.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_13"
+down_revision = "20261018_12"
+branch_labels = None
+depends_on = None
+
+MEDIA_TABLES = ["filmweb_movies", "filmweb_series"]
+
+
+def _has_column(table: str, column: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        # fresh database, create_all() will build the table with the column
+        return True
+    return column in [c["name"] for c in inspector.get_columns(table)]
+
+
+def upgrade():
+    for table in MEDIA_TABLES:
+        if _has_column(table, "next_refresh_at"):
+            continue
+
+        with op.batch_alter_table(table) as batch:
+            batch.add_column(sa.Column("last_scraped_at", sa.DateTime(), nullable=True))
+            batch.add_column(sa.Column("next_refresh_at", sa.DateTime(), nullable=True))
+            batch.create_index(f"ix_{table}_next_refresh_at", ["next_refresh_at"])
+
+
+def downgrade():
+    for table in MEDIA_TABLES:
+        with op.batch_alter_table(table) as batch:
+            batch.drop_index(f"ix_{table}_next_refresh_at")
+            batch.drop_column("next_refresh_at")
+            batch.drop_column("last_scraped_at")
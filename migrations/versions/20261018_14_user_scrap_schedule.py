@@ -0,0 +1,58 @@
+"""Add scrap schedule to filmweb user mappings
+
+Revision ID: 20261018_14
+Create Date: 2026-10-18
+
+Watched movies/series of a user are scraped when next_scrap_at is due instead
+of every user every 3 minutes. last_rated_at starts as the newest date of the
+user's watched rows, so accounts dormant for long go straight to the slow pace.
+Every mapping starts due.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_14"
+down_revision = "20261018_13"
+branch_labels = None
+depends_on = None
+
+WATCHED_TABLES = ["filmweb_user_watched_movies", "filmweb_user_watched_series"]
+
+
+def _has_column(table: str, column: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    if table not in inspector.get_table_names():
+        # fresh database, create_all() will build the table with the column
+        return True
+    return column in [c["name"] for c in inspector.get_columns(table)]
+
+
+def upgrade():
+    if _has_column("filmweb_user_mapping", "next_scrap_at"):
+        return
+
+    with op.batch_alter_table("filmweb_user_mapping") as batch:
+        batch.add_column(sa.Column("last_rated_at", sa.DateTime(), nullable=True))
+        batch.add_column(sa.Column("next_scrap_at", sa.DateTime(), nullable=True))
+        batch.create_index("ix_filmweb_user_mapping_next_scrap_at", ["next_scrap_at"])
+
+    mapping = sa.table("filmweb_user_mapping", sa.column("filmweb_id"), sa.column("last_rated_at"))
+    for table in WATCHED_TABLES:
+        watched = sa.table(table, sa.column("filmweb_id"), sa.column("date"))
+        newest = (
+            sa.select(sa.func.max(watched.c.date)).where(watched.c.filmweb_id == mapping.c.filmweb_id).scalar_subquery()
+        )
+        op.execute(
+            mapping.update()
+            .where(sa.or_(mapping.c.last_rated_at.is_(None), mapping.c.last_rated_at < newest))
+            .values(last_rated_at=newest)
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("filmweb_user_mapping") as batch:
+        batch.drop_index("ix_filmweb_user_mapping_next_scrap_at")
+        batch.drop_column("next_scrap_at")
+        batch.drop_column("last_rated_at")
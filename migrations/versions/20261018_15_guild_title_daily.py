@@ -0,0 +1,53 @@
+"""Add per guild per title per day rollup
+
+Revision ID: 20261018_15
+Create Date: 2026-10-18
+
+Guild top rated and most watched titles sum this table over the days of
+the period instead of grouping the members' watched history. Existing
+history is not copied here, run POST /stats/rebuild once after upgrading.
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision for alembic
+revision = "20261018_15"
+down_revision = "20261018_14"
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table: str) -> bool:
+    return table in sa.inspect(op.get_bind()).get_table_names()
+
+
+def _counter(name: str) -> sa.Column:
+    return sa.Column(name, sa.Integer(), nullable=False, server_default="0")
+
+
+def upgrade():
+    # fresh database, create_all() will build the table
+    if not _has_table("discord_guilds") or _has_table("discord_guild_title_daily"):
+        return
+
+    op.create_table(
+        "discord_guild_title_daily",
+        sa.Column(
+            "discord_guild_id",
+            sa.BIGINT(),
+            sa.ForeignKey("discord_guilds.discord_guild_id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("media_type", sa.String(16), primary_key=True),
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("id_media", sa.Integer(), primary_key=True),
+        _counter("watched"),
+        _counter("rated"),
+        _counter("rate_sum"),
+        sqlite_with_rowid=False,
+    )
+
+
+def downgrade():
+    op.drop_table("discord_guild_title_daily")
@@ -13,7 +13,8 @@ from filman_crawler.tasks.scrap_movie import Scraper as movie_scrapper
 from filman_crawler.tasks.scrap_series import Scraper as series_scrapper
 from filman_crawler.tasks.scrap_user_watched_movies import Scraper as user_watched_movies_scrapper
 from filman_crawler.tasks.scrap_user_watched_series import Scraper as user_watched_series_scrapper
-from filman_server.database.schemas import Task, TaskTypes
+from filman_crawler.tasks.utils import FilmWeb, Tasks
+from filman_server.database.schemas import Task, TaskStatus, TaskTypes
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "WARNING")
 logging.basicConfig(
@@ -24,6 +25,12 @@ logging.basicConfig(
 
 CORE_ENDPOINT = os.environ.get("CORE_ENDPOINT", "http://localhost:8001")
 
+WORKERS = int(os.environ.get("CRAWLER_WORKERS", "1"))
+LEASE_SIZE = int(os.environ.get("CRAWLER_LEASE_SIZE", "10"))
+LEASE_SECONDS = int(os.environ.get("CRAWLER_LEASE_SECONDS", "600"))
+# the lease request blocks server side up to this long when the queue is empty
+LEASE_WAIT_SECONDS = int(os.environ.get("CRAWLER_LEASE_WAIT_SECONDS", "30"))
+
 HEADERS = {
     "User-Agent": UserAgent().random,
     "x-locale": "pl_PL",
@@ -54,6 +61,12 @@ ALLOWED_TASKS = [
 
 TASK_TYPES = [task for task in ALLOWED_TASKS]
 
+# movie/series refreshes are scraped in parallel and stored with one update_many request per batch
+MEDIA_TASK_TYPES = [
+    TaskTypes.SCRAP_FILMWEB_MOVIE,
+    TaskTypes.SCRAP_FILMWEB_SERIES,
+]
+
 sentry_logging = LoggingIntegration(
     level=logging.WARNING,
     event_level=logging.ERROR,  # Capture info and above as breadcrumbs  # Send errors as events
@@ -64,42 +77,31 @@ if os.environ.get("SENTRY_ENABLED", "false") == "true":
     sentry_sdk.init(dsn=os.environ.get("SENTRY_DSN"), integrations=[sentry_logging])
 
 
-def check_there_are_any_tasks():
-    try:
-        r = requests.head(
-            f"{CORE_ENDPOINT}/tasks/get/to_do",
-            params={"task_types": TASK_TYPES},
-            headers=HEADERS,
-        )
-
-        if r.status_code != 200:
-            return False
-
-        return True
-
-    except Exception as e:
-        logging.error(f"Error checking tasks: {e}")
-        return False
-
-
-def get_task_to_do() -> Task:
+# None when the server can't be reached, an empty list when nothing came in LEASE_WAIT_SECONDS
+def lease_tasks() -> list[Task] | None:
     try:
-        r = requests.get(
-            f"{CORE_ENDPOINT}/tasks/get/to_do",
-            params={"task_types": TASK_TYPES},
+        r = requests.post(
+            f"{CORE_ENDPOINT}/tasks/lease",
+            params={
+                "task_types": TASK_TYPES,
+                "n": LEASE_SIZE,
+                "lease_seconds": LEASE_SECONDS,
+                "wait": LEASE_WAIT_SECONDS,
+            },
             headers=HEADERS,
-            timeout=3,
+            timeout=LEASE_WAIT_SECONDS + 5,
         )
 
         if r.status_code != 200:
+            logging.error(f"Error leasing tasks: {r.status_code}")
             return None
 
-        task = Task(**r.json())
-        logging.info(f"Fetched task: {task}")
-        return task
+        tasks = [Task(**task) for task in r.json()]
+        logging.info(f"Leased {len(tasks)} tasks")
+        return tasks
 
     except Exception as e:
-        logging.error(f"Error getting task to do: {e}")
+        logging.error(f"Error leasing tasks: {e}")
         return None
 
 
@@ -124,6 +126,50 @@ def do_task(task: Task):
         logging.error(f"Unknown task type: {task.task_type}")
 
 
+def do_media_tasks(executor: ThreadPoolExecutor, task_type: TaskTypes, tasks: list[Task]):
+    filmweb = FilmWeb(HEADERS, CORE_ENDPOINT)
+
+    if task_type == TaskTypes.SCRAP_FILMWEB_MOVIE:
+        scraper = movie_scrapper(headers=HEADERS, endpoint_url=CORE_ENDPOINT)
+        update_many = filmweb.update_movies_many
+    else:
+        scraper = series_scrapper(headers=HEADERS, endpoint_url=CORE_ENDPOINT)
+        update_many = filmweb.update_series_many
+
+    # a task that fails to scrape or to be stored stays running, stuck task recovery puts it back in the queue
+    scraped = []
+    for task, future in [(task, executor.submit(scraper.fetch_data, task)) for task in tasks]:
+        try:
+            media = future.result()
+        except Exception as e:
+            logging.error(f"Error scraping {task_type.value} {task.task_job}: {e}")
+            continue
+        if media:
+            scraped.append((task, media))
+
+    if not scraped:
+        return
+
+    try:
+        result = update_many([media for _, media in scraped])
+    except Exception as e:
+        logging.error(f"Error storing {task_type.value} batch: {e}")
+        return
+    if result is None:
+        return
+
+    logging.info(
+        f"{task_type.value}: {result.inserted} inserted, {result.changed} changed, {result.unchanged} unchanged"
+    )
+
+    tasks_updater = Tasks(HEADERS, CORE_ENDPOINT)
+    for task, _ in scraped:
+        try:
+            tasks_updater.update_task_status(task.task_id, TaskStatus.COMPLETED)
+        except Exception as e:
+            logging.error(f"Error updating task {task.task_id}: {e}")
+
+
 def check_connection() -> bool:
     try:
         r = requests.get(CORE_ENDPOINT, headers=HEADERS, timeout=5)
@@ -140,22 +186,33 @@ def main():
 
     wait_time = 2
 
-    with ThreadPoolExecutor(max_workers=1) as executor:
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
         while True:
-            logging.debug("Fetching tasks from endpoint")
-
-            if check_there_are_any_tasks():
-                task = get_task_to_do()
-
-                if task is not None:
-                    executor.submit(do_task, task)
-                else:
-                    logging.info("No tasks to do")
+            logging.debug("Leasing tasks from endpoint")
+
+            tasks = lease_tasks()
+
+            if tasks:
+                for task_type in MEDIA_TASK_TYPES:
+                    media_tasks = [task for task in tasks if task.task_type == task_type]
+                    if media_tasks:
+                        do_media_tasks(executor, task_type, media_tasks)
+
+                # wait for the whole batch, so leases are not piling up in the executor queue
+                # a failed task is only logged, it stays running until stuck task recovery requeues it
+                futures = [
+                    (task, executor.submit(do_task, task)) for task in tasks if task.task_type not in MEDIA_TASK_TYPES
+                ]
+                for task, future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logging.error(f"Error doing task {task.task_id}: {e}")
+            elif tasks is None:
+                time.sleep(wait_time)
             else:
                 logging.info("No tasks to do")
 
-            time.sleep(wait_time)
-
 
 if __name__ == "__main__":
     while not check_connection():
@@ -12,7 +12,7 @@ class Scraper:
         self.endpoint_url = endpoint_url
         self.fetch = Updaters(headers, endpoint_url).fetch
 
-    def scrap(self, task: Task):
+    def fetch_data(self, task: Task) -> FilmWebMovie | None:
         logging.debug(f"Scraping movie data for movie: {task.task_job}")
 
         info_url = f"https://www.filmweb.pl/api/v1/title/{task.task_job}/info"
@@ -30,7 +30,7 @@ class Scraper:
         logging.debug(f"Task id: {task.task_id}")
 
         if info_data is None or rating_data is None:
-            return False
+            return None
 
         try:
             info_data = ujson.loads(info_data)
@@ -50,22 +50,37 @@ class Scraper:
         if title is None or year is None or poster_url is None:
             logging.error(f"Error fetching movie data for movie (title/year/poster_url): {task.task_job}")
             logging.debug(f"Title: {title}, Year: {year}, Poster URL: {poster_url}")
-            return False
+            return None
 
-        update = self.update_data(
-            movie_id=task.task_job,
+        return FilmWebMovie(
+            id=task.task_job,
             title=title,
             year=year,
             poster_url=poster_url,
             community_rate=community_rate,
             critics_rate=critics_rate,
+        )
+
+    def scrap(self, task: Task):
+        movie = self.fetch_data(task)
+
+        if movie is None:
+            return False
+
+        update = self.update_data(
+            movie_id=movie.id,
+            title=movie.title,
+            year=movie.year,
+            poster_url=movie.poster_url,
+            community_rate=movie.community_rate,
+            critics_rate=movie.critics_rate,
             task_id=task.task_id,
         )
 
         if update:
-            logging.info(f"Updated movie {title} ({year})")
+            logging.info(f"Updated movie {movie.title} ({movie.year})")
         else:
-            logging.error(f"Error updating movie {title} ({year})")
+            logging.error(f"Error updating movie {movie.title} ({movie.year})")
 
         logging.debug(f"Scraping movie data for movie: {task.task_job} finished")
 
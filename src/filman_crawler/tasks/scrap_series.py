@@ -12,7 +12,7 @@ class Scraper:
         self.endpoint_url = endpoint_url
         self.fetch = Updaters(headers, endpoint_url).fetch
 
-    def scrap(self, task: Task):
+    def fetch_data(self, task: Task) -> FilmWebSeries | None:
         logging.debug(f"Scraping series data for series: {task.task_job}")
 
         info_url = f"https://www.filmweb.pl/api/v1/title/{task.task_job}/info"
@@ -28,7 +28,7 @@ class Scraper:
         logging.debug(f"Fetched critics data: {critics_data}")
 
         if info_data is None or rating_data is None:
-            return False
+            return None
 
         try:
             info_data = ujson.loads(info_data)
@@ -53,25 +53,39 @@ class Scraper:
         if title is None or year is None or poster_url is None:
             logging.error(f"Error fetching series data for series (title/year/poster_url): {task.task_job}")
             logging.debug(f"Title: {title}, Year: {year}, Poster URL: {poster_url}")
-            return False
+            return None
 
-        logging.debug(f"Updating series data for series: {task.task_job}")
-
-        update = self.update_data(
-            series_id=task.task_job,
+        return FilmWebSeries(
+            id=task.task_job,
             title=title,
             year=year,
             other_year=other_year,
             poster_url=poster_url,
             community_rate=community_rate,
             critics_rate=critics_rate,
+        )
+
+    def scrap(self, task: Task):
+        series = self.fetch_data(task)
+
+        if series is None:
+            return False
+
+        update = self.update_data(
+            series_id=series.id,
+            title=series.title,
+            year=series.year,
+            other_year=series.other_year,
+            poster_url=series.poster_url,
+            community_rate=series.community_rate,
+            critics_rate=series.critics_rate,
             task_id=task.task_id,
         )
 
         if update:
-            logging.info(f"Updated series {title} ({year})")
+            logging.info(f"Updated series {series.title} ({series.year})")
         else:
-            logging.error(f"Error updating series {title} ({year})")
+            logging.error(f"Error updating series {series.title} ({series.year})")
 
         logging.debug(f"Scraping series data for series: {task.task_job} finished")
 
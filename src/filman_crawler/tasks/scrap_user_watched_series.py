@@ -6,9 +6,9 @@ from urllib.parse import quote
 import requests
 import ujson
 
-from filman_server.database.schemas import FilmWebUserWatchedSeriesCreate
+from filman_server.database.schemas import FilmWebUserWatchedSeriesCreate, WatchedUpsertStatus
 
-from .utils import DiscordNotifications, FilmWeb, Task, Tasks, TaskStatus, TaskTypes, Updaters
+from .utils import FilmWeb, Task, Tasks, TaskStatus, TaskTypes, Updaters
 
 
 class Scraper:
@@ -16,7 +16,6 @@ class Scraper:
         self.headers = headers
         self.endpoint_url = endpoint_url
         self.fetch = Updaters(headers, endpoint_url).fetch
-        self._filmweb_user_id_cache: dict[str, int] = {}
 
     def _fetch_filmweb_user_id(self, filmweb_id: str) -> int | None:
         url = f"https://www.filmweb.pl/api/v1/users/{quote(filmweb_id)}/id"
@@ -39,16 +38,13 @@ class Scraper:
             logging.error(f"Error parsing Filmweb user id response for {filmweb_id}: {exc}")
             return None
 
+    # the server stores the userId when the mapping is set, filmweb is asked only for older mappings
     def _resolve_filmweb_user_id(self, filmweb_id: str) -> int | None:
-        if filmweb_id in self._filmweb_user_id_cache:
-            return self._filmweb_user_id_cache[filmweb_id]
+        filmweb_user_id = FilmWeb(self.headers, self.endpoint_url).get_filmweb_user_id(filmweb_id)
+        if filmweb_user_id is not None:
+            return filmweb_user_id
 
-        filmweb_user_id = self._fetch_filmweb_user_id(filmweb_id)
-        if filmweb_user_id is None:
-            return None
-
-        self._filmweb_user_id_cache[filmweb_id] = filmweb_user_id
-        return filmweb_user_id
+        return self._fetch_filmweb_user_id(filmweb_id)
 
     def scrap(self, task: Task):
         logging.info(f"Scraping user watched movies for user: {task.task_job}")
@@ -61,21 +57,7 @@ class Scraper:
             return "Error resolving Filmweb user id"
 
         last_100_watched = f"https://www.filmweb.pl/api/v1/users/{filmweb_user_id}/votes/serial"
-        user_already_watched = f"{self.endpoint_url}/filmweb/user/watched/series/get_all?filmweb_id={task.task_job}"
-
-        try:
-            logging.debug(f"Fetching user already watched series from: {user_already_watched}")
-            user_already_watched_data = self.fetch(user_already_watched, params={"filmweb_id": task.task_job})
-            user_already_watched_data = ujson.loads(user_already_watched_data)
-
-            if user_already_watched is not None or user_already_watched_data != []:
-                user_already_watched_ids = [series["series"]["id"] for series in user_already_watched_data]
-            else:
-                user_already_watched_ids = []
-
-        except Exception as e:
-            logging.error(f"Error fetching user already watched movies: {e}")
-            return "Error fetching user already watched movies"
+        user_watched_diff = f"{self.endpoint_url}/filmweb/user/watched/series/diff"
 
         try:
             logging.debug(f"Fetching last 100 watched series from (filmweb): {last_100_watched}")
@@ -98,27 +80,50 @@ class Scraper:
             logging.error(f"Error fetching last 100 watched series from filmweb: {e}")
             return "Error fetching last 100 watched series from filmweb"
 
-        first_time_scrap = True if user_already_watched_ids == [] else False
-
-        user_already_watched_ids = set(user_already_watched_ids or [])
-
-        series_ids = []
+        diff_items = []
         for vote in votes:
+            timestamp, rate = None, None
             if isinstance(vote, dict) and "id" in vote:
                 vote_id = vote.get("id")
                 if isinstance(vote_id, dict):
                     series_id = vote_id.get("id")
                 else:
                     series_id = vote_id
+                timestamp = vote.get("timestamp")
+                rate = vote.get("rate")
             elif isinstance(vote, (list, tuple)) and len(vote) > 0:
                 series_id = vote[0]
             else:
                 series_id = None
 
             if series_id is not None:
-                series_ids.append(series_id)
+                diff_items.append(
+                    {
+                        "id_media": int(series_id),
+                        "date": (
+                            datetime.datetime.fromtimestamp(timestamp / 1000).isoformat()
+                            if timestamp is not None
+                            else None
+                        ),
+                        "rate": rate,
+                    }
+                )
+
+        # server answers with only the new (or re-rated) ids, not the whole history
+        try:
+            logging.debug(f"Diffing vote list against watched series: {user_watched_diff}")
+            diff_data = self.fetch(
+                user_watched_diff, method="POST", params={"filmweb_id": task.task_job}, json=diff_items
+            )
+            diff_data = ujson.loads(diff_data)
+
+            new_series_watched = diff_data["ids"]
+            first_time_scrap = not diff_data["has_watched"]
+
+        except Exception as e:
+            logging.error(f"Error diffing user watched series: {e}")
+            return "Error diffing user watched series"
 
-        new_series_watched = [series_id for series_id in series_ids if series_id not in user_already_watched_ids]
         new_series_watched_parsed = []
 
         logging.debug(f"Found {len(new_series_watched)} new series watched")
@@ -187,43 +192,32 @@ class Scraper:
 
         filmweb = FilmWeb(self.headers, self.endpoint_url)
         tasks = Tasks(self.headers, self.endpoint_url)
-        dc_notifications = DiscordNotifications(self.headers, self.endpoint_url)
-
-        for series in series_watched:
 
-            try:
-                if filmweb.add_watched_series(series):
-                    if first_time_scrap is False:
-                        if (
-                            dc_notifications.send_notification(
-                                filmweb_id=filmweb_id,
-                                media_type="series",
-                                media_id=series.id_media,
-                            )
-                            is True
-                        ):
-                            logging.info(f"Notification sent for series: {series.id_media}")
-                        else:
-                            logging.error(f"Error sending notification for series: {series.id_media}")
-                            continue
-                else:
-                    logging.error(f"Error adding watched series: {series.id_media}")
-                    continue
-
-                tasks.create_task(
-                    Task(
-                        task_id=0,
-                        task_status=TaskStatus.QUEUED,
-                        task_type=TaskTypes.SCRAP_FILMWEB_SERIES,
-                        task_job=str(series.id_media),
-                        task_created=datetime.datetime.now(),
-                    )
+        # the first scrap of a user is their whole history, nothing is announced
+        results = filmweb.add_watched_series_many(series_watched, notify=not first_time_scrap)
+        if results is None:
+            logging.error(f"Error adding watched series: {filmweb_id}")
+            return False
+
+        # only newly added series are scraped (and announced by the server), updated rates are not
+        created = [result.id_media for result in results if result.status == WatchedUpsertStatus.CREATED]
+
+        new_tasks = []
+
+        for media_id in created:
+            new_tasks.append(
+                Task(
+                    task_id=0,
+                    task_status=TaskStatus.QUEUED,
+                    task_type=TaskTypes.SCRAP_FILMWEB_SERIES,
+                    task_job=str(media_id),
+                    task_created=datetime.datetime.now(),
                 )
+            )
 
-            except Exception as e:
-                logging.error(f"Error updating series data for user: {filmweb_id}")
-                logging.error(e)
-                continue
+        # series scraps go in one request
+        if not tasks.create_tasks(new_tasks):
+            logging.error(f"Error creating tasks for series: {filmweb_id}")
 
         tasks.update_task_status(task_id, TaskStatus.COMPLETED)
 
@@ -1,17 +1,17 @@
-import datetime
 import logging
 
 import requests
 import ujson
 
 from filman_server.database.schemas import (
+    FilmWebMediaUpdateManyResult,
     FilmWebMovie,
     FilmWebSeries,
     FilmWebUserWatchedMovieCreate,
     FilmWebUserWatchedSeriesCreate,
+    FilmWebUserWatchedUpsertResult,
     Task,
     TaskStatus,
-    TaskTypes,
 )
 
 
@@ -70,50 +70,44 @@ class Tasks(Updaters):
 
         return True
 
-    def create_task(self, task: Task):
+    def create_tasks(self, tasks: list[Task]):
+        if not tasks:
+            return True
+
         r = requests.post(
-            f"{self.endpoint_url}/tasks/create",
+            f"{self.endpoint_url}/tasks/create_many",
             headers=self.headers,
-            json={
-                "task_id": task.task_id,
-                "task_status": task.task_status.value,
-                "task_type": task.task_type.value,
-                "task_job": task.task_job,
-                "task_created": task.task_created.isoformat(),
-            },
+            json=[
+                {
+                    "task_status": task.task_status.value,
+                    "task_type": task.task_type.value,
+                    "task_job": task.task_job,
+                }
+                for task in tasks
+            ],
         )
 
         if r.status_code != 200:
-            logging.error(f"Error creating task: HTTP {r.status_code}")
+            logging.error(f"Error creating tasks: HTTP {r.status_code}")
             logging.error(r.text)
             return False
 
-        return True
-
+        logging.debug(f"Created tasks: {r.json()}")
 
-class DiscordNotifications(Updaters):
-    def send_notification(self, filmweb_id: str, media_type: str, media_id: int):
+        return True
 
-        task = Tasks(self.headers, self.endpoint_url)
 
-        task = task.create_task(
-            Task(
-                task_id=0,
-                task_status=TaskStatus.QUEUED,
-                task_type=TaskTypes.SEND_DISCORD_NOTIFICATION,
-                task_job=f"{filmweb_id},{media_type},{media_id}",
-                task_created=datetime.datetime.now(),
-            )
-        )
-
-        if not task:
-            logging.error("Error creating task: SEND_DISCORD_NOTIFICATION")
-            return False
+class FilmWeb(Updaters):
+    # numeric filmweb userId stored on the mapping by the server, None when the server doesn't have it
+    def get_filmweb_user_id(self, filmweb_id: str) -> int | None:
+        data = self.fetch(f"{self.endpoint_url}/filmweb/user/mapping/get", params={"filmweb_id": filmweb_id})
 
-        return True
+        if data is None:
+            return None
 
+        filmweb_user_id = ujson.loads(data).get("filmweb_user_id")
+        return int(filmweb_user_id) if filmweb_user_id is not None else None
 
-class FilmWeb(Updaters):
     def update_series(self, series: FilmWebSeries):
         r = requests.post(
             f"{self.endpoint_url}/filmweb/series/update",
@@ -128,26 +122,47 @@ class FilmWeb(Updaters):
 
         return True
 
-    def add_watched_series(self, info: FilmWebUserWatchedSeriesCreate):
+    def update_series_many(self, items: list[FilmWebSeries]) -> FilmWebMediaUpdateManyResult | None:
+        r = requests.post(
+            f"{self.endpoint_url}/filmweb/series/update_many",
+            headers=self.headers,
+            json=[item.model_dump() for item in items],
+        )
+
+        if r.status_code != 200:
+            logging.error(f"Error updating series data: HTTP {r.status_code}")
+            logging.error(r.text)
+            return None
+
+        return FilmWebMediaUpdateManyResult(**r.json())
+
+    # notify: the server announces the created ones on discord (written with the watched rows)
+    def add_watched_series_many(
+        self, infos: list[FilmWebUserWatchedSeriesCreate], notify: bool = False
+    ) -> list[FilmWebUserWatchedUpsertResult] | None:
         r = requests.post(
-            f"{self.endpoint_url}/filmweb/user/watched/series/add",
+            f"{self.endpoint_url}/filmweb/user/watched/series/add_many",
             headers=self.headers,
-            json={
-                "id_media": int(info.id_media),
-                "filmweb_id": str(info.filmweb_id),
-                "date": info.date.isoformat(),
-                "rate": int(info.rate),
-                "comment": info.comment,
-                "favorite": bool(info.favorite),
-            },
+            params={"notify": notify},
+            json=[
+                {
+                    "id_media": int(info.id_media),
+                    "filmweb_id": str(info.filmweb_id),
+                    "date": info.date.isoformat(),
+                    "rate": int(info.rate),
+                    "comment": info.comment,
+                    "favorite": bool(info.favorite),
+                }
+                for info in infos
+            ],
         )
 
         if r.status_code != 200:
             logging.error(f"Error adding watched series: HTTP {r.status_code}")
             logging.error(r.text)
-            return False
+            return None
 
-        return True
+        return [FilmWebUserWatchedUpsertResult(**result) for result in r.json()]
 
     def update_movie(self, movie: FilmWebMovie):
         r = requests.post(
@@ -163,23 +178,44 @@ class FilmWeb(Updaters):
 
         return True
 
-    def add_watched_movie(self, info: FilmWebUserWatchedMovieCreate):
+    def update_movies_many(self, items: list[FilmWebMovie]) -> FilmWebMediaUpdateManyResult | None:
         r = requests.post(
-            f"{self.endpoint_url}/filmweb/user/watched/movies/add",
+            f"{self.endpoint_url}/filmweb/movie/update_many",
             headers=self.headers,
-            json={
-                "id_media": int(info.id_media),
-                "filmweb_id": str(info.filmweb_id),
-                "date": info.date.isoformat(),
-                "rate": int(info.rate),
-                "comment": info.comment,
-                "favorite": bool(info.favorite),
-            },
+            json=[item.model_dump() for item in items],
         )
 
         if r.status_code != 200:
-            logging.error(f"Error adding watched movie: HTTP {r.status_code}")
+            logging.error(f"Error updating movies data: HTTP {r.status_code}")
             logging.error(r.text)
-            return False
+            return None
 
-        return True
+        return FilmWebMediaUpdateManyResult(**r.json())
+
+    # notify: the server announces the created ones on discord (written with the watched rows)
+    def add_watched_movies_many(
+        self, infos: list[FilmWebUserWatchedMovieCreate], notify: bool = False
+    ) -> list[FilmWebUserWatchedUpsertResult] | None:
+        r = requests.post(
+            f"{self.endpoint_url}/filmweb/user/watched/movies/add_many",
+            headers=self.headers,
+            params={"notify": notify},
+            json=[
+                {
+                    "id_media": int(info.id_media),
+                    "filmweb_id": str(info.filmweb_id),
+                    "date": info.date.isoformat(),
+                    "rate": int(info.rate),
+                    "comment": info.comment,
+                    "favorite": bool(info.favorite),
+                }
+                for info in infos
+            ],
+        )
+
+        if r.status_code != 200:
+            logging.error(f"Error adding watched movies: HTTP {r.status_code}")
+            logging.error(r.text)
+            return None
+
+        return [FilmWebUserWatchedUpsertResult(**result) for result in r.json()]
@@ -1,9 +1,6 @@
 import logging
 from datetime import datetime
 
-import io
-import json
-import csv
 import hikari
 import lightbulb
 
@@ -170,7 +167,7 @@ async def last10_subcommand(
     
     async with ctx.bot.d.client_session.get(
         f"http://filman_server:8000/filmweb/user/watched/{typ}/get_all",
-        params={"discord_id": user.id},
+        params={"discord_id": user.id, "limit": 10},
     ) as resp:
         if not resp.ok:
             await ctx.respond(
@@ -662,7 +659,7 @@ async def export_subcommand(
 
     async with ctx.bot.d.client_session.get(
         "http://filman_server:8000/filmweb/user/watched/export",
-        params={"discord_id": user.id},
+        params={"discord_id": user.id, "format": format},
     ) as resp:
         if not resp.ok:
             if resp.status == 404:
@@ -676,57 +673,16 @@ async def export_subcommand(
 
             return await ctx.edit_last_response(content=f"API zwróciło {resp.status} status :c")
 
-        data = await resp.json()
-
-    if format == "json":
-        json_str = json.dumps(data, indent=2, ensure_ascii=False)
-        file_bytes = io.BytesIO(json_str.encode("utf-8"))
-        filename = f"filman_export_{user.id}.json"
-    else:
-        csv_buffer = io.StringIO()
-        csv_writer = csv.writer(csv_buffer, delimiter=";")
-        csv_writer.writerow([
-            "typ", "id", "tytuł", "rok", "rok_końca", "ocena_użytkownika", 
-            "komentarz", "ulubiony", "data_obejrzenia", "ocena_społeczności", "ocena_krytyków"
-        ])
-
-        for movie in data.get("movies", []):
-            csv_writer.writerow([
-                "film",
-                movie["id"],
-                movie["title"],
-                movie["year"],
-                "",
-                movie["user_rate"],
-                movie["user_comment"] or "",
-                movie["favorite"],
-                movie["date_watched"],
-                movie["community_rate"],
-                movie["critics_rate"],
-            ])
-
-        for series in data.get("series", []):
-            csv_writer.writerow([
-                "serial",
-                series["id"],
-                series["title"],
-                series["year"],
-                series["other_year"] or "",
-                series["user_rate"],
-                series["user_comment"] or "",
-                series["favorite"],
-                series["date_watched"],
-                series["community_rate"],
-                series["critics_rate"],
-            ])
-
-        csv_buffer.seek(0)
-        file_bytes = io.BytesIO(csv_buffer.getvalue().encode("utf-8"))
-        filename = f"filman_export_{user.id}.csv"
+        # server already renders the file, it is forwarded as is
+        file_bytes = await resp.read()
+        total_movies = resp.headers.get("X-Total-Movies", "0")
+        total_series = resp.headers.get("X-Total-Series", "0")
+
+    filename = f"filman_export_{user.id}.{format}"
 
     embed = hikari.Embed(
         title="Eksport zakończony!",
-        description=f"Wyeksportowano **{data['total_movies']}** filmów i **{data['total_series']}** seriali dla {user.mention}",
+        description=f"Wyeksportowano **{total_movies}** filmów i **{total_series}** seriali dla {user.mention}",
         colour=0xFFC200,
         timestamp=datetime.now().astimezone(),
     )
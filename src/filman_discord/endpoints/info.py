@@ -66,6 +66,11 @@ async def info_database_command(ctx: lightbulb.SlashContext) -> None:
         value=f"W bazie danych znajduje się {data['users_count']} użytkowników, wszyscy obejrzeli {data['filmweb_watched_movies']} filmów oraz {data['filmweb_watched_series']} seriali, a w bazie jest zarejestrowanych {data['discord_guilds']} serwerów.",
     )
 
+    embed.add_field(
+        name="Filmweb",
+        value=f"Znanych filmów: {data['filmweb_movies']}, seriali: {data['filmweb_series']}. W kolejce czeka {data['tasks']['queued']} zadań, w trakcie jest {data['tasks']['running']}.",
+    )
+
     embed.set_footer(
         text=f"Requested by {ctx.author}",
         icon=ctx.author.display_avatar_url,
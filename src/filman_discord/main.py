@@ -13,6 +13,9 @@ from filman_discord.utils.star_counter import star_emoji_counter
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 DISCORD_TOKEN = os.environ.get("DISCORD_TOKEN")
+NOTIFICATIONS_BATCH = 20
+# the first read of a run blocks server side up to this long until there is a notification
+NOTIFICATIONS_WAIT_SECONDS = 30
 
 logging.basicConfig(
     level=LOG_LEVEL,
@@ -83,274 +86,173 @@ async def notifications_task(app: lightbulb.BotApp) -> None:
             return star_emoji_counter(rate) + f" **{round(rate, 1)}/10**"
         return f"_brak ocen {rate_type}_"
 
+    # False when discord refused the message (channel gone, no permission, bad request)
     async def send_discord_message(
         app: lightbulb.BotApp,
         channel_id: int,
         embed: hikari.Embed,
         discord_id: int,
-    ) -> None:
+    ) -> bool:
         rest = app.rest
 
         try:
             await rest.create_message(channel_id, embed=embed, user_mentions=discord_id)
+            return True
         except hikari.NotFoundError:
             logging.info(f"Channel {channel_id} not found")
+        except hikari.ForbiddenError as e:
+            logging.error(f"No permission to send message to {channel_id}: {e.message}")
         except hikari.BadRequestError as e:
             logging.error(f"Error sending message: {e.status_code} {e.message}")
+        return False
 
-    async def send_discord_notification_watched(
-        app: lightbulb.BotApp,
-        filmweb_id: int,
-        media_type: str,
-        media_id: int,
-    ) -> None:
-
-        task_id = task["task_id"]
+    async def get_json(url: str, params: dict):
+        async with bot.d.client_session.get(url, params=params) as resp:
+            if not resp.ok:
+                raise RuntimeError(f"{url} {params}: {resp.status} {resp.reason}")
+            return await resp.json()
+
+    # the embed shows the watched row as it was announced (payload), only the title details are read now
+    # raises when the notification was not delivered anywhere, the caller acks it as failed
+    async def send_discord_notification_watched(app: lightbulb.BotApp, notification: dict) -> None:
+        filmweb_id = notification["filmweb_id"]
+        media_type = notification["media_type"]
+        media_id = notification["media_id"]
+        payload = notification["payload"]
+
+        logging.info(f"sending notification for {filmweb_id} {media_type} {media_id}")
+
+        user = await get_json("http://filman_server:8000/users/get", {"filmweb_id": filmweb_id})
+        discord_id = user["discord_id"]
+
+        message_destinations = await get_json(
+            "http://filman_server:8000/users/get_all_channels", {"user_id": user["id"]}
+        )
+        if not message_destinations:
+            logging.info(f"No destinations for {filmweb_id}")
+            return
 
         if media_type == "movie":
-            async with bot.d.client_session.get(
-                f"http://filman_server:8000/filmweb/user/watched/movies/get?filmweb_id={filmweb_id}&movie_id={media_id}"
-            ) as resp2:
-                if not resp2.ok:
-                    return
+            media = await get_json("http://filman_server:8000/filmweb/movie/get", {"id": media_id})
+            title = f"{media['title']} ({media['year']})"
+            colour = 0xFFC200
+            social_rate_parsed_star = parse_movie_rate(media["community_rate"], "społeczności")
+            critcis_rate_parsed_star = parse_movie_rate(media["critics_rate"], "krytyków")
+        else:
+            media = await get_json("http://filman_server:8000/filmweb/series/get", {"id": media_id})
+            title = (
+                f"{media['title']} ({media['year']})"
+                if media["other_year"] is None
+                else f"{media['title']} ({media['year']} - {media['other_year']})"
+            )
+            colour = 0x00FFC3
+            social_rate_parsed_star = parse_series_rate(media["community_rate"], "społeczności")
+            critcis_rate_parsed_star = parse_series_rate(media["critics_rate"], "krytyków")
+
+        # parse data to none-safe
+        date_watched = datetime.datetime.fromisoformat(payload["date"]).astimezone(tz=datetime.timezone.utc)
+        comment = payload["comment"]
+        comment = "\n".join(textwrap.wrap(comment, width=62)) if comment is not None else None
+        media_url = filmweb_movie_url_generator(media["title"], media["year"], media["id"])
+        poster_url = (
+            "https://fwcdn.pl/fpo" + media["poster_url"]
+            if media["poster_url"] is not None
+            else "https://vectorified.com/images/no-data-icon-23.png"
+        )
+
+        rate_parsed_star = parse_rate(payload["rate"])
+        if payload["favorite"]:
+            rate_parsed_star += " :heart:"
+
+        embed1 = hikari.Embed(
+            title=title,
+            description=f"<@{discord_id}>",
+            url=media_url,
+            colour=colour,
+            timestamp=date_watched,
+        )
+        embed1.set_thumbnail(poster_url)
+
+        embed1.add_field(
+            name=f"Ocena `{filmweb_id}`",
+            value=rate_parsed_star,
+            inline=False,
+        )
+
+        if comment:
+            embed1.add_field(
+                name="Komentarz",
+                value=comment,
+                inline=False,
+            )
 
-                logging.info(f"send_discord_notification_watched_movie {filmweb_id} {media_type} {media_id}")
-                logging.info(f"sending notification for {filmweb_id} {media_id}")
-
-                user_id = 0
-                message_destinations = []
-
-                async with bot.d.client_session.get(
-                    f"http://filman_server:8000/users/get?filmweb_id={filmweb_id}"
-                ) as resp:
-                    if not resp.ok:
-                        return
-
-                    user = await resp.json()
-                    user_id = user["id"]
-                    discord_id = user["discord_id"]
-
-                async with bot.d.client_session.get(
-                    f"http://filman_server:8000/users/get_all_channels?user_id={user_id}"
-                ) as resp3:
-                    if not resp3.ok:
-                        return
-
-                    message_destinations = await resp3.json()
-
-                data = await resp2.json()
-
-                movie = data["movie"]
-
-                filmweb_id = data["filmweb_id"]
-                date_watched = data["date"]
-                rate = data["rate"]
-                comment = data["comment"]
-                favorite = data["favorite"]
-
-                # parse data to none-safe
-                date_watched = datetime.datetime.fromisoformat(date_watched).astimezone(tz=datetime.timezone.utc)
-                comment = "\n".join(textwrap.wrap(comment, width=62)) if comment is not None else None
-                movie_url = filmweb_movie_url_generator(movie["title"], movie["year"], movie["id"])
-                movie["poster_url"] = (
-                    "https://fwcdn.pl/fpo" + movie["poster_url"]
-                    if movie["poster_url"] is not None
-                    else "https://vectorified.com/images/no-data-icon-23.png"
-                )
-
-                rate_parsed_star = ""
-
-                rate_parsed_star = parse_rate(rate)
-                social_rate_parsed_star = parse_movie_rate(movie["community_rate"], "społeczności")
-                critcis_rate_parsed_star = parse_movie_rate(movie["critics_rate"], "krytyków")
-
-                embed1 = hikari.Embed(
-                    title=f"{movie['title']} ({movie['year']})",
-                    description=f"<@{discord_id}>",
-                    url=movie_url,
-                    colour=0xFFC200,
-                    timestamp=date_watched,
-                )
-                embed1.set_thumbnail(movie["poster_url"])
-
-                if favorite:
-                    rate_parsed_star += " :heart:"
-
-                embed1.add_field(
-                    name=f"Ocena `{filmweb_id}`",
-                    value=rate_parsed_star,
-                    inline=False,
-                )
-
-                if comment:
-                    embed1.add_field(
-                        name="Komentarz",
-                        value=comment,
-                        inline=False,
-                    )
-
-                embed1.add_field(
-                    name="Ocena społeczności",
-                    value=social_rate_parsed_star,
-                    inline=False,
-                )
-
-                embed1.add_field(
-                    name="Ocena krytyków",
-                    value=critcis_rate_parsed_star,
-                    inline=False,
-                )
-
-                for message_destination in message_destinations:
-                    await send_discord_message(
-                        app,
-                        message_destination,
-                        embed1,
-                        discord_id,
-                    )
-
-        if media_type == "series":
-            async with bot.d.client_session.get(
-                f"http://filman_server:8000/filmweb/user/watched/series/get?filmweb_id={filmweb_id}&series_id={media_id}"
-            ) as resp2:
-                if not resp2.ok:
-                    return
+        embed1.add_field(
+            name="Ocena społeczności",
+            value=social_rate_parsed_star,
+            inline=False,
+        )
+
+        embed1.add_field(
+            name="Ocena krytyków",
+            value=critcis_rate_parsed_star,
+            inline=False,
+        )
+
+        sent = 0
+        for message_destination in message_destinations:
+            sent += await send_discord_message(
+                app,
+                message_destination,
+                embed1,
+                discord_id,
+            )
 
-                logging.info(f"send_discord_notification_watched_series {filmweb_id} {media_type} {media_id}")
-                logging.info(f"sending notification for {filmweb_id} {media_id}")
-
-                user_id = 0
-                message_destinations = []
-
-                async with bot.d.client_session.get(
-                    f"http://filman_server:8000/users/get?filmweb_id={filmweb_id}"
-                ) as resp:
-                    if not resp.ok:
-                        return
-
-                    user = await resp.json()
-                    user_id = user["id"]
-                    discord_id = user["discord_id"]
-
-                async with bot.d.client_session.get(
-                    f"http://filman_server:8000/users/get_all_channels?user_id={user_id}"
-                ) as resp3:
-                    if not resp3.ok:
-                        return
-
-                    message_destinations = await resp3.json()
-
-                data = await resp2.json()
-
-                series = data["series"]
-
-                filmweb_id = data["filmweb_id"]
-                date_watched = data["date"]
-                rate = data["rate"]
-                comment = data["comment"]
-                favorite = data["favorite"]
-
-                # parse data to none-safe
-                date_watched = datetime.datetime.fromisoformat(date_watched).astimezone(tz=datetime.timezone.utc)
-                comment = "\n".join(textwrap.wrap(comment, width=62)) if comment is not None else None
-                series_url = filmweb_movie_url_generator(series["title"], series["year"], series["id"])
-                series["poster_url"] = (
-                    "https://fwcdn.pl/fpo" + series["poster_url"]
-                    if series["poster_url"] is not None
-                    else "https://vectorified.com/images/no-data-icon-23.png"
-                )
-
-                rate_parsed_star = ""
-
-                rate_parsed_star = parse_rate(rate)
-                social_rate_parsed_star = parse_series_rate(series["community_rate"], "społeczności")
-                critcis_rate_parsed_star = parse_series_rate(series["critics_rate"], "krytyków")
-
-                series_title = ""
-                series_title = (
-                    f"{series['title']} ({series['year']})"
-                    if series["other_year"] is None
-                    else f"{series['title']} ({series['year']} - {series['other_year']})"
-                )
-
-                embed1 = hikari.Embed(
-                    title=series_title,
-                    description=f"<@{discord_id}>",
-                    url=series_url,
-                    colour=0x00FFC3,
-                    timestamp=date_watched,
-                )
-                embed1.set_thumbnail(series["poster_url"])
-
-                if favorite:
-                    rate_parsed_star += " :heart:"
-
-                embed1.add_field(
-                    name=f"Ocena `{filmweb_id}`",
-                    value=rate_parsed_star,
-                    inline=False,
-                )
-
-                if comment:
-                    embed1.add_field(
-                        name="Komentarz",
-                        value=comment,
-                        inline=False,
-                    )
-
-                embed1.add_field(
-                    name="Ocena społeczności",
-                    value=social_rate_parsed_star,
-                    inline=False,
-                )
-
-                embed1.add_field(
-                    name="Ocena krytyków",
-                    value=critcis_rate_parsed_star,
-                    inline=False,
-                )
-
-                for message_destination in message_destinations:
-                    await send_discord_message(
-                        app,
-                        message_destination,
-                        embed1,
-                        discord_id,
-                    )
+        # a retry goes to every destination again, so it is only failed when no channel got it
+        if sent == 0:
+            raise RuntimeError(f"not sent to any of {len(message_destinations)} channels")
 
+    # pending notifications oldest first, page by page (after = id of the last one) until the outbox is drained
+    # failed ones are pending again and come back on the next run
+    after = 0
+    while True:
         async with bot.d.client_session.get(
-            f"http://filman_server:8000/tasks/update/status/{task_id}/completed"
+            "http://filman_server:8000/notifications",
+            params={
+                "after": after,
+                "limit": NOTIFICATIONS_BATCH,
+                "wait": NOTIFICATIONS_WAIT_SECONDS if after == 0 else 0,
+            },
         ) as resp:
             if not resp.ok:
-                print(f"Error updating task status: {resp.status} {resp.reason}")
-
-    async with bot.d.client_session.get(
-        "http://filman_server:8000/tasks/get/to_do?task_types=send_discord_notification"
-    ) as resp:
-        if not resp.ok:
-            if resp.status == 404:
-                logging.info("No tasks to do")
+                logging.error(f"Error getting notifications: {resp.status} {resp.reason}")
                 return
 
-            logging.error(f"Error getting tasks: {resp.status} {resp.reason}")
-            return
-
-        task = await resp.json()
+            notifications = await resp.json()
 
-        logging.info(task)
+        ack = {"delivered": [], "failed": []}
+        for notification in notifications:
+            logging.info(
+                f"notification {notification['id']} {notification['filmweb_id']} "
+                f"{notification['media_type']} {notification['media_id']}"
+            )
 
-        if task["task_type"] == "send_discord_notification":  # divide it to other funtion
+            try:
+                await send_discord_notification_watched(bot, notification)
+                ack["delivered"].append(notification["id"])
+            except Exception as e:
+                logging.error(f"Error sending notification {notification['id']}: {e}")
+                ack["failed"].append(notification["id"])
+
+        if notifications:
+            async with bot.d.client_session.post("http://filman_server:8000/notifications/ack", json=ack) as resp:
+                if not resp.ok:
+                    logging.error(f"Error acking notifications: {resp.status} {resp.reason}")
+                    return
 
-            filmweb_id = task["task_job"].split(",")[0]
-            media_type = task["task_job"].split(",")[1]
-            media_id = task["task_job"].split(",")[2]
+        if len(notifications) < NOTIFICATIONS_BATCH:
+            return
 
-            await send_discord_notification_watched(
-                bot,
-                filmweb_id,
-                media_type,
-                media_id,
-            )
+        after = notifications[-1]["id"]
 
 
 bot.load_extensions_from("./endpoints/")
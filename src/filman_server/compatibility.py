@@ -0,0 +1,151 @@
+from typing import NamedTuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from filman_server.database import async_crud, schemas
+from filman_server.similarity import user_compatibility
+
+# taste compatibility of guild members (/stats/guild/compatibility), all pairs of a guild at once
+# a guild's matrices are kept until its members or one of their watched_version change,
+# rates are kept per member and version too, so only members who changed are read again
+
+COMPATIBILITY_CACHE_MAX_SIZE = 1000
+MEMBER_RATES_CACHE_MAX_SIZE = 10000
+
+
+class GuildCompatibility(NamedTuple):
+    members: list[tuple[int, str]]  # (discord_id, filmweb_id), rows and columns of the arrays
+    pearson: np.ndarray
+    cosine: np.ndarray
+    common: np.ndarray
+
+
+# (discord_guild_id, media_type) -> (members with watched_version, matrices)
+compatibility_cache: dict[tuple, tuple[list, GuildCompatibility]] = {}
+# (filmweb_id, media_type) -> (watched_version, id_media, rates)
+member_rates_cache: dict[tuple, tuple[int, np.ndarray, np.ndarray]] = {}
+
+
+async def _get_member_rates(
+    db: AsyncSession,
+    members: list[tuple[int, str, int]],
+    media_type: schemas.MediaType,
+) -> list[tuple[np.ndarray, np.ndarray]]:
+    if len(member_rates_cache) + len(members) > MEMBER_RATES_CACHE_MAX_SIZE:
+        member_rates_cache.clear()
+
+    stale = [
+        filmweb_id
+        for _, filmweb_id, version in members
+        if member_rates_cache.get((filmweb_id, media_type), (None,))[0] != version
+    ]
+
+    if stale:
+        rows = await async_crud.get_filmweb_users_rates(db, stale, media_type)
+        index = {filmweb_id: i for i, filmweb_id in enumerate(stale)}
+        owners = np.fromiter((index[row[0]] for row in rows), np.int64, len(rows))
+        id_media = np.fromiter((row[1] for row in rows), np.int32, len(rows))
+        rates = np.fromiter((row[2] for row in rows), np.int8, len(rows))
+
+        order = np.argsort(owners, kind="stable")
+        bounds = np.searchsorted(owners[order], np.arange(len(stale) + 1))
+
+        versions = {filmweb_id: version for _, filmweb_id, version in members}
+        for i, filmweb_id in enumerate(stale):
+            own = order[bounds[i] : bounds[i + 1]]
+            member_rates_cache[(filmweb_id, media_type)] = (versions[filmweb_id], id_media[own], rates[own])
+
+    return [member_rates_cache[(filmweb_id, media_type)][1:] for _, filmweb_id, _ in members]
+
+
+def _compute(member_rates: list[tuple[np.ndarray, np.ndarray]]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    users = np.repeat(np.arange(len(member_rates)), [len(rates) for _, rates in member_rates])
+    id_media = np.concatenate([np.empty(0, np.int32)] + [ids for ids, _ in member_rates])
+    rates = np.concatenate([np.empty(0, np.int8)] + [rates for _, rates in member_rates])
+    return user_compatibility(users, id_media, rates, len(member_rates))
+
+
+async def get_guild_compatibility(
+    db: AsyncSession,
+    discord_guild_id: int,
+    media_type: schemas.MediaType,
+) -> GuildCompatibility:
+    members = await async_crud.get_guild_members_versions(db, discord_guild_id)
+
+    key = (discord_guild_id, media_type)
+    entry = compatibility_cache.get(key)
+    if entry is not None and entry[0] == members:
+        return entry[1]
+
+    member_rates = await _get_member_rates(db, members, media_type)
+    # numpy releases the GIL in the matrix products, a big guild doesn't block the event loop
+    pearson, cosine, common = await run_in_threadpool(_compute, member_rates)
+
+    compatibility = GuildCompatibility(
+        members=[(discord_id, filmweb_id) for discord_id, filmweb_id, _ in members],
+        pearson=pearson,
+        cosine=cosine,
+        common=common,
+    )
+    if len(compatibility_cache) >= COMPATIBILITY_CACHE_MAX_SIZE:
+        compatibility_cache.clear()
+    compatibility_cache[key] = (members, compatibility)
+    return compatibility
+
+
+def _pairs(
+    compatibility: GuildCompatibility,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    min_common: int,
+    limit: int,
+) -> list[schemas.TasteCompatibility]:
+    pearson = compatibility.pearson[rows, cols]
+    common = compatibility.common[rows, cols]
+
+    keep = (common >= min_common) & ~np.isnan(pearson)
+    rows, cols, pearson, common = rows[keep], cols[keep], pearson[keep], common[keep]
+
+    # most correlated first, more titles in common breaks ties
+    order = np.lexsort((-common, -pearson))[:limit]
+    rows, cols = rows[order], cols[order]
+    cosine = compatibility.cosine[rows, cols]
+
+    return [
+        schemas.TasteCompatibility(
+            discord_id=compatibility.members[i][0],
+            filmweb_id=compatibility.members[i][1],
+            other_discord_id=compatibility.members[j][0],
+            other_filmweb_id=compatibility.members[j][1],
+            common=rated_both,
+            pearson=round(correlation, 4),
+            cosine=round(cosine_similarity, 4),
+        )
+        for i, j, rated_both, correlation, cosine_similarity in zip(
+            rows.tolist(), cols.tolist(), common[order].tolist(), pearson[order].tolist(), cosine.tolist()
+        )
+    ]
+
+
+# every pair of members once, most compatible first
+def top_pairs(compatibility: GuildCompatibility, min_common: int, limit: int) -> list[schemas.TasteCompatibility]:
+    rows, cols = np.triu_indices(len(compatibility.members), 1)
+    return _pairs(compatibility, rows, cols, min_common, limit)
+
+
+# the member's closest taste matches, None when discord_id is not a member of the guild
+def closest_matches(
+    compatibility: GuildCompatibility,
+    discord_id: int,
+    min_common: int,
+    limit: int,
+) -> list[schemas.TasteCompatibility] | None:
+    member = next((i for i, (member_id, _) in enumerate(compatibility.members) if member_id == discord_id), None)
+    if member is None:
+        return None
+
+    cols = np.arange(len(compatibility.members))
+    cols = cols[cols != member]
+    return _pairs(compatibility, np.full(len(cols), member), cols, min_common, limit)
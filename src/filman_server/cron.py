@@ -19,40 +19,51 @@ class Cron:
     def execute_task(url, task_name):
         try:
             response = requests.get(url, timeout=10)
-            logging.info(f"Executed {task_name}: {response.status_code}")
+            logging.info(f"Executed {task_name}: {response.status_code} {response.text}")
         except requests.exceptions.Timeout:
             logging.error(f"Timeout occurred while executing {task_name}")
         except requests.exceptions.RequestException as e:
             logging.error(f"An error occurred while executing {task_name}: {e}")
 
     @staticmethod
-    def tasks_new_scrap_filmweb_users_series():
+    def tasks_refresh_filmweb_series():
         Cron.execute_task(
-            "http://localhost:8000/tasks/new/scrap/filmweb/users/series",
-            "tasks_new_scrap_filmweb_users_series",
+            "http://localhost:8000/tasks/new/refresh/filmweb/series",
+            "tasks_refresh_filmweb_series",
         )
 
     @staticmethod
-    def tasks_new_scrap_filmweb_series():
+    def tasks_refresh_filmweb_movies():
         Cron.execute_task(
-            "http://localhost:8000/tasks/new/scrap/filmweb/series",
-            "tasks_new_scrap_filmweb_series",
+            "http://localhost:8000/tasks/new/refresh/filmweb/movies",
+            "tasks_refresh_filmweb_movies",
         )
 
     @staticmethod
-    def tasks_new_scrap_filmweb_users_movies():
+    def tasks_refresh_filmweb_users():
         Cron.execute_task(
-            "http://localhost:8000/tasks/new/scrap/filmweb/users/movies",
-            "tasks_new_scrap_filmweb_users_movies",
+            "http://localhost:8000/tasks/new/refresh/filmweb/users",
+            "tasks_refresh_filmweb_users",
         )
 
     @staticmethod
-    def tasks_new_scrap_filmweb_movies():
+    def filmweb_revalidate_user_mappings():
         Cron.execute_task(
-            "http://localhost:8000/tasks/new/scrap/filmweb/movies",
-            "tasks_new_scrap_filmweb_movies",
+            "http://localhost:8000/filmweb/user/mapping/revalidate",
+            "filmweb_revalidate_user_mappings",
         )
 
+    @staticmethod
+    def recommend_rebuild_similarities():
+        Cron.execute_task(
+            "http://localhost:8000/recommend/rebuild",
+            "recommend_rebuild_similarities",
+        )
+
+    @staticmethod
+    def notifications_delete_old():
+        Cron.execute_task("http://localhost:8000/notifications/delete/old/7", "notifications_delete_old")
+
     @staticmethod
     def tasks_update_stuck_tasks():
         Cron.execute_task("http://localhost:8000/tasks/update/stuck/5", "tasks_update_stuck_tasks")
@@ -62,13 +73,23 @@ class Cron:
         Cron.execute_task("http://localhost:8000/tasks/update/old/20", "tasks_update_old_tasks")
 
     def schedule_tasks(self):
-        # filmweb series
-        self.schedule.every(3).minutes.do(self.tasks_new_scrap_filmweb_users_series)
-        self.schedule.every(6).hours.do(self.tasks_new_scrap_filmweb_series)
+        # filmweb users watched movies and series (users whose next scrap is due, crud.USER_SCRAP_*)
+        self.schedule.every(1).minutes.do(self.tasks_refresh_filmweb_users)
+
+        # filmweb series (titles only when their refresh is due, crud.MEDIA_REFRESH_PLAN_MINUTES)
+        self.schedule.every(10).minutes.do(self.tasks_refresh_filmweb_series)
 
         # filmweb movies
-        self.schedule.every(3).minutes.do(self.tasks_new_scrap_filmweb_users_movies)
-        self.schedule.every(6).hours.do(self.tasks_new_scrap_filmweb_movies)
+        self.schedule.every(10).minutes.do(self.tasks_refresh_filmweb_movies)
+
+        # filmweb users (renamed accounts, mappings without a stored user id)
+        self.schedule.every(1).hours.do(self.filmweb_revalidate_user_mappings)
+
+        # recommendations (skipped by the server when nothing changed)
+        self.schedule.every(6).hours.do(self.recommend_rebuild_similarities)
+
+        # delivered notifications (the pending ones are kept)
+        self.schedule.every(1).days.do(self.notifications_delete_old)
 
         # tasks mgmt
         self.schedule.every(5).minutes.do(self.tasks_update_stuck_tasks)
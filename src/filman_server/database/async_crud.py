@@ -0,0 +1,815 @@
+import datetime
+import logging
+import os
+
+from sqlalchemy import and_, exists, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, joinedload
+
+import filman_server.database.crud as crud
+import filman_server.database.models as models
+import filman_server.database.schemas as schemas
+from filman_server.database.identity import resolve_identity_async
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# async twins of the crud.py reads used by hot routes (bot notification poll, get_all...)
+# relationships are loaded eagerly, lazy loading is not possible on AsyncSession
+
+#
+# USERS
+#
+
+
+async def get_user(
+    db: AsyncSession,
+    id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+) -> models.User | None:
+    if id:
+        query = select(models.User).where(models.User.id == id)
+    elif filmweb_id:
+        query = (
+            select(models.User)
+            .join(models.FilmWebUserMapping)
+            .where(models.FilmWebUserMapping.filmweb_id == filmweb_id)
+        )
+    elif discord_id:
+        query = select(models.User).where(models.User.discord_id == discord_id)
+    else:
+        return None
+
+    return (await db.scalars(query.limit(1))).first()
+
+
+async def get_user_destinations_channels(
+    db: AsyncSession,
+    user_id: int | None,
+    discord_user_id: int | None,
+) -> list[int]:
+    if user_id is None:
+        user = await get_user(db, None, None, discord_user_id)
+        if user is None:
+            return []
+        user_id = user.id
+
+    query = (
+        select(models.DiscordGuilds.discord_channel_id)
+        .join(
+            models.DiscordDestinations,
+            models.DiscordDestinations.discord_guild_id == models.DiscordGuilds.discord_guild_id,
+        )
+        .where(models.DiscordDestinations.user_id == user_id)
+    )
+    return list(await db.scalars(query))
+
+
+#
+# FILMWEB MOVIES / SERIES
+#
+
+
+async def get_movie_filmweb_id(db: AsyncSession, id: int) -> models.FilmWebMovie | None:
+    return await db.get(models.FilmWebMovie, id)
+
+
+async def get_series_filmweb_id(db: AsyncSession, id: int) -> models.FilmWebSeries | None:
+    return await db.get(models.FilmWebSeries, id)
+
+
+#
+# FILMWEB USER MAPPING
+#
+
+
+async def get_filmweb_user_mapping(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+) -> models.FilmWebUserMapping | None:
+    identity = await resolve_identity_async(db, user_id, filmweb_id, discord_id)
+
+    if identity is None:
+        return None
+
+    query = select(models.FilmWebUserMapping).where(models.FilmWebUserMapping.user_id == identity.user_id)
+    return (await db.scalars(query.limit(1))).first()
+
+
+async def _resolve_filmweb_id(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+) -> str | None:
+    identity = await resolve_identity_async(db, user_id, filmweb_id, discord_id)
+
+    if identity is None:
+        return None
+
+    return filmweb_id or identity.filmweb_id
+
+
+# (mapping id, watched_version) for ETags, one lookup on the mapping and no watched table reads
+async def get_filmweb_user_watched_version(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+) -> tuple[int, int] | None:
+    identity = await resolve_identity_async(db, user_id, filmweb_id, discord_id)
+
+    if identity is None:
+        return None
+
+    query = select(models.FilmWebUserMapping.id, models.FilmWebUserMapping.watched_version).where(
+        models.FilmWebUserMapping.user_id == identity.user_id
+    )
+    return (await db.execute(query)).first()
+
+
+#
+# FILMWEB WATCHED
+#
+
+
+# cursor date of a row without a date, such rows sort as the oldest (last newest first, first oldest first)
+WATCHED_NULL_DATE = datetime.datetime(1, 1, 1)
+
+
+# keyset pagination over the (filmweb_id, date, id_media) index, newest first by default
+# the cursor is (date, id_media) of the last row of the previous page, both or none of them
+# NULL dates are the lowest in the index on sqlite and mariadb alike, WATCHED_NULL_DATE stands for them
+def _paginate_watched(
+    query,
+    model,
+    after_date: datetime.datetime | None,
+    after_id: int | None,
+    limit: int | None,
+    order: schemas.WatchedOrder,
+):
+    desc = order == schemas.WatchedOrder.DESC
+
+    if (after_date is None) != (after_id is None):
+        raise ValueError("after_date and after_id go together")
+
+    if after_date is not None:
+        no_date = model.date.is_(None)
+        if after_date == WATCHED_NULL_DATE:
+            same_date = no_date
+            after = None if desc else model.date.is_not(None)
+        elif desc:
+            same_date = model.date == after_date
+            after = or_(model.date < after_date, no_date)
+        else:
+            same_date = model.date == after_date
+            after = model.date > after_date
+
+        same_date_after = and_(same_date, model.id_media < after_id if desc else model.id_media > after_id)
+        query = query.where(same_date_after if after is None else or_(after, same_date_after))
+
+    if desc:
+        query = query.order_by(model.date.desc(), model.id_media.desc())
+    else:
+        query = query.order_by(model.date, model.id_media)
+
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query
+
+
+async def get_filmweb_user_watched_movie(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    id_media: int,
+) -> models.FilmWebUserWatchedMovie | None:
+    filmweb_id = await _resolve_filmweb_id(db, user_id, filmweb_id, discord_id)
+
+    if filmweb_id is None:
+        return None
+
+    query = (
+        select(models.FilmWebUserWatchedMovie)
+        .options(joinedload(models.FilmWebUserWatchedMovie.movie))
+        .where(
+            models.FilmWebUserWatchedMovie.filmweb_id == filmweb_id,
+            models.FilmWebUserWatchedMovie.id_media == id_media,
+        )
+    )
+    return (await db.scalars(query.limit(1))).first()
+
+
+async def get_filmweb_user_watched_movies(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    after_date: datetime.datetime | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+    order: schemas.WatchedOrder = schemas.WatchedOrder.DESC,
+) -> list[models.FilmWebUserWatchedMovie] | None:
+    filmweb_id = await _resolve_filmweb_id(db, user_id, filmweb_id, discord_id)
+
+    if filmweb_id is None:
+        return None
+
+    query = (
+        select(models.FilmWebUserWatchedMovie)
+        .options(joinedload(models.FilmWebUserWatchedMovie.movie))
+        .where(models.FilmWebUserWatchedMovie.filmweb_id == filmweb_id)
+    )
+    query = _paginate_watched(query, models.FilmWebUserWatchedMovie, after_date, after_id, limit, order)
+    return list(await db.scalars(query))
+
+
+async def get_filmweb_user_watched_series(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    id_media: int,
+) -> models.FilmWebUserWatchedSeries | None:
+    filmweb_id = await _resolve_filmweb_id(db, user_id, filmweb_id, discord_id)
+
+    if filmweb_id is None:
+        return None
+
+    query = (
+        select(models.FilmWebUserWatchedSeries)
+        .options(joinedload(models.FilmWebUserWatchedSeries.series))
+        .where(
+            models.FilmWebUserWatchedSeries.filmweb_id == filmweb_id,
+            models.FilmWebUserWatchedSeries.id_media == id_media,
+        )
+    )
+    return (await db.scalars(query.limit(1))).first()
+
+
+async def get_filmweb_user_watched_series_all(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    after_date: datetime.datetime | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+    order: schemas.WatchedOrder = schemas.WatchedOrder.DESC,
+) -> list[models.FilmWebUserWatchedSeries] | None:
+    filmweb_id = await _resolve_filmweb_id(db, user_id, filmweb_id, discord_id)
+
+    if filmweb_id is None:
+        return None
+
+    query = (
+        select(models.FilmWebUserWatchedSeries)
+        .options(joinedload(models.FilmWebUserWatchedSeries.series))
+        .where(models.FilmWebUserWatchedSeries.filmweb_id == filmweb_id)
+    )
+    query = _paginate_watched(query, models.FilmWebUserWatchedSeries, after_date, after_id, limit, order)
+    return list(await db.scalars(query))
+
+
+# fast path for the big get_all lists: only the needed columns, rows as plain dicts
+# same shape as schemas.FilmWebUserWatchedMovie/Series, no ORM objects or pydantic models per row
+WATCHED_FIELDS = ("filmweb_id", "date", "rate", "comment", "favorite")
+MOVIE_FIELDS = ("id", "title", "year", "poster_url", "community_rate", "critics_rate")
+SERIES_FIELDS = ("id", "title", "year", "other_year", "poster_url", "community_rate", "critics_rate")
+
+
+async def _get_filmweb_user_watched_rows(
+    db: AsyncSession,
+    model,
+    media_model,
+    media_key: str,
+    media_fields: tuple[str, ...],
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    after_date: datetime.datetime | None,
+    after_id: int | None,
+    limit: int | None,
+    order: schemas.WatchedOrder,
+) -> list[dict] | None:
+    filmweb_id = await _resolve_filmweb_id(db, user_id, filmweb_id, discord_id)
+
+    if filmweb_id is None:
+        return None
+
+    query = (
+        select(
+            *[getattr(media_model, field) for field in media_fields],
+            *[getattr(model, field) for field in WATCHED_FIELDS],
+        )
+        .join(media_model, media_model.id == model.id_media)
+        .where(model.filmweb_id == filmweb_id)
+    )
+    query = _paginate_watched(query, model, after_date, after_id, limit, order)
+
+    split = len(media_fields)
+    return [
+        {media_key: dict(zip(media_fields, row[:split])), **dict(zip(WATCHED_FIELDS, row[split:]))}
+        for row in await db.execute(query)
+    ]
+
+
+async def get_filmweb_user_watched_movies_rows(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    after_date: datetime.datetime | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+    order: schemas.WatchedOrder = schemas.WatchedOrder.DESC,
+) -> list[dict] | None:
+    return await _get_filmweb_user_watched_rows(
+        db,
+        models.FilmWebUserWatchedMovie,
+        models.FilmWebMovie,
+        "movie",
+        MOVIE_FIELDS,
+        user_id,
+        filmweb_id,
+        discord_id,
+        after_date,
+        after_id,
+        limit,
+        order,
+    )
+
+
+async def get_filmweb_user_watched_series_rows(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    after_date: datetime.datetime | None = None,
+    after_id: int | None = None,
+    limit: int | None = None,
+    order: schemas.WatchedOrder = schemas.WatchedOrder.DESC,
+) -> list[dict] | None:
+    return await _get_filmweb_user_watched_rows(
+        db,
+        models.FilmWebUserWatchedSeries,
+        models.FilmWebSeries,
+        "series",
+        SERIES_FIELDS,
+        user_id,
+        filmweb_id,
+        discord_id,
+        after_date,
+        after_id,
+        limit,
+        order,
+    )
+
+
+# ids only, answered from the (filmweb_id, id_media, rate) covering index
+async def _get_filmweb_user_watched_ids(
+    db: AsyncSession,
+    model,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    with_rate: bool,
+) -> list[int] | list[tuple[int, int | None]] | None:
+    filmweb_id = await _resolve_filmweb_id(db, user_id, filmweb_id, discord_id)
+
+    if filmweb_id is None:
+        return None
+
+    if with_rate:
+        query = select(model.id_media, model.rate).where(model.filmweb_id == filmweb_id).order_by(model.id_media)
+        return [tuple(row) for row in await db.execute(query)]
+
+    query = select(model.id_media).where(model.filmweb_id == filmweb_id).order_by(model.id_media)
+    return list(await db.scalars(query))
+
+
+async def get_filmweb_user_watched_movies_ids(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    with_rate: bool = False,
+) -> list[int] | list[tuple[int, int | None]] | None:
+    return await _get_filmweb_user_watched_ids(
+        db, models.FilmWebUserWatchedMovie, user_id, filmweb_id, discord_id, with_rate
+    )
+
+
+async def get_filmweb_user_watched_series_ids(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    with_rate: bool = False,
+) -> list[int] | list[tuple[int, int | None]] | None:
+    return await _get_filmweb_user_watched_ids(
+        db, models.FilmWebUserWatchedSeries, user_id, filmweb_id, discord_id, with_rate
+    )
+
+
+# which of the sent votes are new or changed, one IN lookup on the primary key
+# a sent date/rate of None means "don't compare", dates are compared to the second (MariaDB DATETIME)
+# like the bulk upsert does, a stored date of None differs from any sent one
+async def _diff_filmweb_user_watched(
+    db: AsyncSession,
+    model,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    items: list[schemas.FilmWebUserWatchedDiffItem],
+) -> schemas.FilmWebUserWatchedDiffResult | None:
+    filmweb_id = await _resolve_filmweb_id(db, user_id, filmweb_id, discord_id)
+
+    if filmweb_id is None:
+        return None
+
+    has_watched = bool(await db.scalar(select(exists().where(model.filmweb_id == filmweb_id))))
+
+    ids = list(dict.fromkeys(item.id_media for item in items))
+    known = {}
+    if ids and has_watched:
+        query = select(model.id_media, model.date, model.rate).where(
+            model.filmweb_id == filmweb_id,
+            model.id_media.in_(ids),
+        )
+        known = {row.id_media: row for row in await db.execute(query)}
+
+    changed = []
+    for item in items:
+        row = known.get(item.id_media)
+
+        if row is None:
+            changed.append(item.id_media)
+        elif item.date is not None and (row.date is None or not crud._same_value(row.date, item.date)):
+            changed.append(item.id_media)
+        elif item.rate is not None and item.rate != row.rate:
+            changed.append(item.id_media)
+
+    return schemas.FilmWebUserWatchedDiffResult(ids=list(dict.fromkeys(changed)), has_watched=has_watched)
+
+
+async def diff_filmweb_user_watched_movies(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    items: list[schemas.FilmWebUserWatchedDiffItem],
+) -> schemas.FilmWebUserWatchedDiffResult | None:
+    return await _diff_filmweb_user_watched(db, models.FilmWebUserWatchedMovie, user_id, filmweb_id, discord_id, items)
+
+
+async def diff_filmweb_user_watched_series(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    items: list[schemas.FilmWebUserWatchedDiffItem],
+) -> schemas.FilmWebUserWatchedDiffResult | None:
+    return await _diff_filmweb_user_watched(db, models.FilmWebUserWatchedSeries, user_id, filmweb_id, discord_id, items)
+
+
+#
+# STATS
+#
+
+
+def _media_stats(row: models.FilmWebUserStats | None, months: list) -> schemas.FilmWebUserMediaStats:
+    if row is None:
+        return schemas.FilmWebUserMediaStats()
+
+    return schemas.FilmWebUserMediaStats(
+        watched=row.watched,
+        rated=row.rated,
+        average_rate=round(row.rate_sum / row.rated, 2) if row.rated else None,
+        rate_histogram=[getattr(row, f"rate_{rate}") for rate in range(1, 11)],
+        favorites=row.favorites,
+        first_watched=row.first_watched,
+        last_watched=row.last_watched,
+        months=[schemas.FilmWebUserStatsMonth(month=month.month, watched=month.watched) for month in months],
+    )
+
+
+# precomputed by crud.py STATS, two reads on the primary keys and no watched table scan
+async def get_filmweb_user_stats(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+) -> schemas.FilmWebUserStats | None:
+    filmweb_id = await _resolve_filmweb_id(db, user_id, filmweb_id, discord_id)
+
+    if filmweb_id is None:
+        return None
+
+    stats = {
+        row.media_type: row
+        for row in await db.scalars(
+            select(models.FilmWebUserStats).where(models.FilmWebUserStats.filmweb_id == filmweb_id)
+        )
+    }
+
+    months = {media_type: [] for media_type in schemas.MediaType}
+    query = (
+        select(models.FilmWebUserStatsMonthly)
+        .where(models.FilmWebUserStatsMonthly.filmweb_id == filmweb_id)
+        .order_by(models.FilmWebUserStatsMonthly.media_type, models.FilmWebUserStatsMonthly.month)
+    )
+    for month in await db.scalars(query):
+        months[schemas.MediaType(month.media_type)].append(month)
+
+    return schemas.FilmWebUserStats(
+        filmweb_id=filmweb_id,
+        movies=_media_stats(stats.get(schemas.MediaType.MOVIE.value), months[schemas.MediaType.MOVIE]),
+        series=_media_stats(stats.get(schemas.MediaType.SERIES.value), months[schemas.MediaType.SERIES]),
+    )
+
+
+# GUILD STATS
+# members are discord destinations with a filmweb mapping, rollups are summed over them
+
+STATS_PERIOD_DAYS = {
+    schemas.StatsPeriod.WEEK: 7,
+    schemas.StatsPeriod.MONTH: 30,
+    schemas.StatsPeriod.YEAR: 365,
+}
+GUILD_TITLES_MEDIA = {
+    schemas.MediaType.MOVIE: (models.FilmWebUserWatchedMovie, models.FilmWebMovie),
+    schemas.MediaType.SERIES: (models.FilmWebUserWatchedSeries, models.FilmWebSeries),
+}
+
+
+def _period_start(period: schemas.StatsPeriod) -> datetime.date:
+    return datetime.date.today() - datetime.timedelta(days=STATS_PERIOD_DAYS[period] - 1)
+
+
+def _guild_members(discord_guild_id: int):
+    return (
+        select(models.FilmWebUserMapping.filmweb_id)
+        .join(models.DiscordDestinations, models.DiscordDestinations.user_id == models.FilmWebUserMapping.user_id)
+        .where(models.DiscordDestinations.discord_guild_id == discord_guild_id)
+    )
+
+
+def _average_rate(rate_sum, rated) -> float | None:
+    return round(rate_sum / rated, 2) if rated else None
+
+
+# id -> (id, title, year, poster_url) of the listed titles
+async def _get_media_rows(db: AsyncSession, media_model, ids: list[int]) -> dict:
+    query = select(media_model.id, media_model.title, media_model.year, media_model.poster_url).where(
+        media_model.id.in_(ids)
+    )
+    return {row.id: row for row in await db.execute(query)}
+
+
+# members ordered by rates given in the period, then by watched
+async def get_guild_raters(
+    db: AsyncSession,
+    discord_guild_id: int,
+    period: schemas.StatsPeriod,
+    media_type: schemas.MediaType | None,
+    limit: int,
+) -> list[schemas.GuildRater]:
+    daily = models.FilmWebUserActivityDaily
+    watched = func.sum(daily.watched)
+    rated = func.sum(daily.rated)
+
+    query = (
+        select(models.User.discord_id, daily.filmweb_id, watched, rated, func.sum(daily.rate_sum))
+        .join(models.FilmWebUserMapping, models.FilmWebUserMapping.filmweb_id == daily.filmweb_id)
+        .join(models.User, models.User.id == models.FilmWebUserMapping.user_id)
+        .join(models.DiscordDestinations, models.DiscordDestinations.user_id == models.User.id)
+        .where(
+            models.DiscordDestinations.discord_guild_id == discord_guild_id,
+            daily.day >= _period_start(period),
+        )
+        .group_by(models.User.discord_id, daily.filmweb_id)
+        .order_by(rated.desc(), watched.desc(), daily.filmweb_id)
+        .limit(limit)
+    )
+    if media_type is not None:
+        query = query.where(daily.media_type == media_type.value)
+
+    return [
+        schemas.GuildRater(
+            discord_id=discord_id,
+            filmweb_id=filmweb_id,
+            watched=watched,
+            rated=rated,
+            average_rate=_average_rate(rate_sum, rated),
+        )
+        for discord_id, filmweb_id, watched, rated, rate_sum in (await db.execute(query)).all()
+    ]
+
+
+# titles watched by members in the period, summed from the guild's per title daily counters: one key range
+# top_rated orders by the members' average rate (titles with at least min_rates rates), else by watched count
+async def get_guild_titles(
+    db: AsyncSession,
+    discord_guild_id: int,
+    period: schemas.StatsPeriod,
+    media_type: schemas.MediaType,
+    top_rated: bool,
+    min_rates: int,
+    limit: int,
+) -> list[schemas.GuildTitle]:
+    _, media_model = GUILD_TITLES_MEDIA[media_type]
+    daily = models.DiscordGuildTitleDaily
+
+    watched = func.sum(daily.watched)
+    rated = func.sum(daily.rated)
+    rate_sum = func.sum(daily.rate_sum)
+
+    query = (
+        select(daily.id_media, watched.label("watched"), rated.label("rated"), rate_sum.label("rate_sum"))
+        .where(
+            daily.discord_guild_id == discord_guild_id,
+            daily.media_type == media_type.value,
+            daily.day >= _period_start(period),
+        )
+        .group_by(daily.id_media)
+    )
+    if top_rated:
+        query = query.having(rated >= min_rates).order_by((rate_sum * 1.0 / rated).desc(), rated.desc())
+    else:
+        query = query.order_by(watched.desc(), rated.desc())
+    rows = (await db.execute(query.order_by(daily.id_media).limit(limit))).all()
+    media = await _get_media_rows(db, media_model, [row.id_media for row in rows])
+
+    titles = []
+    for row in rows:
+        title = media.get(row.id_media)
+        titles.append(
+            schemas.GuildTitle(
+                id_media=row.id_media,
+                title=title.title if title is not None else None,
+                year=title.year if title is not None else None,
+                poster_url=title.poster_url if title is not None else None,
+                watched=row.watched,
+                rated=row.rated,
+                average_rate=_average_rate(row.rate_sum, row.rated),
+            )
+        )
+    return titles
+
+
+# watched and rated per day by all members, days without activity are left out
+async def get_guild_activity(
+    db: AsyncSession,
+    discord_guild_id: int,
+    period: schemas.StatsPeriod,
+    media_type: schemas.MediaType | None,
+) -> list[schemas.GuildActivityDay]:
+    daily = models.FilmWebUserActivityDaily
+
+    query = (
+        select(daily.day, func.sum(daily.watched), func.sum(daily.rated))
+        .where(
+            daily.filmweb_id.in_(_guild_members(discord_guild_id)),
+            daily.day >= _period_start(period),
+        )
+        .group_by(daily.day)
+        .order_by(daily.day)
+    )
+    if media_type is not None:
+        query = query.where(daily.media_type == media_type.value)
+
+    return [
+        schemas.GuildActivityDay(day=day, watched=watched, rated=rated)
+        for day, watched, rated in (await db.execute(query)).all()
+    ]
+
+
+# (discord_id, filmweb_id, watched_version) of every member, together the version of the guild's watched data
+async def get_guild_members_versions(db: AsyncSession, discord_guild_id: int) -> list[tuple[int, str, int]]:
+    query = (
+        select(models.User.discord_id, models.FilmWebUserMapping.filmweb_id, models.FilmWebUserMapping.watched_version)
+        .join(models.FilmWebUserMapping, models.FilmWebUserMapping.user_id == models.User.id)
+        .join(models.DiscordDestinations, models.DiscordDestinations.user_id == models.User.id)
+        .where(models.DiscordDestinations.discord_guild_id == discord_guild_id)
+        .order_by(models.FilmWebUserMapping.filmweb_id)
+    )
+    return [tuple(row) for row in await db.execute(query)]
+
+
+# (filmweb_id, id_media, rate) of every rate of the listed users
+# a whole guild is a lot of rows, read as Core rows on the (filmweb_id, id_media, rate) index
+async def get_filmweb_users_rates(
+    db: AsyncSession,
+    filmweb_ids: list[str],
+    media_type: schemas.MediaType,
+) -> list[tuple[str, int, int]]:
+    watched_model, _ = GUILD_TITLES_MEDIA[media_type]
+    connection = await db.connection()
+
+    rates = []
+    for chunk in crud._chunks(filmweb_ids):
+        query = select(watched_model.filmweb_id, watched_model.id_media, watched_model.rate).where(
+            watched_model.filmweb_id.in_(chunk),
+            watched_model.rate >= 1,
+            watched_model.rate <= 10,
+        )
+        rates.extend(await connection.execute(query))
+    return rates
+
+
+#
+# RECOMMEND
+#
+
+
+# the user's average rate from the stats counters, None when nothing is rated
+async def get_filmweb_user_mean_rate(
+    db: AsyncSession,
+    filmweb_id: str,
+    media_type: schemas.MediaType,
+) -> float | None:
+    stats = models.FilmWebUserStats
+    query = select(stats.rated, stats.rate_sum).where(
+        stats.filmweb_id == filmweb_id, stats.media_type == media_type.value
+    )
+    row = (await db.execute(query)).first()
+    if row is None or not row.rated:
+        return None
+    return row.rate_sum / row.rated
+
+
+# (id_similar, sum of similarity * rate, sum of similarity) over the stored neighbours of every title
+# the user rated, titles the user watched are left out
+# best `limit` by (weighted sum + mean_rate) / (weight + 1), a title few rated neighbours point to
+# is pulled towards the user's mean
+async def get_filmweb_user_recommend_candidates(
+    db: AsyncSession,
+    filmweb_id: str,
+    media_type: schemas.MediaType,
+    mean_rate: float,
+    limit: int,
+) -> list[tuple[int, float, float]]:
+    watched_model, _ = GUILD_TITLES_MEDIA[media_type]
+    similarity = models.FilmWebMediaSimilarity
+    seen = aliased(watched_model)
+
+    weighted_sum = func.sum(similarity.similarity * watched_model.rate)
+    weight = func.sum(similarity.similarity)
+    query = (
+        select(similarity.id_similar, weighted_sum, weight)
+        .select_from(watched_model)
+        .join(
+            similarity,
+            and_(similarity.media_type == media_type.value, similarity.id_media == watched_model.id_media),
+        )
+        .where(
+            watched_model.filmweb_id == filmweb_id,
+            watched_model.rate >= 1,
+            watched_model.rate <= 10,
+            ~exists().where(seen.filmweb_id == filmweb_id, seen.id_media == similarity.id_similar),
+        )
+        .group_by(similarity.id_similar)
+        .order_by(((weighted_sum + mean_rate) / (weight + 1)).desc(), similarity.id_similar)
+        .limit(limit)
+    )
+    return [tuple(row) for row in await db.execute(query)]
+
+
+# id -> (rated, rate_sum) of the listed titles by guild members other than filmweb_id
+# read per title on the (id_media, filmweb_id) primary key
+async def get_guild_rates(
+    db: AsyncSession,
+    discord_guild_id: int,
+    media_type: schemas.MediaType,
+    ids: list[int],
+    exclude_filmweb_id: str,
+) -> dict[int, tuple[int, int]]:
+    watched_model, _ = GUILD_TITLES_MEDIA[media_type]
+
+    rates = {}
+    for chunk in crud._chunks(ids):
+        query = (
+            select(watched_model.id_media, func.count(), func.sum(watched_model.rate))
+            .where(
+                watched_model.id_media.in_(chunk),
+                watched_model.filmweb_id.in_(_guild_members(discord_guild_id)),
+                watched_model.filmweb_id != exclude_filmweb_id,
+                watched_model.rate >= 1,
+                watched_model.rate <= 10,
+            )
+            .group_by(watched_model.id_media)
+        )
+        for id_media, rated, rate_sum in await db.execute(query):
+            rates[id_media] = (rated, rate_sum)
+    return rates
+
+
+async def get_media_rows(db: AsyncSession, media_type: schemas.MediaType, ids: list[int]) -> dict:
+    _, media_model = GUILD_TITLES_MEDIA[media_type]
+    return await _get_media_rows(db, media_model, ids)
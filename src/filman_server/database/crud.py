@@ -1,18 +1,169 @@
 import logging
+import math
 import os
+import threading
+from collections import deque
 from datetime import datetime, timedelta
-
+from functools import cache
+
+from sqlalchemy import (
+    DateTime,
+    String,
+    and_,
+    bindparam,
+    case,
+    cast,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    literal_column,
+    or_,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects import mysql, sqlite
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from . import models, schemas
+from .identity import identity_cache, resolve_identity
+from .wakeup import NOTIFICATIONS_TOPIC, wake
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
 #
-# USERS
+# HELPERS
 #
 
-LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
-logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+# keeps IN (...) lists and multi row inserts at a sane size
+CHUNK_SIZE = 500
+
+
+def _chunks(items: list, size: int = CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+# datetimes are stored naive in local time, a client may send an aware one ("...Z")
+def _naive_local(value: datetime) -> datetime:
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo is not None else value
+
+
+def _is_mysql(db: Session) -> bool:
+    return db.get_bind().dialect.name in ("mysql", "mariadb")
+
+
+# INSERT that silently skips rows violating a unique/primary key
+def _insert_ignore_stmt(db: Session, model):
+    if _is_mysql(db):
+        return mysql.insert(model).prefix_with("IGNORE")
+    return sqlite.insert(model).on_conflict_do_nothing()
+
+
+# returns number of inserted rows
+def _insert_ignore(db: Session, model, rows: list[dict]) -> int:
+    if not rows:
+        return 0
+
+    stmt = _insert_ignore_stmt(db, model)
+
+    inserted = 0
+    for chunk in _chunks(rows):
+        result = db.connection().execute(stmt, chunk)
+        inserted += result.rowcount if result.rowcount >= 0 else len(chunk)
+
+    return inserted
+
+
+# INSERT ... ON DUPLICATE KEY UPDATE / ON CONFLICT DO UPDATE on the primary key
+def _upsert(db: Session, model, rows: list[dict], update_columns: list[str]):
+    if not rows:
+        return
+
+    if _is_mysql(db):
+        stmt = mysql.insert(model)
+        stmt = stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in update_columns})
+    else:
+        stmt = sqlite.insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[column.name for column in model.__table__.primary_key],
+            set_={column: stmt.excluded[column] for column in update_columns},
+        )
+
+    for chunk in _chunks(rows):
+        db.connection().execute(stmt, chunk)
+
+
+# same as _upsert, but an existing row gets the values added to its columns (counters)
+def _upsert_add(db: Session, model, rows: list[dict], add_columns: list[str]):
+    if not rows:
+        return
+
+    table = model.__table__
+
+    if _is_mysql(db):
+        stmt = mysql.insert(model)
+        stmt = stmt.on_duplicate_key_update({column: table.c[column] + stmt.inserted[column] for column in add_columns})
+    else:
+        stmt = sqlite.insert(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[column.name for column in table.primary_key],
+            set_={column: table.c[column] + stmt.excluded[column] for column in add_columns},
+        )
+
+    for chunk in _chunks(rows):
+        db.connection().execute(stmt, chunk)
+
+
+# (SELECT of existing keys, UPDATE adding to counters) of a model, built once
+@cache
+def _add_counters_stmts(model, add_columns: tuple[str, ...]):
+    table = model.__table__
+    keys = [column.name for column in table.primary_key]
+
+    select_stmt = select(*[table.c[key] for key in keys]).where(
+        tuple_(*[table.c[key] for key in keys]).in_(bindparam("keys", expanding=True))
+    )
+    update_stmt = (
+        update(table)
+        .where(*[table.c[key] == bindparam(f"key_{key}") for key in keys])
+        .values({column: table.c[column] + bindparam(f"add_{column}") for column in add_columns})
+    )
+    return keys, select_stmt, update_stmt
+
+
+# adds to counters: one executemany UPDATE for the rows that exist, _upsert_add only for the new ones
+# dialect upserts are compiled again on every call, the plain SELECT/UPDATE come from the statement cache
+def _add_counters(db: Session, model, rows: list[dict], add_columns: list[str]):
+    if not rows:
+        return
+
+    keys, select_stmt, update_stmt = _add_counters_stmts(model, tuple(add_columns))
+    row_keys = [tuple(row[key] for key in keys) for row in rows]
+
+    existing = set()
+    for chunk in _chunks(row_keys):
+        existing.update(tuple(row) for row in db.connection().execute(select_stmt, {"keys": chunk}))
+
+    params = [
+        {f"key_{key}": row[key] for key in keys} | {f"add_{column}": row[column] for column in add_columns}
+        for row, row_key in zip(rows, row_keys)
+        if row_key in existing
+    ]
+    if params:
+        db.connection().execute(update_stmt, params)
+
+    # a row created meanwhile by another writer is still added to, not overwritten
+    _upsert_add(db, model, [row for row, row_key in zip(rows, row_keys) if row_key not in existing], add_columns)
+
+
+#
+# USERS
+#
 
 
 def get_user(
@@ -40,6 +191,11 @@ def get_users(db: Session):
     return db.query(models.User).all()
 
 
+# plain dicts for the /users/get_all fast path, same shape as schemas.User
+def get_users_rows(db: Session) -> list[dict]:
+    return [dict(row) for row in db.execute(select(models.User.id, models.User.discord_id)).mappings()]
+
+
 def create_user(
     db: Session,
     user: schemas.UserCreate,
@@ -48,6 +204,7 @@ def create_user(
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    identity_cache.invalidate(user_id=db_user.id, discord_id=db_user.discord_id)
     return db_user
 
 
@@ -105,6 +262,14 @@ def set_user_destination(
     if db_dest is None:
         db_dest = models.DiscordDestinations(user_id=user_id, discord_guild_id=discord_guild_id)
         db.add(db_dest)
+        db.flush()
+        _rebuild_guild_title_stats(db, [discord_guild_id])
+        # the scraps of a user with a destination are more frequent, the new pace starts now
+        db.execute(
+            update(models.FilmWebUserMapping)
+            .where(models.FilmWebUserMapping.user_id == user_id)
+            .values(next_scrap_at=None)
+        )
     else:
         db_dest.discord_guild_id = discord_guild_id
 
@@ -131,6 +296,8 @@ def delete_user_destination(
         return None
 
     db.delete(db_dest)
+    db.flush()
+    _rebuild_guild_title_stats(db, [discord_guild_id])
     db.commit()
 
     return db_dest
@@ -204,6 +371,9 @@ def delete_guild(db: Session, discord_guild_id: int):
     db.query(models.DiscordDestinations).filter(
         models.DiscordDestinations.discord_guild_id == discord_guild_id
     ).delete()
+    db.execute(
+        delete(models.DiscordGuildTitleDaily).where(models.DiscordGuildTitleDaily.discord_guild_id == discord_guild_id)
+    )
 
     db.delete(db_guild)
     db.commit()
@@ -215,11 +385,37 @@ def get_guilds(db: Session):
     return db.query(models.DiscordGuilds).all()
 
 
+# plain dicts for the /discord/guilds fast path, same shape as schemas.DiscordGuilds
+def get_guilds_rows(db: Session) -> list[dict]:
+    query = select(
+        models.DiscordGuilds.id, models.DiscordGuilds.discord_guild_id, models.DiscordGuilds.discord_channel_id
+    )
+    return [dict(row) for row in db.execute(query).mappings()]
+
+
 #
 # FILMWEB MOVIES
 #
 
 
+MOVIE_COLUMNS = ["title", "year", "poster_url", "community_rate", "critics_rate"]
+SERIES_COLUMNS = MOVIE_COLUMNS + ["other_year"]
+
+
+# rates are FLOAT (single precision) on MariaDB, exact comparison would always see a change
+# DATETIME keeps whole seconds there too, while the crawler sends milliseconds (same as the watched diff)
+def _same_value(stored, incoming) -> bool:
+    if isinstance(stored, float) and isinstance(incoming, (float, int)):
+        return math.isclose(stored, incoming, rel_tol=1e-6)
+    if isinstance(stored, datetime) and isinstance(incoming, datetime):
+        return stored.replace(microsecond=0) == _naive_local(incoming).replace(microsecond=0)
+    return stored == incoming
+
+
+def _media_changed(db_media, media, columns: list[str]) -> bool:
+    return not all(_same_value(getattr(db_media, column), getattr(media, column)) for column in columns)
+
+
 def get_movie_filmweb_id(db: Session, id: int) -> models.FilmWebMovie | None:
     return db.query(models.FilmWebMovie).filter(models.FilmWebMovie.id == id).first()
 
@@ -245,37 +441,10 @@ def create_filmweb_movie(db: Session, movie: schemas.FilmWebMovie) -> models.Fil
     return db_movie
 
 
+# a scrap result, same as a batch of one (the next refresh is planned too)
 def update_filmweb_movie(db: Session, movie: schemas.FilmWebMovie):
-    db_movie = get_movie_filmweb_id(db, movie.id)
-
-    if db_movie is None:
-        return create_filmweb_movie(db, movie)
-
-    logging.debug(f"Updating movie: {movie.title}")
-    logging.debug(f"movie data before")
-    logging.debug(f"{db_movie.title}")
-    logging.debug(f"{db_movie.year}")
-    logging.debug(f"{db_movie.poster_url}")
-    logging.debug(f"{db_movie.community_rate}")
-    logging.debug(f"{db_movie.critics_rate}")
-    logging.debug(f"movie data after")
-
-    db_movie.title = movie.title
-    db_movie.year = movie.year
-    db_movie.poster_url = movie.poster_url
-    db_movie.community_rate = movie.community_rate
-    db_movie.critics_rate = movie.critics_rate
-
-    logging.debug(f"{db_movie.title}")
-    logging.debug(f"{db_movie.year}")
-    logging.debug(f"{db_movie.poster_url}")
-    logging.debug(f"{db_movie.community_rate}")
-    logging.debug(f"{db_movie.critics_rate}")
-
-    db.commit()
-    db.refresh(db_movie)
-
-    return db_movie
+    update_filmweb_movies_many(db, [movie])
+    return get_movie_filmweb_id(db, movie.id)
 
 
 #
@@ -310,22 +479,176 @@ def create_filmweb_series(db: Session, series: schemas.FilmWebSeries):
 
 
 def update_filmweb_series(db: Session, series: schemas.FilmWebSeries):
-    db_series = get_series_filmweb_id(db, series.id)
+    update_filmweb_series_many(db, [series])
+    return get_series_filmweb_id(db, series.id)
+
+
+#
+# FILMWEB MEDIA REFRESH
+#
+
+# a title is scraped again after an interval following how much it still changes, instead of every title
+# every few hours: recent releases, titles whose community rate moved on the last scrap and titles rated
+# by many of our users come back sooner, old titles nobody here rated settle at the maximum
+MEDIA_REFRESH_MIN_HOURS = 6
+MEDIA_REFRESH_MAX_DAYS = 60
 
-    if db_series is None:
-        return create_filmweb_series(db, series)
+# the planner runs every MEDIA_REFRESH_PLAN_MINUTES (cron), the titles due within the next window are
+# spread evenly over its runs, so the scraping rate stays flat whatever the due dates look like
+MEDIA_REFRESH_PLAN_MINUTES = 10
+MEDIA_REFRESH_WINDOW_HOURS = 24
 
-    db_series.title = series.title
-    db_series.year = series.year
-    db_series.poster_url = series.poster_url
-    db_series.community_rate = series.community_rate
-    db_series.other_year = series.other_year
-    db_series.critics_rate = series.critics_rate
 
+# stable per title in [0, 1), titles scraped in one batch don't all come due at the same moment again
+def _refresh_jitter(media_id: int) -> float:
+    return (media_id * 2654435761 % 2**32) / 2**32
+
+
+# rate_change is how much the community rate moved on this scrap, None on the first one
+def _media_refresh_interval(
+    media_id: int, year: int | None, rate_change: float | None, raters: int, now: datetime
+) -> timedelta:
+    age = now.year - year if year else 0
+    if age <= 1:
+        days = 2
+    elif age <= 5:
+        days = 14
+    else:
+        days = MEDIA_REFRESH_MAX_DAYS
+
+    if rate_change is not None and rate_change >= 0.1:
+        days /= 4
+    elif rate_change is not None and rate_change >= 0.01:
+        days /= 2
+
+    days /= 1 + math.log2(1 + raters) / 2
+    days *= 0.75 + 0.25 * _refresh_jitter(media_id)
+
+    hours = min(max(days * 24, MEDIA_REFRESH_MIN_HOURS), MEDIA_REFRESH_MAX_DAYS * 24)
+    return timedelta(hours=hours)
+
+
+# media_id -> our users who rated it
+def _count_media_raters(db: Session, watched_model, media_ids: list[int]) -> dict[int, int]:
+    raters = {}
+    for chunk in _chunks(media_ids):
+        raters.update(
+            db.execute(
+                select(watched_model.id_media, func.count())
+                .where(watched_model.id_media.in_(chunk), watched_model.rate >= 1, watched_model.rate <= 10)
+                .group_by(watched_model.id_media)
+            ).all()
+        )
+    return raters
+
+
+# queues refresh tasks of the titles that are due (never scraped ones first), at most this run's share
+# of what comes due within the window, returns number of created tasks
+def _plan_filmweb_media_refresh(db: Session, model, task_type: schemas.TaskTypes) -> int:
+    now = datetime.now()
+
+    def due_by(moment: datetime):
+        return or_(model.next_refresh_at.is_(None), model.next_refresh_at <= moment)
+
+    window_end = now + timedelta(hours=MEDIA_REFRESH_WINDOW_HOURS)
+    due_in_window = db.scalar(select(func.count()).select_from(model).where(due_by(window_end)))
+    limit = math.ceil(due_in_window * MEDIA_REFRESH_PLAN_MINUTES / (MEDIA_REFRESH_WINDOW_HOURS * 60))
+    if limit == 0:
+        return 0
+
+    # NULLs sort first on both sqlite and mariadb
+    return _create_tasks_from_column(
+        db,
+        task_type,
+        model.id,
+        _refresh_priority(),
+        where=due_by(now),
+        order_by=(model.next_refresh_at, model.id),
+        limit=limit,
+    )
+
+
+def plan_filmweb_movies_refresh(db: Session) -> int:
+    return _plan_filmweb_media_refresh(db, models.FilmWebMovie, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE)
+
+
+def plan_filmweb_series_refresh(db: Session) -> int:
+    return _plan_filmweb_media_refresh(db, models.FilmWebSeries, schemas.TaskTypes.SCRAP_FILMWEB_SERIES)
+
+
+#
+# FILMWEB MEDIA BULK UPDATE
+#
+
+
+# compares incoming rows with stored ones, inserts missing, updates changed rows, one commit
+# every row gets its scrap time and next refresh, the metadata columns are only written when changed
+def _update_filmweb_media_many(
+    db: Session,
+    model,
+    watched_model,
+    items: list[schemas.FilmWebMovie | schemas.FilmWebSeries],
+    columns: list[str],
+) -> schemas.FilmWebMediaUpdateManyResult:
+    now = datetime.now()
+    # last one wins if the same id came twice
+    incoming = {item.id: item for item in items}
+
+    existing = {}
+    for chunk in _chunks(list(incoming)):
+        existing.update({row.id: row for row in db.query(model).filter(model.id.in_(chunk))})
+
+    raters = _count_media_raters(db, watched_model, list(incoming))
+
+    to_insert = []
+    to_update = []
+    changed_ids = []
+    for media_id, item in incoming.items():
+        values = {column: getattr(item, column) for column in columns}
+        row = existing.get(media_id)
+
+        old_rate = row.community_rate if row is not None else None
+        rate_change = abs(item.community_rate - old_rate) if None not in (item.community_rate, old_rate) else None
+        refresh = {
+            "last_scraped_at": now,
+            "next_refresh_at": now
+            + _media_refresh_interval(media_id, item.year, rate_change, raters.get(media_id, 0), now),
+        }
+
+        if row is None:
+            to_insert.append({"id": media_id, **values, **refresh})
+        elif _media_changed(row, item, columns):
+            to_update.append({"id": media_id, **values, **refresh})
+            changed_ids.append(media_id)
+        else:
+            to_update.append({"id": media_id, **refresh})
+
+    inserted = _insert_ignore(db, model, to_insert)
+    if to_update:
+        # ORM bulk UPDATE by primary key, one executemany per set of columns
+        db.execute(update(model), to_update)
+    if changed_ids:
+        _bump_watched_version_of_media(db, watched_model, changed_ids)
     db.commit()
-    db.refresh(db_series)
 
-    return db_series
+    result = schemas.FilmWebMediaUpdateManyResult(
+        inserted=inserted,
+        changed=len(changed_ids),
+        unchanged=len(incoming) - len(to_insert) - len(changed_ids),
+    )
+    logging.info(f"Bulk update of {model.__tablename__}: {result}")
+
+    return result
+
+
+def update_filmweb_movies_many(db: Session, movies: list[schemas.FilmWebMovie]) -> schemas.FilmWebMediaUpdateManyResult:
+    return _update_filmweb_media_many(db, models.FilmWebMovie, models.FilmWebUserWatchedMovie, movies, MOVIE_COLUMNS)
+
+
+def update_filmweb_series_many(
+    db: Session, series: list[schemas.FilmWebSeries]
+) -> schemas.FilmWebMediaUpdateManyResult:
+    return _update_filmweb_media_many(db, models.FilmWebSeries, models.FilmWebUserWatchedSeries, series, SERIES_COLUMNS)
 
 
 #
@@ -341,17 +664,20 @@ def get_filmweb_user_mapping(
     filmweb_id: str | None,
     discord_id: int | None,
 ) -> models.FilmWebUserMapping | None:
-    user = get_user(db, user_id, filmweb_id, discord_id)
+    identity = resolve_identity(db, user_id, filmweb_id, discord_id)
 
-    if user is None:
+    if identity is None:
         return None
 
-    return db.query(models.FilmWebUserMapping).filter(models.FilmWebUserMapping.user_id == user.id).first()
+    return db.query(models.FilmWebUserMapping).filter(models.FilmWebUserMapping.user_id == identity.user_id).first()
 
 
 # sets filmweb user nickname to corelate with discord user (main user in db)
+# filmweb_user_id is the numeric filmweb.pl userId of the nick, if the caller already resolved it
 def set_filmweb_user_mapping(
-    db: Session, mapping: schemas.FilmWebUserMappingCreate
+    db: Session,
+    mapping: schemas.FilmWebUserMappingCreate,
+    filmweb_user_id: int | None = None,
 ) -> models.FilmWebUserMapping | None:
     user = get_user(db, mapping.user_id, None, None)
 
@@ -366,11 +692,31 @@ def set_filmweb_user_mapping(
         db.add(db_mapping)
     # updates
     else:
-        db_mapping.filmweb_id = mapping.filmweb_id
+        identity_cache.invalidate(filmweb_id=db_mapping.filmweb_id)
+        db_mapping.watched_version += 1
+
+    if db_mapping.filmweb_id != mapping.filmweb_id or filmweb_user_id is not None:
+        db_mapping.filmweb_user_id = filmweb_user_id
+        db_mapping.filmweb_user_id_checked_at = datetime.now() if filmweb_user_id is not None else None
+
+    # another account, scraped at once and paced by its own rates
+    changed = db_mapping.filmweb_id != mapping.filmweb_id
+    if changed:
+        db_mapping.last_rated_at = None
+        db_mapping.next_scrap_at = None
+
+    db_mapping.filmweb_id = mapping.filmweb_id
+
+    # the user's guilds count the watched rows of the new account
+    if changed:
+        db.flush()
+        _rebuild_guild_title_stats(db, _user_guild_ids(db, user.id))
 
     db.commit()
     db.refresh(db_mapping)
 
+    identity_cache.invalidate(user.id, mapping.filmweb_id, user.discord_id)
+
     return db_mapping
 
 
@@ -392,12 +738,91 @@ def delete_filmweb_user_mapping(
         logging.debug(f"Mapping not found for user {user.id} and filmweb_id {filmweb_id}")
         return None
 
+    _delete_filmweb_user_stats(db, db_mapping.filmweb_id)
     db.delete(db_mapping)
+    db.flush()
+    _rebuild_guild_title_stats(db, _user_guild_ids(db, user.id))
     db.commit()
 
+    identity_cache.invalidate(user.id, db_mapping.filmweb_id, user.discord_id)
+
     return True
 
 
+# mappings never checked first, then the ones checked longest ago
+def get_filmweb_user_mappings_to_revalidate(
+    db: Session, checked_before: datetime, limit: int
+) -> list[models.FilmWebUserMapping]:
+    checked_at = models.FilmWebUserMapping.filmweb_user_id_checked_at
+
+    return (
+        db.query(models.FilmWebUserMapping)
+        .filter(or_(checked_at.is_(None), checked_at < checked_before))
+        .order_by(checked_at.is_not(None), checked_at)
+        .limit(limit)
+        .all()
+    )
+
+
+# filmweb_user_id None keeps the stored id, the nick is gone (renamed account) but its votes are still there
+def set_filmweb_user_id(db: Session, mapping_id: int, filmweb_user_id: int | None) -> models.FilmWebUserMapping | None:
+    db_mapping = db.get(models.FilmWebUserMapping, mapping_id)
+
+    if db_mapping is None:
+        return None
+
+    if filmweb_user_id is not None:
+        db_mapping.filmweb_user_id = filmweb_user_id
+    db_mapping.filmweb_user_id_checked_at = datetime.now()
+
+    db.commit()
+    db.refresh(db_mapping)
+
+    return db_mapping
+
+
+# watched_version is the ETag of a user's watched lists, bumped in the same transaction as the change
+def _bump_watched_version(db: Session, filmweb_ids: list[str]):
+    for chunk in _chunks(list(set(filmweb_ids))):
+        db.execute(
+            update(models.FilmWebUserMapping)
+            .where(models.FilmWebUserMapping.filmweb_id.in_(chunk))
+            .values(watched_version=models.FilmWebUserMapping.watched_version + 1)
+        )
+
+
+# watched lists embed media details, so a changed title/poster/rate is a change for everyone who watched it
+def _bump_watched_version_of_media(db: Session, watched_model, media_ids: list[int]):
+    for chunk in _chunks(media_ids):
+        db.execute(
+            update(models.FilmWebUserMapping)
+            .where(
+                models.FilmWebUserMapping.filmweb_id.in_(
+                    select(watched_model.filmweb_id).where(watched_model.id_media.in_(chunk))
+                )
+            )
+            .values(watched_version=models.FilmWebUserMapping.watched_version + 1)
+        )
+
+
+def get_filmweb_user_watched_version(
+    db: Session,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+) -> tuple[int, int] | None:
+    identity = resolve_identity(db, user_id, filmweb_id, discord_id)
+
+    if identity is None:
+        return None
+
+    return db.execute(
+        select(models.FilmWebUserMapping.id, models.FilmWebUserMapping.watched_version).where(
+            models.FilmWebUserMapping.user_id == identity.user_id
+        )
+    ).first()
+
+
 # MOVIES WATCHED
 
 
@@ -432,6 +857,11 @@ def create_filmweb_user_watched_movie(db: Session, user_watched_movie: schemas.F
         favorite=user_watched_movie.favorite,
     )
     db.add(db_movie)
+    db.flush()
+    _update_filmweb_user_stats(
+        db, schemas.MediaType.MOVIE, models.FilmWebUserWatchedMovie, [(None, _watched_stats_row(db_movie))]
+    )
+    _bump_watched_version(db, [user_watched_movie.filmweb_id])
     db.commit()
     db.refresh(db_movie)
     return db_movie
@@ -444,18 +874,12 @@ def get_filmweb_user_watched_movie(
     discord_id: int | None,
     id_media: int,
 ):
-    user = get_user(db, user_id, filmweb_id, discord_id)
+    identity = resolve_identity(db, user_id, filmweb_id, discord_id)
 
-    if user is None:
+    if identity is None:
         return None
 
-    if filmweb_id is None:
-        filmweb_mapping = (
-            db.query(models.FilmWebUserMapping).filter(models.FilmWebUserMapping.user_id == user.id).first()
-        )
-        if filmweb_mapping is None:
-            return None
-        filmweb_id = filmweb_mapping.filmweb_id
+    filmweb_id = filmweb_id or identity.filmweb_id
 
     return (
         db.query(models.FilmWebUserWatchedMovie)
@@ -473,18 +897,12 @@ def get_filmweb_user_watched_movies(
     filmweb_id: str | None,
     discord_id: int | None,
 ):
-    user = get_user(db, user_id, filmweb_id, discord_id)
+    identity = resolve_identity(db, user_id, filmweb_id, discord_id)
 
-    if user is None:
+    if identity is None:
         return None
 
-    if filmweb_id is None:
-        filmweb_mapping = (
-            db.query(models.FilmWebUserMapping).filter(models.FilmWebUserMapping.user_id == user.id).first()
-        )
-        if filmweb_mapping is None:
-            return None
-        filmweb_id = filmweb_mapping.filmweb_id
+    filmweb_id = filmweb_id or identity.filmweb_id
 
     watched_movies = (
         db.query(models.FilmWebUserWatchedMovie).filter(models.FilmWebUserWatchedMovie.filmweb_id == filmweb_id).all()
@@ -507,6 +925,9 @@ def delete_filmweb_user_watched_movies(
     filmweb_id = user_mapping.filmweb_id
 
     db.query(models.FilmWebUserWatchedMovie).filter(models.FilmWebUserWatchedMovie.filmweb_id == filmweb_id).delete()
+    _delete_filmweb_user_stats(db, filmweb_id, schemas.MediaType.MOVIE)
+    _rebuild_guild_title_stats(db, _user_guild_ids(db, user_mapping.user_id))
+    _bump_watched_version(db, [filmweb_id])
     db.commit()
 
     return True
@@ -548,6 +969,11 @@ def create_filmweb_user_watched_series(db: Session, user_watched_series: schemas
         favorite=user_watched_series.favorite,
     )
     db.add(db_series)
+    db.flush()
+    _update_filmweb_user_stats(
+        db, schemas.MediaType.SERIES, models.FilmWebUserWatchedSeries, [(None, _watched_stats_row(db_series))]
+    )
+    _bump_watched_version(db, [user_watched_series.filmweb_id])
     db.commit()
     db.refresh(db_series)
     return db_series
@@ -559,19 +985,12 @@ def get_filmweb_user_watched_series_all(
     filmweb_id: str | None,
     discord_id: int | None,
 ):
-    user = get_user(db, user_id, filmweb_id, discord_id)
+    identity = resolve_identity(db, user_id, filmweb_id, discord_id)
 
-    if user is None:
+    if identity is None:
         return None
 
-    # Get the filmweb_id from the mapping if not provided
-    if filmweb_id is None:
-        filmweb_mapping = (
-            db.query(models.FilmWebUserMapping).filter(models.FilmWebUserMapping.user_id == user.id).first()
-        )
-        if filmweb_mapping is None:
-            return None
-        filmweb_id = filmweb_mapping.filmweb_id
+    filmweb_id = filmweb_id or identity.filmweb_id
 
     return (
         db.query(models.FilmWebUserWatchedSeries).filter(models.FilmWebUserWatchedSeries.filmweb_id == filmweb_id).all()
@@ -585,19 +1004,12 @@ def get_filmweb_user_watched_series(
     discord_id: int | None,
     id_media: int,
 ):
-    user = get_user(db, user_id, filmweb_id, discord_id)
+    identity = resolve_identity(db, user_id, filmweb_id, discord_id)
 
-    if user is None:
+    if identity is None:
         return None
 
-    # Get the filmweb_id from the mapping if not provided
-    if filmweb_id is None:
-        filmweb_mapping = (
-            db.query(models.FilmWebUserMapping).filter(models.FilmWebUserMapping.user_id == user.id).first()
-        )
-        if filmweb_mapping is None:
-            return None
-        filmweb_id = filmweb_mapping.filmweb_id
+    filmweb_id = filmweb_id or identity.filmweb_id
 
     return (
         db.query(models.FilmWebUserWatchedSeries)
@@ -623,6 +1035,9 @@ def delete_filmweb_user_watched_series(
     filmweb_id = user_mapping.filmweb_id
 
     db.query(models.FilmWebUserWatchedSeries).filter(models.FilmWebUserWatchedSeries.filmweb_id == filmweb_id).delete()
+    _delete_filmweb_user_stats(db, filmweb_id, schemas.MediaType.SERIES)
+    _rebuild_guild_title_stats(db, _user_guild_ids(db, user_mapping.user_id))
+    _bump_watched_version(db, [filmweb_id])
     db.commit()
 
     return True
@@ -634,22 +1049,743 @@ def get_filmweb_watched_series_all(
     return db.query(models.FilmWebUserWatchedSeries).all()
 
 
+# BULK WATCHED
+
+WATCHED_UPSERT_COLUMNS = ["date", "rate", "comment", "favorite"]
+
+
+# one transaction for the whole list: missing media placeholders in bulk,
+# one SELECT to classify rows, one native upsert for the created/updated ones
+def _create_filmweb_user_watched_many(
+    db: Session,
+    watched_model,
+    media_model,
+    media_type: schemas.MediaType,
+    items: list[schemas.FilmWebUserWatchedMovieCreate | schemas.FilmWebUserWatchedSeriesCreate],
+    notify: bool,
+) -> list[schemas.FilmWebUserWatchedUpsertResult]:
+    # last one wins if the same (user, media) came twice
+    # aware dates become local wall-clock time first, as stored and as compared, so a resend stays unchanged
+    incoming = {
+        (item.filmweb_id, item.id_media): (
+            item.model_copy(update={"date": _naive_local(item.date)}) if item.date and item.date.tzinfo else item
+        )
+        for item in items
+    }
+
+    _insert_ignore(db, media_model, [{"id": id_media} for id_media in sorted({key[1] for key in incoming})])
+
+    existing = {}
+    for filmweb_id in {key[0] for key in incoming}:
+        ids = [key[1] for key in incoming if key[0] == filmweb_id]
+        for chunk in _chunks(ids):
+            rows = db.query(watched_model).filter(
+                watched_model.filmweb_id == filmweb_id,
+                watched_model.id_media.in_(chunk),
+            )
+            existing.update({(row.filmweb_id, row.id_media): row for row in rows})
+
+    results = []
+    to_write = []
+    stats_changes = []
+    notifications = []
+    for key, item in incoming.items():
+        values = {column: getattr(item, column) for column in WATCHED_UPSERT_COLUMNS}
+        row = existing.get(key)
+
+        if row is None:
+            status = schemas.WatchedUpsertStatus.CREATED
+        elif not all(_same_value(getattr(row, column), value) for column, value in values.items()):
+            status = schemas.WatchedUpsertStatus.UPDATED
+        else:
+            status = schemas.WatchedUpsertStatus.UNCHANGED
+
+        if status != schemas.WatchedUpsertStatus.UNCHANGED:
+            to_write.append({"filmweb_id": item.filmweb_id, "id_media": item.id_media, **values})
+            stats_changes.append((_watched_stats_row(row) if row is not None else None, _watched_stats_row(item)))
+
+        if notify and status == schemas.WatchedUpsertStatus.CREATED:
+            notifications.append(_notification_row(item, media_type))
+
+        results.append(
+            schemas.FilmWebUserWatchedUpsertResult(id_media=item.id_media, filmweb_id=item.filmweb_id, status=status)
+        )
+
+    try:
+        _upsert(db, watched_model, to_write, WATCHED_UPSERT_COLUMNS)
+        _update_filmweb_user_stats(db, media_type, watched_model, stats_changes)
+        _bump_watched_version(db, [row["filmweb_id"] for row in to_write])
+        _set_filmweb_users_rated(db, to_write)
+        # a title already announced once is not announced again
+        _insert_ignore(db, models.NotificationOutbox, notifications)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise
+
+    if notifications:
+        wake(NOTIFICATIONS_TOPIC)
+
+    return results
+
+
+# notify: announce the created ones on discord (notification outbox), the crawler skips it on a user's first scrap
+def create_filmweb_user_watched_movies_many(
+    db: Session, user_watched_movies: list[schemas.FilmWebUserWatchedMovieCreate], notify: bool = False
+) -> list[schemas.FilmWebUserWatchedUpsertResult]:
+    return _create_filmweb_user_watched_many(
+        db, models.FilmWebUserWatchedMovie, models.FilmWebMovie, schemas.MediaType.MOVIE, user_watched_movies, notify
+    )
+
+
+def create_filmweb_user_watched_series_many(
+    db: Session, user_watched_series: list[schemas.FilmWebUserWatchedSeriesCreate], notify: bool = False
+) -> list[schemas.FilmWebUserWatchedUpsertResult]:
+    return _create_filmweb_user_watched_many(
+        db, models.FilmWebUserWatchedSeries, models.FilmWebSeries, schemas.MediaType.SERIES, user_watched_series, notify
+    )
+
+
+# EXPORT
+
+# rows fetched per round trip, MySQL streams them from a server side cursor
+EXPORT_YIELD_PER = 1000
+
+
+def _count_filmweb_user_watched(db: Session, watched_model, filmweb_id: str) -> int:
+    return db.scalar(select(func.count()).select_from(watched_model).where(watched_model.filmweb_id == filmweb_id))
+
+
+# flat (media + vote) rows oldest first, never materializes the whole history
+def _iter_filmweb_user_watched_export(db: Session, watched_model, media_model, filmweb_id: str):
+    columns = [
+        media_model.id,
+        media_model.title,
+        media_model.year,
+        media_model.poster_url,
+        media_model.community_rate,
+        media_model.critics_rate,
+        watched_model.rate,
+        watched_model.comment,
+        watched_model.favorite,
+        watched_model.date,
+    ]
+    if media_model is models.FilmWebSeries:
+        columns.append(media_model.other_year)
+
+    query = (
+        select(*columns)
+        .join(media_model, media_model.id == watched_model.id_media)
+        .where(watched_model.filmweb_id == filmweb_id)
+        .order_by(watched_model.date, watched_model.id_media)
+        .execution_options(yield_per=EXPORT_YIELD_PER)
+    )
+
+    yield from db.execute(query)
+
+
+def count_filmweb_user_watched_movies(db: Session, filmweb_id: str) -> int:
+    return _count_filmweb_user_watched(db, models.FilmWebUserWatchedMovie, filmweb_id)
+
+
+def count_filmweb_user_watched_series(db: Session, filmweb_id: str) -> int:
+    return _count_filmweb_user_watched(db, models.FilmWebUserWatchedSeries, filmweb_id)
+
+
+def iter_filmweb_user_watched_movies_export(db: Session, filmweb_id: str):
+    return _iter_filmweb_user_watched_export(db, models.FilmWebUserWatchedMovie, models.FilmWebMovie, filmweb_id)
+
+
+def iter_filmweb_user_watched_series_export(db: Session, filmweb_id: str):
+    return _iter_filmweb_user_watched_export(db, models.FilmWebUserWatchedSeries, models.FilmWebSeries, filmweb_id)
+
+
+#
+# STATS
+#
+
+STATS_RATES = range(1, 11)
+STATS_COUNTERS = ["watched", "rated", "rate_sum", *[f"rate_{rate}" for rate in STATS_RATES], "favorites"]
+STATS_DAILY_COUNTERS = ["watched", "rated", "rate_sum"]
+STATS_MODELS = (models.FilmWebUserStats, models.FilmWebUserStatsMonthly, models.FilmWebUserActivityDaily)
+STATS_WATCHED_MODELS = {
+    schemas.MediaType.MOVIE: models.FilmWebUserWatchedMovie,
+    schemas.MediaType.SERIES: models.FilmWebUserWatchedSeries,
+}
+
+
+# the fields of a watched row (ORM row or create schema) the stats depend on
+def _watched_stats_row(row) -> tuple:
+    return (row.filmweb_id, row.id_media, row.date, row.rate, bool(row.favorite))
+
+
+def _month(date: datetime | None) -> str | None:
+    return date.strftime("%Y-%m") if date is not None else None
+
+
+def _month_expr(db: Session, column):
+    if _is_mysql(db):
+        return func.date_format(column, "%Y-%m")
+    return func.strftime("%Y-%m", column)
+
+
+# first/last watched can't be undone by a delta, they are two seeks on the (filmweb_id, date) index instead
+# months and days that dropped to zero are removed
+@cache
+def _stats_maintenance_stmts(watched_model):
+    dates = select(watched_model.date).where(watched_model.filmweb_id == bindparam("b_filmweb_id"))
+    dates_stmt = (
+        update(models.FilmWebUserStats)
+        .where(
+            models.FilmWebUserStats.filmweb_id == bindparam("b_filmweb_id"),
+            models.FilmWebUserStats.media_type == bindparam("b_media_type"),
+        )
+        .values(
+            first_watched=dates.with_only_columns(func.min(watched_model.date)).scalar_subquery(),
+            last_watched=dates.with_only_columns(func.max(watched_model.date)).scalar_subquery(),
+        )
+    )
+    cleanup_stmt = delete(models.FilmWebUserStatsMonthly).where(
+        models.FilmWebUserStatsMonthly.filmweb_id == bindparam("b_filmweb_id"),
+        models.FilmWebUserStatsMonthly.media_type == bindparam("b_media_type"),
+        models.FilmWebUserStatsMonthly.watched <= 0,
+    )
+    daily_cleanup_stmt = delete(models.FilmWebUserActivityDaily).where(
+        models.FilmWebUserActivityDaily.filmweb_id == bindparam("b_filmweb_id"),
+        models.FilmWebUserActivityDaily.media_type == bindparam("b_media_type"),
+        models.FilmWebUserActivityDaily.watched <= 0,
+    )
+    return dates_stmt, cleanup_stmt, daily_cleanup_stmt
+
+
+@cache
+def _guild_title_stats_cleanup_stmt():
+    model = models.DiscordGuildTitleDaily
+    return delete(model).where(
+        model.discord_guild_id == bindparam("b_discord_guild_id"),
+        model.media_type == bindparam("b_media_type"),
+        model.day == bindparam("b_day"),
+        model.id_media == bindparam("b_id_media"),
+        model.watched <= 0,
+    )
+
+
+def _user_guild_ids(db: Session, user_id: int) -> list[int]:
+    query = select(models.DiscordDestinations.discord_guild_id).where(models.DiscordDestinations.user_id == user_id)
+    return list(db.execute(query).scalars())
+
+
+# adds the (filmweb_id, day, id_media) deltas to the title counters of every guild the users are members of
+def _add_guild_title_stats(db: Session, media_type: schemas.MediaType, titles: dict[tuple, dict[str, int]]):
+    titles = {key: counters for key, counters in titles.items() if any(counters.values())}
+    if not titles:
+        return
+
+    mapping = models.FilmWebUserMapping
+    query = (
+        select(mapping.filmweb_id, models.DiscordDestinations.discord_guild_id)
+        .join(models.DiscordDestinations, models.DiscordDestinations.user_id == mapping.user_id)
+        .where(mapping.filmweb_id.in_(sorted({filmweb_id for filmweb_id, _, _ in titles})))
+    )
+    guilds: dict[str, list[int]] = {}
+    for filmweb_id, discord_guild_id in db.execute(query):
+        guilds.setdefault(filmweb_id, []).append(discord_guild_id)
+
+    # members of one guild watching the same title on the same day add to one row
+    rows: dict[tuple, dict[str, int]] = {}
+    for (filmweb_id, day, id_media), counters in titles.items():
+        for discord_guild_id in guilds.get(filmweb_id, []):
+            row = rows.setdefault((discord_guild_id, day, id_media), dict.fromkeys(STATS_DAILY_COUNTERS, 0))
+            for column, value in counters.items():
+                row[column] += value
+
+    rows = {key: counters for key, counters in rows.items() if any(counters.values())}
+    if not rows:
+        return
+
+    _add_counters(
+        db,
+        models.DiscordGuildTitleDaily,
+        [
+            {"discord_guild_id": discord_guild_id, "media_type": media_type.value, "day": day, "id_media": id_media}
+            | counters
+            for (discord_guild_id, day, id_media), counters in rows.items()
+        ],
+        STATS_DAILY_COUNTERS,
+    )
+    db.connection().execute(
+        _guild_title_stats_cleanup_stmt(),
+        [
+            {
+                "b_discord_guild_id": discord_guild_id,
+                "b_media_type": media_type.value,
+                "b_day": day,
+                "b_id_media": id_media,
+            }
+            for discord_guild_id, day, id_media in rows
+        ],
+    )
+
+
+# recomputes the title counters of the guilds from their members' watched rows, None rebuilds every guild
+# a guild is rebuilt when a member joins, leaves or loses watched rows, the deltas can't follow those
+def _rebuild_guild_title_stats(db: Session, discord_guild_ids: list[int] | None = None):
+    model = models.DiscordGuildTitleDaily
+    if discord_guild_ids is not None and not discord_guild_ids:
+        return
+
+    query = delete(model)
+    if discord_guild_ids is not None:
+        query = query.where(model.discord_guild_id.in_(discord_guild_ids))
+    db.execute(query)
+
+    guild = models.DiscordDestinations.discord_guild_id
+    for media_type, watched_model in STATS_WATCHED_MODELS.items():
+        rate = watched_model.rate
+        rated = and_(rate >= 1, rate <= 10)
+        day = func.date(watched_model.date)
+
+        titles_query = (
+            select(
+                guild,
+                literal(media_type.value),
+                day,
+                watched_model.id_media,
+                func.count(),
+                func.sum(case((rated, 1), else_=0)),
+                func.sum(case((rated, rate), else_=0)),
+            )
+            .join(models.FilmWebUserMapping, models.FilmWebUserMapping.filmweb_id == watched_model.filmweb_id)
+            .join(models.DiscordDestinations, models.DiscordDestinations.user_id == models.FilmWebUserMapping.user_id)
+            .where(watched_model.date.is_not(None))
+            .group_by(guild, day, watched_model.id_media)
+        )
+        if discord_guild_ids is not None:
+            titles_query = titles_query.where(guild.in_(discord_guild_ids))
+
+        db.execute(
+            insert(model).from_select(
+                ["discord_guild_id", "media_type", "day", "id_media", *STATS_DAILY_COUNTERS], titles_query
+            )
+        )
+
+
+# applies (old row, new row) changes of one media type to the counters, in the caller's transaction
+# None on the old side is an insert, on the new side a delete
+def _update_filmweb_user_stats(db: Session, media_type: schemas.MediaType, watched_model, changes: list[tuple]):
+    stats: dict[str, dict[str, int]] = {}
+    months: dict[tuple[str, str], int] = {}
+    days: dict[tuple, dict[str, int]] = {}
+    titles: dict[tuple, dict[str, int]] = {}
+
+    for old, new in changes:
+        if old == new:
+            continue
+
+        for row, sign in ((old, -1), (new, 1)):
+            if row is None:
+                continue
+
+            filmweb_id, id_media, date, rate, favorite = row
+            counters = stats.setdefault(filmweb_id, dict.fromkeys(STATS_COUNTERS, 0))
+            counters["watched"] += sign
+            counters["favorites"] += sign if favorite else 0
+            if rate in STATS_RATES:
+                counters["rated"] += sign
+                counters["rate_sum"] += sign * rate
+                counters[f"rate_{rate}"] += sign
+
+            if date is not None:
+                key = (filmweb_id, _month(date))
+                months[key] = months.get(key, 0) + sign
+
+                for day in (
+                    days.setdefault((filmweb_id, date.date()), dict.fromkeys(STATS_DAILY_COUNTERS, 0)),
+                    titles.setdefault((filmweb_id, date.date(), id_media), dict.fromkeys(STATS_DAILY_COUNTERS, 0)),
+                ):
+                    day["watched"] += sign
+                    if rate in STATS_RATES:
+                        day["rated"] += sign
+                        day["rate_sum"] += sign * rate
+
+    if not stats:
+        return
+
+    _add_counters(
+        db,
+        models.FilmWebUserStats,
+        [
+            {"filmweb_id": filmweb_id, "media_type": media_type.value, **counters}
+            for filmweb_id, counters in stats.items()
+        ],
+        STATS_COUNTERS,
+    )
+    _add_counters(
+        db,
+        models.FilmWebUserStatsMonthly,
+        [
+            {"filmweb_id": filmweb_id, "media_type": media_type.value, "month": month, "watched": watched}
+            for (filmweb_id, month), watched in months.items()
+            if watched != 0
+        ],
+        ["watched"],
+    )
+    _add_counters(
+        db,
+        models.FilmWebUserActivityDaily,
+        [
+            {"filmweb_id": filmweb_id, "day": day, "media_type": media_type.value, **counters}
+            for (filmweb_id, day), counters in days.items()
+            if any(counters.values())
+        ],
+        STATS_DAILY_COUNTERS,
+    )
+    _add_guild_title_stats(db, media_type, titles)
+
+    params = [{"b_filmweb_id": filmweb_id, "b_media_type": media_type.value} for filmweb_id in stats]
+    for stmt in _stats_maintenance_stmts(watched_model):
+        db.connection().execute(stmt, params)
+
+
+# media_type None deletes both
+def _delete_filmweb_user_stats(db: Session, filmweb_id: str, media_type: schemas.MediaType | None = None):
+    for model in STATS_MODELS:
+        query = delete(model).where(model.filmweb_id == filmweb_id)
+        if media_type is not None:
+            query = query.where(model.media_type == media_type.value)
+        db.execute(query)
+
+
+# recomputes the stats from the watched tables (backfill, or repair after a manual change)
+# returns number of stats rows written, filmweb_id None rebuilds everyone
+# the guild title counters are rebuilt for every guild, or for the guilds the user is a member of
+def rebuild_filmweb_user_stats(db: Session, filmweb_id: str | None = None) -> int:
+    if filmweb_id is None:
+        for model in STATS_MODELS:
+            db.execute(delete(model))
+        _rebuild_guild_title_stats(db)
+    else:
+        _delete_filmweb_user_stats(db, filmweb_id)
+        user_id = db.execute(
+            select(models.FilmWebUserMapping.user_id).where(models.FilmWebUserMapping.filmweb_id == filmweb_id)
+        ).scalar()
+        if user_id is not None:
+            _rebuild_guild_title_stats(db, _user_guild_ids(db, user_id))
+
+    written = 0
+    for media_type, watched_model in STATS_WATCHED_MODELS.items():
+        rate = watched_model.rate
+        rated = and_(rate >= 1, rate <= 10)
+
+        query = select(
+            watched_model.filmweb_id,
+            literal(media_type.value),
+            func.count(),
+            func.sum(case((rated, 1), else_=0)),
+            func.sum(case((rated, rate), else_=0)),
+            *[func.sum(case((rate == value, 1), else_=0)) for value in STATS_RATES],
+            func.sum(case((watched_model.favorite == True, 1), else_=0)),  # noqa: E712
+            func.min(watched_model.date),
+            func.max(watched_model.date),
+        ).group_by(watched_model.filmweb_id)
+
+        month = _month_expr(db, watched_model.date)
+        monthly_query = (
+            select(watched_model.filmweb_id, literal(media_type.value), month, func.count())
+            .where(watched_model.date.is_not(None))
+            .group_by(watched_model.filmweb_id, month)
+        )
+
+        day = func.date(watched_model.date)
+        daily_query = (
+            select(
+                watched_model.filmweb_id,
+                day,
+                literal(media_type.value),
+                func.count(),
+                func.sum(case((rated, 1), else_=0)),
+                func.sum(case((rated, rate), else_=0)),
+            )
+            .where(watched_model.date.is_not(None))
+            .group_by(watched_model.filmweb_id, day)
+        )
+
+        if filmweb_id is not None:
+            query = query.where(watched_model.filmweb_id == filmweb_id)
+            monthly_query = monthly_query.where(watched_model.filmweb_id == filmweb_id)
+            daily_query = daily_query.where(watched_model.filmweb_id == filmweb_id)
+
+        result = db.execute(
+            insert(models.FilmWebUserStats).from_select(
+                ["filmweb_id", "media_type", *STATS_COUNTERS, "first_watched", "last_watched"], query
+            )
+        )
+        written += result.rowcount if result.rowcount >= 0 else 0
+
+        db.execute(
+            insert(models.FilmWebUserStatsMonthly).from_select(
+                ["filmweb_id", "media_type", "month", "watched"], monthly_query
+            )
+        )
+        db.execute(
+            insert(models.FilmWebUserActivityDaily).from_select(
+                ["filmweb_id", "day", "media_type", *STATS_DAILY_COUNTERS], daily_query
+            )
+        )
+
+    db.commit()
+
+    return written
+
+
+#
+# RECOMMEND
+#
+
+RATES_YIELD_PER = 50000
+
+
+# every rate of a media type as partitions of (filmweb_id, id_media, rate) rows, input of the similarity job
+# streamed, the whole table is never held as row objects
+def iter_filmweb_user_rates(db: Session, media_type: schemas.MediaType):
+    watched_model = STATS_WATCHED_MODELS[media_type]
+    query = (
+        select(watched_model.filmweb_id, watched_model.id_media, watched_model.rate)
+        .where(watched_model.rate >= 1, watched_model.rate <= 10)
+        .execution_options(yield_per=RATES_YIELD_PER)
+    )
+    yield from db.execute(query).partitions()
+
+
+# changes whenever any watched movie/series changes (watched_version is bumped on every write)
+def get_watched_fingerprint(db: Session) -> tuple[int, int]:
+    total, count = db.execute(
+        select(func.coalesce(func.sum(models.FilmWebUserMapping.watched_version), 0), func.count())
+    ).one()
+    return int(total), count
+
+
+# replaces all similarities of a media type in one transaction, readers see the old set until commit
+def set_filmweb_media_similarities(
+    db: Session,
+    media_type: schemas.MediaType,
+    id_media: list[int],
+    id_similar: list[int],
+    similarity: list[float],
+) -> int:
+    db.execute(
+        delete(models.FilmWebMediaSimilarity).where(models.FilmWebMediaSimilarity.media_type == media_type.value)
+    )
+
+    rows = [
+        {"media_type": media_type.value, "id_media": a, "id_similar": b, "similarity": value}
+        for a, b, value in zip(id_media, id_similar, similarity)
+    ]
+    for chunk in _chunks(rows, CHUNK_SIZE * 10):
+        db.execute(insert(models.FilmWebMediaSimilarity), chunk)
+
+    db.commit()
+
+    return len(rows)
+
+
+#
+# NOTIFICATIONS
+#
+
+# a notification failing this many times is marked failed and not read again
+NOTIFICATION_MAX_ATTEMPTS = 5
+
+
+def _notification_row(
+    item: schemas.FilmWebUserWatchedMovieCreate | schemas.FilmWebUserWatchedSeriesCreate,
+    media_type: schemas.MediaType,
+) -> dict:
+    payload = schemas.NotificationPayload(date=item.date, rate=item.rate, comment=item.comment, favorite=item.favorite)
+    return {
+        "filmweb_id": item.filmweb_id,
+        "media_type": media_type.value,
+        "media_id": item.id_media,
+        "payload": payload.model_dump(mode="json"),
+        "status": schemas.NotificationStatus.PENDING.value,
+        "created": datetime.now(),
+    }
+
+
+# pending notifications with id > after, oldest first, one range of the (status, id) index
+def get_notifications(db: Session, after: int, limit: int) -> list[models.NotificationOutbox]:
+    return (
+        db.query(models.NotificationOutbox)
+        .filter(
+            models.NotificationOutbox.status == schemas.NotificationStatus.PENDING,
+            models.NotificationOutbox.id > after,
+        )
+        .order_by(models.NotificationOutbox.id)
+        .limit(limit)
+        .all()
+    )
+
+
+# only pending rows are changed, acking the same id twice is a no-op
+def ack_notifications(db: Session, ack: schemas.NotificationAck) -> schemas.NotificationAckResult:
+    outbox = models.NotificationOutbox
+    pending = outbox.status == schemas.NotificationStatus.PENDING
+
+    delivered = 0
+    for chunk in _chunks(ack.delivered):
+        delivered += db.execute(
+            update(outbox)
+            .where(outbox.id.in_(chunk), pending)
+            .values(status=schemas.NotificationStatus.DELIVERED.value, attempts=outbox.attempts + 1)
+        ).rowcount
+
+    failed = 0
+    for chunk in _chunks(ack.failed):
+        failed += db.execute(
+            update(outbox)
+            .where(outbox.id.in_(chunk), pending)
+            .values(
+                attempts=outbox.attempts + 1,
+                status=case(
+                    (outbox.attempts + 1 >= NOTIFICATION_MAX_ATTEMPTS, schemas.NotificationStatus.FAILED.value),
+                    else_=schemas.NotificationStatus.PENDING.value,
+                ),
+            )
+        ).rowcount
+
+    db.commit()
+
+    return schemas.NotificationAckResult(delivered=delivered, failed=failed)
+
+
+# delivered/failed notifications older than days, pending ones are kept
+def delete_old_notifications(db: Session, days: int) -> int:
+    deleted = db.execute(
+        delete(models.NotificationOutbox).where(
+            models.NotificationOutbox.status != schemas.NotificationStatus.PENDING,
+            models.NotificationOutbox.created < datetime.now() - timedelta(days=days),
+        )
+    ).rowcount
+    db.commit()
+
+    return deleted
+
+
 #
 # TASKS
 #
 
 
+ACTIVE_TASK_STATUSES = (schemas.TaskStatus.QUEUED, schemas.TaskStatus.RUNNING)
+
+
+# only queued/running tasks have a key, unique index on it keeps one active task per (type, job)
+def task_dedupe_key(task_type: schemas.TaskTypes, task_job: str) -> str:
+    return f"{schemas.TaskTypes(task_type).value}:{task_job}"
+
+
+# the active task of the key, a duplicate of a queued task raises its priority, like in create_tasks_many
+def _existing_active_task(db: Session, dedupe_key: str, priority: int) -> models.Task | None:
+    existing_task = db.query(models.Task).filter(models.Task.task_dedupe_key == dedupe_key).first()
+    if existing_task is not None:
+        queued = existing_task.task_status == schemas.TaskStatus.QUEUED
+        if queued and existing_task.task_priority < priority:
+            existing_task.task_priority = priority
+            db.commit()
+            db.refresh(existing_task)
+    return existing_task
+
+
 def create_task(db: Session, task: schemas.TaskCreate):
     db_task = models.Task(**task.model_dump())
 
     db_task.task_created = datetime.now()
 
+    if task.task_status in ACTIVE_TASK_STATUSES:
+        db_task.task_dedupe_key = task_dedupe_key(task.task_type, task.task_job)
+
+        existing_task = _existing_active_task(db, db_task.task_dedupe_key, task.task_priority)
+        if existing_task is not None:
+            return existing_task
+
     db.add(db_task)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # a concurrent create of the same (type, job) took the key between the check and the insert
+        db.rollback()
+        if db_task.task_dedupe_key is None:
+            raise
+        existing_task = _existing_active_task(db, db_task.task_dedupe_key, task.task_priority)
+        if existing_task is None:
+            raise
+        return existing_task
+
     db.refresh(db_task)
+
+    if task.task_status == schemas.TaskStatus.QUEUED:
+        wake(task.task_type.value)
+
     return db_task
 
 
+def create_tasks_many(db: Session, tasks: list[schemas.TaskCreate]) -> schemas.TaskBulkCreateResult:
+    now = datetime.now()
+
+    rows = {}
+    inactive_rows = []
+    for task in tasks:
+        row = {
+            "task_status": task.task_status.value,
+            "task_type": task.task_type.value,
+            "task_job": task.task_job,
+            "task_created": now,
+            "task_started": task.task_started,
+            "task_finished": task.task_finished,
+            "task_priority": int(task.task_priority),
+        }
+
+        if task.task_status not in ACTIVE_TASK_STATUSES:
+            inactive_rows.append(row)
+            continue
+
+        row["task_dedupe_key"] = task_dedupe_key(task.task_type, task.task_job)
+        active_row = rows.setdefault(row["task_dedupe_key"], row)
+        active_row["task_priority"] = max(active_row["task_priority"], row["task_priority"])
+
+    # already queued/running ones are skipped by the unique key, this also covers concurrent enqueues
+    inserted = _insert_ignore(db, models.Task, list(rows.values()))
+
+    # a duplicate of a queued task raises its priority instead, e.g. a title queued by the periodic refresh
+    # is scraped right away once a user watches it
+    keys_by_priority = {}
+    for row in rows.values():
+        keys_by_priority.setdefault(row["task_priority"], []).append(row["task_dedupe_key"])
+
+    for priority, keys in keys_by_priority.items():
+        for chunk in _chunks(keys):
+            db.execute(
+                update(models.Task)
+                .where(
+                    models.Task.task_dedupe_key.in_(chunk),
+                    models.Task.task_status == schemas.TaskStatus.QUEUED.value,
+                    models.Task.task_priority < priority,
+                )
+                .values(task_priority=priority)
+                .execution_options(synchronize_session=False)
+            )
+
+    if inactive_rows:
+        db.execute(insert(models.Task), inactive_rows)
+        inserted += len(inactive_rows)
+
+    db.commit()
+
+    wake(*{row["task_type"] for row in rows.values() if row["task_status"] == schemas.TaskStatus.QUEUED.value})
+
+    return schemas.TaskBulkCreateResult(inserted=inserted, deduplicated=len(tasks) - inserted)
+
+
 def __change_task_status(db: Session, task_id: int, task_status: schemas.TaskStatus):
     db_task = db.query(models.Task).filter(models.Task.task_id == task_id).first()
     if db_task is None:
@@ -657,6 +1793,13 @@ def __change_task_status(db: Session, task_id: int, task_status: schemas.TaskSta
 
     db_task.task_status = task_status
 
+    if task_status not in ACTIVE_TASK_STATUSES:
+        db_task.task_dedupe_key = None
+    elif db_task.task_dedupe_key is None:
+        dedupe_key = task_dedupe_key(db_task.task_type, db_task.task_job)
+        if db.query(models.Task.task_id).filter(models.Task.task_dedupe_key == dedupe_key).first() is None:
+            db_task.task_dedupe_key = dedupe_key
+
     task_started = datetime.now() if task_status == schemas.TaskStatus.RUNNING else None
     if task_started is not None:
         db_task.task_started = task_started
@@ -674,6 +1817,10 @@ def __change_task_status(db: Session, task_id: int, task_status: schemas.TaskSta
 
     db.commit()
     db.refresh(db_task)
+
+    if task_status == schemas.TaskStatus.QUEUED:
+        wake(schemas.TaskTypes(db_task.task_type).value)
+
     return db_task
 
 
@@ -682,22 +1829,138 @@ def update_task_status(db: Session, task_id: int, task_status: schemas.TaskStatu
 
 
 def get_task_to_do(db: Session, task_types: schemas.TaskTypes, head: bool = False):
-    task_to_do = (
+    if not head:
+        # no lease deadline here, these are recovered by update_stuck_tasks minutes as before
+        leased = lease_tasks(db, task_types, n=1, lease_seconds=None)
+        return leased[0] if leased else None
+
+    return (
         db.query(models.Task)
         .filter(
             models.Task.task_status == schemas.TaskStatus.QUEUED,
             models.Task.task_type.in_(task_types),
         )
+        .order_by(models.Task.task_priority.desc(), models.Task.task_created, models.Task.task_id)
         .first()
     )
 
-    if task_to_do is None:
-        return None
 
-    if head:
-        return task_to_do
-    else:
-        return __change_task_status(db, task_to_do.task_id, schemas.TaskStatus.RUNNING)
+DEFAULT_TASK_LEASE_SECONDS = 300
+
+# share of the claims a task type gets when other types wait at the same priority
+# a type without a weight is retired, it is never claimed and the old tasks cleanup removes its tasks
+TASK_TYPE_WEIGHTS = {
+    schemas.TaskTypes.SCRAP_FILMWEB_USER: 8,
+    schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_MOVIES: 2,
+    schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_SERIES: 2,
+    schemas.TaskTypes.SCRAP_FILMWEB_MOVIE: 1,
+    schemas.TaskTypes.SCRAP_FILMWEB_SERIES: 1,
+}
+
+# task type -> its current weight in the round-robin, kept between claims so single task claims take turns too
+task_type_turns: dict[schemas.TaskTypes, int] = {}
+_task_type_turns_lock = threading.Lock()
+
+
+# smooth weighted round-robin over the types queued at the highest priority, lower priorities
+# only fill what is left of n, candidates are task type -> (its highest priority, oldest task ids)
+def _schedule_tasks(candidates: dict[schemas.TaskTypes, tuple[int, list[int]]], n: int) -> list[int]:
+    picked = []
+
+    for priority in sorted({priority for priority, _ in candidates.values()}, reverse=True):
+        queues = {task_type: deque(ids) for task_type, (p, ids) in candidates.items() if p == priority and ids}
+
+        with _task_type_turns_lock:
+            while queues and len(picked) < n:
+                total = sum(TASK_TYPE_WEIGHTS[task_type] for task_type in queues)
+                for task_type in queues:
+                    task_type_turns[task_type] = task_type_turns.get(task_type, 0) + TASK_TYPE_WEIGHTS[task_type]
+
+                task_type = max(queues, key=lambda t: (task_type_turns[t], TASK_TYPE_WEIGHTS[t]))
+                task_type_turns[task_type] -= total
+
+                picked.append(queues[task_type].popleft())
+                if not queues[task_type]:
+                    del queues[task_type]
+
+    return picked
+
+
+# claims up to n queued tasks, highest priority first, then oldest first within a task type
+# parallel workers never get the same task, the update only takes rows that are still queued
+def lease_tasks(
+    db: Session,
+    task_types: list[schemas.TaskTypes],
+    n: int = 1,
+    lease_seconds: int | None = DEFAULT_TASK_LEASE_SECONDS,
+) -> list[models.Task]:
+    now = datetime.now()
+    lease_expires = now + timedelta(seconds=lease_seconds) if lease_seconds is not None else None
+    is_mysql = _is_mysql(db)
+
+    # two seeks of the (type, status, priority, created) index per type, never a scan of the whole queue
+    candidates = {}
+    for task_type in dict.fromkeys(schemas.TaskTypes(task_type) for task_type in task_types):
+        if task_type not in TASK_TYPE_WEIGHTS:
+            continue
+
+        queued_of_type = (
+            models.Task.task_type == task_type.value,
+            models.Task.task_status == schemas.TaskStatus.QUEUED.value,
+        )
+        priority = db.scalar(
+            select(models.Task.task_priority).where(*queued_of_type).order_by(models.Task.task_priority.desc()).limit(1)
+        )
+        if priority is None:
+            continue
+
+        queued = (
+            select(models.Task.task_id)
+            .where(*queued_of_type, models.Task.task_priority == priority)
+            .order_by(models.Task.task_created, models.Task.task_id)
+            .limit(n)
+        )
+        if is_mysql:
+            # mariadb can't UPDATE ... RETURNING, lock the rows instead and skip the ones other workers hold
+            queued = queued.with_for_update(skip_locked=True)
+
+        candidates[task_type] = (priority, db.execute(queued).scalars().all())
+
+    task_ids = _schedule_tasks(candidates, n)
+    if not task_ids:
+        db.commit()
+        return []
+
+    lease = (
+        update(models.Task)
+        .values(
+            task_status=schemas.TaskStatus.RUNNING.value,
+            task_started=now,
+            task_lease_expires=lease_expires,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+    # in the order they were scheduled, sorted while loaded (the commit expires them)
+    order = {task_id: i for i, task_id in enumerate(task_ids)}
+
+    if is_mysql:
+        db.execute(lease.where(models.Task.task_id.in_(task_ids)))
+        db.commit()
+
+        tasks = db.query(models.Task).filter(models.Task.task_id.in_(task_ids)).populate_existing().all()
+        return sorted(tasks, key=lambda task: order[task.task_id])
+
+    tasks = db.scalars(
+        lease.where(
+            models.Task.task_id.in_(task_ids),
+            models.Task.task_status == schemas.TaskStatus.QUEUED.value,
+        ).returning(models.Task)
+    ).all()
+    tasks = sorted(tasks, key=lambda task: order[task.task_id])
+    db.commit()
+
+    return tasks
 
 
 def remove_completed_tasks(db: Session):
@@ -709,74 +1972,205 @@ def remove_completed_tasks(db: Session):
 # MULTIPLE TASKS GENERATION
 #
 
-# MOVIES
 
+# one INSERT INTO tasks ... SELECT for the whole table, skips jobs that are already queued/running
+# priority is an expression over the same table, where/order_by/limit pick a part of it
+def _create_tasks_from_column(
+    db: Session,
+    task_type: schemas.TaskTypes,
+    job_column,
+    priority,
+    where=None,
+    order_by: tuple = (),
+    limit: int | None = None,
+) -> int:
+    task_job = cast(job_column, String)
+    dedupe_key = literal(f"{task_type.value}:") + task_job
+
+    active_task = select(models.Task.task_id).where(models.Task.task_dedupe_key == dedupe_key)
+
+    rows = select(
+        literal(schemas.TaskStatus.QUEUED.value),
+        literal(task_type.value),
+        task_job,
+        literal(datetime.now(), DateTime),
+        dedupe_key,
+        priority,
+    ).where(~exists(active_task))
+
+    # task ids follow the job order, unless asked otherwise
+    if where is not None:
+        rows = rows.where(where)
+    rows = rows.order_by(*(order_by or (job_column,))).limit(limit)
+
+    stmt = _insert_ignore_stmt(db, models.Task).from_select(
+        ["task_status", "task_type", "task_job", "task_created", "task_dedupe_key", "task_priority"],
+        rows,
+    )
 
-def create_scrap_filmweb_users_movies_task(db: Session) -> bool:
-    filmweb_users = db.query(models.FilmWebUserMapping).all()
+    created = db.connection().execute(stmt).rowcount
+    db.commit()
 
-    for user in filmweb_users:
-        create_task(
-            db,
-            schemas.TaskCreate(
-                task_status=schemas.TaskStatus.QUEUED,
-                task_type=schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_MOVIES,
-                task_job=str(user.filmweb_id),
-            ),
-        )
+    if created:
+        wake(task_type.value)
 
-    return True
+    logging.info(f"Created {created} {task_type.value} tasks")
 
+    return created
 
-def create_scrap_filmweb_movies_task(db: Session) -> bool:
-    filmweb_movies = db.query(models.FilmWebMovie).all()
 
-    for movie in filmweb_movies:
-        create_task(
-            db,
-            schemas.TaskCreate(
-                task_status=schemas.TaskStatus.QUEUED,
-                task_type=schemas.TaskTypes.SCRAP_FILMWEB_MOVIE,
-                task_job=str(movie.id),
-            ),
-        )
+# nothing was ever stored for a user before the first scrap, it goes ahead of everyone else's
+def _user_scrap_priority():
+    return case(
+        (models.FilmWebUserMapping.watched_version == 0, schemas.TaskPriority.ONBOARDING.value),
+        else_=schemas.TaskPriority.NORMAL.value,
+    )
+
+
+# a refresh of every known title waits for the tasks of users
+def _refresh_priority():
+    return literal(schemas.TaskPriority.REFRESH.value)
+
+
+# MOVIES
 
-    return True
+
+def create_scrap_filmweb_users_movies_task(db: Session) -> int:
+    return _create_tasks_from_column(
+        db,
+        schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_MOVIES,
+        models.FilmWebUserMapping.filmweb_id,
+        _user_scrap_priority(),
+    )
+
+
+def create_scrap_filmweb_movies_task(db: Session) -> int:
+    return _create_tasks_from_column(
+        db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, models.FilmWebMovie.id, _refresh_priority()
+    )
 
 
 # SERIES
 
 
-def create_scrap_filmweb_users_series_task(db: Session) -> bool:
-    filmweb_users = db.query(models.FilmWebUserMapping).all()
+def create_scrap_filmweb_users_series_task(db: Session) -> int:
+    return _create_tasks_from_column(
+        db,
+        schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_SERIES,
+        models.FilmWebUserMapping.filmweb_id,
+        _user_scrap_priority(),
+    )
 
-    for user in filmweb_users:
-        create_task(
-            db,
-            schemas.TaskCreate(
-                task_status=schemas.TaskStatus.QUEUED,
-                task_type=schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_SERIES,
-                task_job=str(user.filmweb_id),
-            ),
-        )
 
-    return True
+def create_scrap_filmweb_series_task(db: Session) -> int:
+    return _create_tasks_from_column(
+        db, schemas.TaskTypes.SCRAP_FILMWEB_SERIES, models.FilmWebSeries.id, _refresh_priority()
+    )
 
 
-def create_scrap_filmweb_series_task(db: Session) -> bool:
-    filmweb_series = db.query(models.FilmWebSeries).all()
+# USERS (adaptive)
 
-    for series in filmweb_series:
-        create_task(
-            db,
-            schemas.TaskCreate(
-                task_status=schemas.TaskStatus.QUEUED,
-                task_type=schemas.TaskTypes.SCRAP_FILMWEB_SERIES,
-                task_job=str(series.id),
-            ),
+# a user is scraped again after an interval growing with the time since their newest rate, an hour for every
+# day without one: a dormant account backs off further with every empty scrap, a new rate brings it back to
+# the minimum. users without a discord destination are announced nowhere, they are scraped less often
+USER_SCRAP_MIN_MINUTES = 2
+USER_SCRAP_MAX_HOURS = 12
+USER_SCRAP_IDLE_DIVISOR = 24
+USER_SCRAP_NO_DESTINATION_FACTOR = 8
+# a user with a destination who rated within these days stays at the minimum (no later than the old 3 minute
+# sweep), the backoff starts counting after them
+USER_SCRAP_ACTIVE_DAYS = 3
+
+
+def _user_scrap_interval(last_rated_at: datetime | None, has_destination: bool, now: datetime) -> timedelta:
+    minimum = timedelta(minutes=USER_SCRAP_MIN_MINUTES)
+    maximum = timedelta(hours=USER_SCRAP_MAX_HOURS)
+
+    # nothing rated yet (or a private profile), checked at the slowest pace
+    if last_rated_at is None:
+        interval = maximum
+    else:
+        idle = now - last_rated_at
+        if has_destination:
+            idle -= timedelta(days=USER_SCRAP_ACTIVE_DAYS)
+        interval = min(max(idle / USER_SCRAP_IDLE_DIVISOR, minimum), maximum)
+
+    if not has_destination:
+        interval *= USER_SCRAP_NO_DESTINATION_FACTOR
+    return interval
+
+
+def _has_destination_expr():
+    return exists(
+        select(models.DiscordDestinations.user_id).where(
+            models.DiscordDestinations.user_id == models.FilmWebUserMapping.user_id
         )
+    )
 
-    return True
+
+# new or changed rates of the users, in the transaction of the write
+# the newest one becomes last_rated_at and the next scrap moves closer if the shorter interval says so
+def _set_filmweb_users_rated(db: Session, rows: list[dict]):
+    now = datetime.now()
+    newest = {}
+    for row in rows:
+        rated_at = min(_naive_local(row["date"]), now)
+        newest[row["filmweb_id"]] = max(newest.get(row["filmweb_id"], rated_at), rated_at)
+
+    mapping = models.FilmWebUserMapping
+    for chunk in _chunks(list(newest)):
+        users = db.execute(
+            select(
+                mapping.id, mapping.filmweb_id, mapping.last_rated_at, mapping.next_scrap_at, _has_destination_expr()
+            ).where(mapping.filmweb_id.in_(chunk))
+        ).all()
+
+        for mapping_id, filmweb_id, last_rated_at, next_scrap_at, has_destination in users:
+            last_rated_at = max(last_rated_at or newest[filmweb_id], newest[filmweb_id])
+            next_scrap = now + _user_scrap_interval(last_rated_at, has_destination, now)
+            if next_scrap_at is not None and next_scrap_at < next_scrap:
+                next_scrap = next_scrap_at
+
+            db.execute(
+                update(mapping)
+                .where(mapping.id == mapping_id)
+                .values(last_rated_at=last_rated_at, next_scrap_at=next_scrap)
+            )
+
+
+# queues watched movies and series scraps of the users who are due and plans their next scrap
+# returns number of created tasks
+def plan_filmweb_users_scrap(db: Session) -> int:
+    now = datetime.now()
+    mapping = models.FilmWebUserMapping
+    due = or_(mapping.next_scrap_at.is_(None), mapping.next_scrap_at <= now)
+
+    users = db.execute(select(mapping.id, mapping.last_rated_at, _has_destination_expr()).where(due)).all()
+    if not users:
+        db.commit()
+        return 0
+
+    created = 0
+    for task_type in (
+        schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_MOVIES,
+        schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_SERIES,
+    ):
+        created += _create_tasks_from_column(db, task_type, mapping.filmweb_id, _user_scrap_priority(), where=due)
+
+    # a user still due only, a rate written meanwhile has already planned a sooner scrap
+    table = mapping.__table__
+    db.connection().execute(
+        update(table)
+        .where(table.c.id == bindparam("b_id"), or_(table.c.next_scrap_at.is_(None), table.c.next_scrap_at <= now))
+        .values(next_scrap_at=bindparam("b_next_scrap_at")),
+        [
+            {"b_id": mapping_id, "b_next_scrap_at": now + _user_scrap_interval(last_rated_at, has_destination, now)}
+            for mapping_id, last_rated_at, has_destination in users
+        ],
+    )
+    db.commit()
+
+    return created
 
 
 #
@@ -785,23 +2179,131 @@ def create_scrap_filmweb_series_task(db: Session) -> bool:
 
 
 def update_stuck_tasks(db: Session, minutes: int = 15):  # dodaj minuty
+    now = datetime.now()
+
     stuck_tasks = (
         db.query(models.Task)
         .filter(models.Task.task_status == schemas.TaskStatus.RUNNING)
-        .filter(models.Task.task_started < datetime.now() - timedelta(minutes=minutes))
+        .filter(
+            or_(
+                models.Task.task_lease_expires < now,
+                and_(
+                    models.Task.task_lease_expires.is_(None),
+                    models.Task.task_started < now - timedelta(minutes=minutes),
+                ),
+            )
+        )
         .all()
     )
 
     for task in stuck_tasks:
         task.task_status = schemas.TaskStatus.QUEUED
         task.task_started = None
-        db.commit()
+        task.task_lease_expires = None
+
+    db.commit()
+
+    wake(*{schemas.TaskTypes(task.task_type).value for task in stuck_tasks})
 
     return True
 
 
+# finished tasks only, queued ones wait for their turn however low their priority (stuck ones are requeued)
+# tasks of retired types (no TASK_TYPE_WEIGHTS) are never claimed, they are removed whatever their status
 def update_old_tasks(db: Session, minutes: int = 30):
-    db.query(models.Task).filter(models.Task.task_created < datetime.now() - timedelta(minutes=minutes)).delete()
+    db.query(models.Task).filter(
+        models.Task.task_status.in_([schemas.TaskStatus.COMPLETED.value, schemas.TaskStatus.ERROR.value]),
+        models.Task.task_created < datetime.now() - timedelta(minutes=minutes),
+    ).delete(synchronize_session=False)
+    db.query(models.Task).filter(
+        models.Task.task_type.not_in([task_type.value for task_type in TASK_TYPE_WEIGHTS])
+    ).delete(synchronize_session=False)
     db.commit()
 
     return True
+
+
+#
+# TASKS STATS
+#
+
+# average wait is over the tasks started in this window, finished tasks are removed by the cron after 20 minutes
+TASK_STATS_WINDOW_MINUTES = 30
+
+
+def _seconds_between_expr(db: Session, start, end):
+    if _is_mysql(db):
+        return func.timestampdiff(literal_column("SECOND"), start, end)
+    return (func.julianday(end) - func.julianday(start)) * 86400
+
+
+# queue depth and age by task type and priority, one grouped scan of the tasks table
+def get_task_queue_stats(db: Session) -> list[schemas.TaskQueueStats]:
+    now = datetime.now()
+    task = models.Task
+    queued = task.task_status == schemas.TaskStatus.QUEUED.value
+
+    rows = db.execute(
+        select(
+            task.task_type,
+            task.task_priority,
+            func.sum(case((queued, 1), else_=0)),
+            func.sum(case((task.task_status == schemas.TaskStatus.RUNNING.value, 1), else_=0)),
+            func.min(case((queued, task.task_created))),
+            func.avg(
+                case(
+                    (
+                        task.task_started >= now - timedelta(minutes=TASK_STATS_WINDOW_MINUTES),
+                        _seconds_between_expr(db, task.task_created, task.task_started),
+                    )
+                )
+            ),
+        )
+        .where(task.task_type.in_([task_type.value for task_type in schemas.TaskTypes]))
+        .group_by(task.task_type, task.task_priority)
+        .order_by(task.task_priority.desc(), task.task_type)
+    ).all()
+
+    return [
+        schemas.TaskQueueStats(
+            task_type=task_type,
+            task_priority=priority,
+            queued=queued_count or 0,
+            running=running or 0,
+            oldest_queued_age=(now - oldest_queued).total_seconds() if oldest_queued is not None else None,
+            average_wait=round(float(average_wait), 3) if average_wait is not None else None,
+        )
+        for task_type, priority, queued_count, running, oldest_queued, average_wait in rows
+        if queued_count or running or average_wait is not None
+    ]
+
+
+#
+# UTILS
+#
+
+
+def _count(model):
+    return select(func.count()).select_from(model).scalar_subquery()
+
+
+# COUNT(*) only, one round trip for the table counters and one for the task queue
+def get_database_info(db: Session) -> schemas.DatabaseInfo:
+    counts = db.execute(
+        select(
+            _count(models.User).label("users_count"),
+            _count(models.FilmWebUserWatchedMovie).label("filmweb_watched_movies"),
+            _count(models.FilmWebUserWatchedSeries).label("filmweb_watched_series"),
+            _count(models.DiscordGuilds).label("discord_guilds"),
+            _count(models.FilmWebMovie).label("filmweb_movies"),
+            _count(models.FilmWebSeries).label("filmweb_series"),
+        )
+    ).one()
+
+    tasks = {status.value: 0 for status in schemas.TaskStatus}
+    for task_status, count in db.execute(
+        select(models.Task.task_status, func.count()).group_by(models.Task.task_status)
+    ):
+        tasks[task_status] = count
+
+    return schemas.DatabaseInfo(**counts._mapping, tasks=tasks, generated_at=datetime.now())
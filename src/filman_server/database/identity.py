@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from . import models
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# discord_id <-> user_id <-> filmweb_id, resolved with one joined query and cached
+# only users with a mapping are cached, writes that change a mapping call invalidate()
+
+IDENTITY_CACHE_TTL_SECONDS = float(os.environ.get("IDENTITY_CACHE_TTL_SECONDS", "300"))
+# shared cache for multiple server replicas, needs the redis package
+IDENTITY_CACHE_REDIS_URL = os.environ.get("IDENTITY_CACHE_REDIS_URL")
+IDENTITY_CACHE_MAX_SIZE = 10000
+
+
+class Identity(NamedTuple):
+    user_id: int
+    discord_id: int
+    filmweb_id: str
+
+
+def _key(user_id: int | None, filmweb_id: str | None, discord_id: int | None) -> str | None:
+    # same precedence as crud.get_user
+    if user_id:
+        return f"identity:user:{user_id}"
+    elif filmweb_id:
+        return f"identity:filmweb:{filmweb_id}"
+    elif discord_id:
+        return f"identity:discord:{discord_id}"
+    else:
+        return None
+
+
+def _keys(identity: Identity) -> list[str]:
+    return [
+        _key(identity.user_id, None, None),
+        _key(None, identity.filmweb_id, None),
+        _key(None, None, identity.discord_id),
+    ]
+
+
+class MemoryBackend:
+    blocking = False
+
+    def __init__(self, max_size: int = IDENTITY_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._data: dict[str, tuple[float, Identity]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Identity | None:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set_many(self, keys: list[str], identity: Identity, ttl: float):
+        expires = time.monotonic() + ttl
+        with self._lock:
+            if len(self._data) + len(keys) > self.max_size:
+                now = time.monotonic()
+                self._data = {k: v for k, v in self._data.items() if v[0] >= now}
+                if len(self._data) + len(keys) > self.max_size:
+                    self._data.clear()
+            for key in keys:
+                self._data[key] = (expires, identity)
+
+    def delete_many(self, keys: list[str]):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend:
+    # every call is a network round trip, the async path runs them in the threadpool
+    blocking = True
+
+    def __init__(self, url: str):
+        import redis  # optional dependency, only needed with IDENTITY_CACHE_REDIS_URL
+
+        # short timeouts, a slow cache must not be slower than the database
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.1, socket_connect_timeout=0.1)
+
+    def get(self, key: str) -> Identity | None:
+        value = self._redis.get(key)
+        return Identity(*json.loads(value)) if value is not None else None
+
+    def set_many(self, keys: list[str], identity: Identity, ttl: float):
+        value = json.dumps(list(identity))
+        with self._redis.pipeline() as pipe:
+            for key in keys:
+                pipe.set(key, value, px=int(ttl * 1000))
+            pipe.execute()
+
+    def delete_many(self, keys: list[str]):
+        self._redis.delete(*keys)
+
+    def clear(self):
+        for key in self._redis.scan_iter("identity:*"):
+            self._redis.delete(key)
+
+
+class IdentityCache:
+    def __init__(self, backend, ttl: float = IDENTITY_CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+
+    # cache errors are logged and treated as a miss, the database is always the source of truth
+    def get(self, user_id: int | None, filmweb_id: str | None, discord_id: int | None) -> Identity | None:
+        key = _key(user_id, filmweb_id, discord_id)
+        if key is None or self.ttl <= 0:
+            return None
+        try:
+            return self.backend.get(key)
+        except Exception as e:
+            logging.warning(f"Identity cache get failed: {e}")
+            return None
+
+    def set(self, identity: Identity):
+        if self.ttl <= 0:
+            return
+        try:
+            self.backend.set_many(_keys(identity), identity, self.ttl)
+        except Exception as e:
+            logging.warning(f"Identity cache set failed: {e}")
+
+    # same as get/set, off the event loop when the backend blocks
+    async def get_async(self, user_id: int | None, filmweb_id: str | None, discord_id: int | None) -> Identity | None:
+        if not self.backend.blocking:
+            return self.get(user_id, filmweb_id, discord_id)
+        return await run_in_threadpool(self.get, user_id, filmweb_id, discord_id)
+
+    async def set_async(self, identity: Identity):
+        if not self.backend.blocking:
+            return self.set(identity)
+        await run_in_threadpool(self.set, identity)
+
+    def invalidate(
+        self,
+        user_id: int | None = None,
+        filmweb_id: str | None = None,
+        discord_id: int | None = None,
+    ):
+        keys = [
+            key
+            for key in (_key(user_id, None, None), _key(None, filmweb_id, None), _key(None, None, discord_id))
+            if key is not None
+        ]
+        if not keys:
+            return
+        try:
+            self.backend.delete_many(keys)
+        except Exception as e:
+            logging.warning(f"Identity cache invalidate failed: {e}")
+
+    def clear(self):
+        self.backend.clear()
+
+
+def _create_backend():
+    if IDENTITY_CACHE_REDIS_URL:
+        try:
+            return RedisBackend(IDENTITY_CACHE_REDIS_URL)
+        except ImportError:
+            logging.error("IDENTITY_CACHE_REDIS_URL is set but redis is not installed, using in-process cache")
+    return MemoryBackend()
+
+
+identity_cache = IdentityCache(_create_backend())
+
+
+def _identity_query(user_id: int | None, filmweb_id: str | None, discord_id: int | None):
+    query = select(models.User.id, models.User.discord_id, models.FilmWebUserMapping.filmweb_id).join(
+        models.FilmWebUserMapping, models.FilmWebUserMapping.user_id == models.User.id
+    )
+
+    if user_id:
+        query = query.where(models.User.id == user_id)
+    elif filmweb_id:
+        query = query.where(models.FilmWebUserMapping.filmweb_id == filmweb_id)
+    elif discord_id:
+        query = query.where(models.User.discord_id == discord_id)
+    else:
+        return None
+
+    return query.limit(1)
+
+
+# user + filmweb mapping in one query, None when the user doesn't exist or has no mapping
+def resolve_identity(
+    db: Session,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+) -> Identity | None:
+    identity = identity_cache.get(user_id, filmweb_id, discord_id)
+    if identity is not None:
+        return identity
+
+    query = _identity_query(user_id, filmweb_id, discord_id)
+    if query is None:
+        return None
+
+    row = db.execute(query).first()
+    if row is None:
+        return None
+
+    identity = Identity(*row)
+    identity_cache.set(identity)
+    return identity
+
+
+async def resolve_identity_async(
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+) -> Identity | None:
+    identity = await identity_cache.get_async(user_id, filmweb_id, discord_id)
+    if identity is not None:
+        return identity
+
+    query = _identity_query(user_id, filmweb_id, discord_id)
+    if query is None:
+        return None
+
+    row = (await db.execute(query)).first()
+    if row is None:
+        return None
+
+    identity = Identity(*row)
+    await identity_cache.set_async(identity)
+    return identity
@@ -1,4 +1,18 @@
-from sqlalchemy import BIGINT, VARCHAR, Boolean, Column, DateTime, Float, ForeignKey, Integer, SmallInteger, String
+from sqlalchemy import (
+    BIGINT,
+    JSON,
+    VARCHAR,
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    SmallInteger,
+    String,
+)
 from sqlalchemy.orm import relationship
 
 from .db import Base
@@ -26,6 +40,16 @@ class FilmWebUserMapping(Base):
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True, unique=True)
     filmweb_id = Column(String(128), index=True, unique=True)
+    # numeric filmweb.pl userId of the nick, resolved once when the mapping is set
+    filmweb_user_id = Column(BIGINT, nullable=True)
+    # last check of the nick against filmweb.pl, NULL never checked (see revalidate route)
+    filmweb_user_id_checked_at = Column(DateTime, nullable=True)
+    # bumped on every change of this user's watched movies/series, used as their ETag
+    watched_version = Column(Integer, nullable=False, default=0, server_default="0")
+    # newest rate seen by the scraps (NULL none yet), the scrap planner backs off from it (crud.USER_SCRAP_*)
+    last_rated_at = Column(DateTime, nullable=True)
+    # NULL is due at once (new mapping, changed nick, new discord destination)
+    next_scrap_at = Column(DateTime, nullable=True, index=True)
 
     user = relationship("User", back_populates="filmweb_user_mapping")
     watched_movies = relationship(
@@ -60,6 +84,9 @@ class DiscordDestinations(Base):
     discord_guild_id = Column(BIGINT, ForeignKey("discord_guilds.discord_guild_id"), primary_key=True)
     user = relationship("User", back_populates="discord_destinations")
 
+    # members of a guild (guild stats), the primary key starts with user_id
+    __table_args__ = (Index("ix_discord_destinations_discord_guild_id", "discord_guild_id", "user_id"),)
+
 
 #
 # FILMWEB
@@ -75,6 +102,9 @@ class __FilmwebMedia(Base):
     poster_url = Column(String(128))
     community_rate = Column(Float)
     critics_rate = Column(Float)
+    # NULL until the first scrap, the refresh planner picks titles by next_refresh_at
+    last_scraped_at = Column(DateTime)
+    next_refresh_at = Column(DateTime, index=True)
 
 
 class FilmWebMovie(__FilmwebMedia):
@@ -107,6 +137,14 @@ class FilmWebUserWatchedMovie(__FilmwebWatched):
         index=True,
     )
 
+    # covering index for "which ids (and rates) does this user have" queries, never touches the table
+    # (filmweb_id, date, id_media) serves the newest-first keyset pagination of get_all
+    # and with rate the guild title stats of a period
+    __table_args__ = (
+        Index("ix_filmweb_user_watched_movies_filmweb_id_id_media_rate", "filmweb_id", "id_media", "rate"),
+        Index("ix_filmweb_user_watched_movies_filmweb_id_date", "filmweb_id", "date", "id_media", "rate"),
+    )
+
     movie = relationship("FilmWebMovie", backref="filmweb_user_watched_movies")
     filmweb_user_mapping = relationship("FilmWebUserMapping", back_populates="watched_movies")
 
@@ -122,10 +160,158 @@ class FilmWebUserWatchedSeries(__FilmwebWatched):
         index=True,
     )
 
+    # covering index for "which ids (and rates) does this user have" queries, never touches the table
+    # (filmweb_id, date, id_media) serves the newest-first keyset pagination of get_all
+    # and with rate the guild title stats of a period
+    __table_args__ = (
+        Index("ix_filmweb_user_watched_series_filmweb_id_id_media_rate", "filmweb_id", "id_media", "rate"),
+        Index("ix_filmweb_user_watched_series_filmweb_id_date", "filmweb_id", "date", "id_media", "rate"),
+    )
+
     series = relationship("FilmWebSeries", backref="filmweb_user_watched_series")
     filmweb_user_mapping = relationship("FilmWebUserMapping", back_populates="watched_series")
 
 
+#
+# STATS
+#
+
+
+# counters of a user's watched movies or series, kept up to date by every watched write (crud.py STATS)
+# average rate is rate_sum / rated, rate_1..rate_10 is the histogram of rates
+class FilmWebUserStats(Base):
+    __tablename__ = "filmweb_user_stats"
+
+    filmweb_id = Column(
+        String(128),
+        ForeignKey("filmweb_user_mapping.filmweb_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    media_type = Column(String(16), primary_key=True)  # schemas.MediaType
+
+    watched = Column(Integer, nullable=False, default=0, server_default="0")
+    rated = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_1 = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_2 = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_3 = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_4 = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_5 = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_6 = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_7 = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_8 = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_9 = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_10 = Column(Integer, nullable=False, default=0, server_default="0")
+    favorites = Column(Integer, nullable=False, default=0, server_default="0")
+    first_watched = Column(DateTime)
+    last_watched = Column(DateTime)
+
+
+class FilmWebUserStatsMonthly(Base):
+    __tablename__ = "filmweb_user_stats_monthly"
+
+    filmweb_id = Column(
+        String(128),
+        ForeignKey("filmweb_user_mapping.filmweb_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    media_type = Column(String(16), primary_key=True)
+    month = Column(String(7), primary_key=True)  # "YYYY-MM"
+
+    watched = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+# per user per day rollup for guild stats (most active raters, activity heatmap)
+# (filmweb_id, day) leads the key, a guild reads one short range per member
+# clustered by the key on sqlite too (innodb always is), the range never touches another page
+class FilmWebUserActivityDaily(Base):
+    __tablename__ = "filmweb_user_activity_daily"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    filmweb_id = Column(
+        String(128),
+        ForeignKey("filmweb_user_mapping.filmweb_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    day = Column(Date, primary_key=True)
+    media_type = Column(String(16), primary_key=True)
+
+    watched = Column(Integer, nullable=False, default=0, server_default="0")
+    rated = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_sum = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+# per guild per title per day rollup of the members' watched rows (guild top rated / most watched)
+# written with the same deltas as the user stats, rebuilt for a guild when its members change (crud.py STATS)
+# (discord_guild_id, media_type, day) leads the key, a guild's period is a single range
+class DiscordGuildTitleDaily(Base):
+    __tablename__ = "discord_guild_title_daily"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    discord_guild_id = Column(
+        BIGINT,
+        ForeignKey("discord_guilds.discord_guild_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    media_type = Column(String(16), primary_key=True)
+    day = Column(Date, primary_key=True)
+    id_media = Column(Integer, primary_key=True)
+
+    watched = Column(Integer, nullable=False, default=0, server_default="0")
+    rated = Column(Integer, nullable=False, default=0, server_default="0")
+    rate_sum = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+#
+# RECOMMEND
+#
+
+
+# top K most similar titles of each title (item-item, adjusted cosine over user rates)
+# rebuilt as a whole in the background (recommend.py), media_type picks movies or series ids
+# id_media leads the primary key, recommendations join it from the user's watched rows
+class FilmWebMediaSimilarity(Base):
+    __tablename__ = "filmweb_media_similarity"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    id_media = Column(Integer, primary_key=True)
+    media_type = Column(String(16), primary_key=True)  # schemas.MediaType
+    id_similar = Column(Integer, primary_key=True)
+    similarity = Column(Float, nullable=False)
+
+
+#
+# NOTIFICATIONS
+#
+
+
+# discord notifications of new watched titles, written in the transaction of the watched insert (crud.py)
+# consumers read pending rows with id > their cursor in id order and ack them, one row per watched title
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+
+    # AUTOINCREMENT on sqlite too, ids are never reused after a cleanup so cursors stay valid
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    filmweb_id = Column(
+        String(128),
+        ForeignKey("filmweb_user_mapping.filmweb_id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    media_type = Column(String(16), nullable=False)  # schemas.MediaType
+    media_id = Column(Integer, nullable=False)
+    payload = Column(JSON, nullable=False)  # schemas.NotificationPayload
+    status = Column(String(16), nullable=False)  # schemas.NotificationStatus
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    created = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_notification_outbox_filmweb_id_media", "filmweb_id", "media_type", "media_id", unique=True),
+        # pending rows after a cursor are one range of this index
+        Index("ix_notification_outbox_status_id", "status", "id"),
+        {"sqlite_autoincrement": True},
+    )
+
+
 #
 # TASKS
 #
@@ -141,3 +327,13 @@ class Task(Base):
     task_created = Column(DateTime)
     task_started = Column(DateTime)
     task_finished = Column(DateTime)
+    task_lease_expires = Column(DateTime)
+    # "{task_type}:{task_job}" while queued/running, NULL otherwise
+    task_dedupe_key = Column(String(321), unique=True)
+    # higher is claimed first (schemas.TaskPriority)
+    task_priority = Column(Integer, nullable=False, default=1, server_default="1")
+
+    __table_args__ = (
+        # a claim seeks the oldest queued tasks of one type at its highest priority
+        Index("ix_tasks_type_status_priority_created", "task_type", "task_status", "task_priority", "task_created"),
+    )
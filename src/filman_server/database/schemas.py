@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from enum import Enum
 from typing import Optional
 
@@ -35,6 +35,7 @@ class FilmWebUserMapping(BaseModel):
     id: int
     user_id: int
     filmweb_id: str
+    filmweb_user_id: int | None = None
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -44,6 +45,12 @@ class FilmWebUserMappingCreate(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class FilmWebUserMappingRevalidateResult(BaseModel):
+    checked: int
+    changed: int  # nick now resolves to another (or a first) userId
+    not_found: int  # nick is gone from filmweb, the stored userId is kept
+
+
 # class UserPreferencesCreate(BaseModel):
 #     discord_color: str
 
@@ -162,6 +169,12 @@ class FilmWebSeriesCreate(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class FilmWebMediaUpdateManyResult(BaseModel):
+    inserted: int
+    changed: int
+    unchanged: int
+
+
 class FilmWebUserWatchedSeries(BaseModel):
     series: FilmWebSeries
     filmweb_id: str
@@ -184,6 +197,179 @@ class FilmWebUserWatchedSeriesCreate(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+# BULK WATCHED
+
+
+class WatchedUpsertStatus(str, Enum):
+    CREATED = "created"
+    UPDATED = "updated"
+    UNCHANGED = "unchanged"
+
+
+class FilmWebUserWatchedUpsertResult(BaseModel):
+    id_media: int
+    filmweb_id: str
+    status: WatchedUpsertStatus
+
+
+class WatchedOrder(str, Enum):
+    ASC = "asc"
+    DESC = "desc"
+
+
+class FilmWebUserWatchedDiffItem(BaseModel):
+    id_media: int
+    date: datetime | None = None
+    rate: int | None = None
+
+
+class FilmWebUserWatchedDiffResult(BaseModel):
+    ids: list[int]  # new or changed, in request order
+    has_watched: bool  # false on the first scrap of a user
+
+
+# EXPORT
+
+
+class ExportFormat(str, Enum):
+    JSON = "json"
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+#
+# STATS
+#
+
+
+class MediaType(str, Enum):
+    MOVIE = "movie"
+    SERIES = "series"
+
+
+class FilmWebUserStatsMonth(BaseModel):
+    month: str  # YYYY-MM
+    watched: int
+
+
+class FilmWebUserMediaStats(BaseModel):
+    watched: int = 0
+    rated: int = 0
+    average_rate: float | None = None
+    rate_histogram: list[int] = [0] * 10  # count of rates 1..10
+    favorites: int = 0
+    first_watched: datetime | None = None
+    last_watched: datetime | None = None
+    months: list[FilmWebUserStatsMonth] = []
+
+
+class FilmWebUserStats(BaseModel):
+    filmweb_id: str
+    movies: FilmWebUserMediaStats
+    series: FilmWebUserMediaStats
+
+
+class StatsPeriod(str, Enum):
+    WEEK = "week"  # last 7 days, today included
+    MONTH = "month"  # last 30 days
+    YEAR = "year"  # last 365 days
+
+
+class GuildRater(BaseModel):
+    discord_id: int
+    filmweb_id: str
+    watched: int
+    rated: int
+    average_rate: float | None = None
+
+
+class GuildTitle(BaseModel):
+    id_media: int
+    title: str | None = None
+    year: int | None = None
+    poster_url: str | None = None
+    watched: int  # by guild members in the period
+    rated: int
+    average_rate: float | None = None
+
+
+class GuildActivityDay(BaseModel):
+    day: date
+    watched: int
+    rated: int
+
+
+class TasteCompatibility(BaseModel):
+    discord_id: int
+    filmweb_id: str
+    other_discord_id: int
+    other_filmweb_id: str
+    common: int  # titles rated by both
+    pearson: float  # correlation of their rates of the common titles, -1..1
+    cosine: float  # cosine similarity of the same rates
+
+
+#
+# RECOMMEND
+#
+
+
+class Recommendation(BaseModel):
+    id_media: int
+    title: str | None = None
+    year: int | None = None
+    poster_url: str | None = None
+    score: float  # expected rate, 1..10
+    predicted_rate: float  # from the user's rates of similar titles only
+    guild_rated: int = 0  # guild members who rated it
+    guild_average_rate: float | None = None
+
+
+class RecommendRebuildResult(BaseModel):
+    started: bool  # false when a rebuild is running or nothing was watched/rated since the last one
+
+
+#
+# NOTIFICATIONS
+#
+
+
+class NotificationStatus(str, Enum):
+    PENDING = "pending"
+    DELIVERED = "delivered"
+    FAILED = "failed"  # given up after crud.NOTIFICATION_MAX_ATTEMPTS
+
+
+# the watched row as it was when the title was added
+class NotificationPayload(BaseModel):
+    date: datetime
+    rate: int | None = None
+    comment: str | None = None
+    favorite: bool
+
+
+class Notification(BaseModel):
+    id: int
+    filmweb_id: str
+    media_type: MediaType
+    media_id: int
+    payload: NotificationPayload
+    status: NotificationStatus
+    attempts: int
+    created: datetime
+    model_config = ConfigDict(from_attributes=True)
+
+
+class NotificationAck(BaseModel):
+    delivered: list[int] = []
+    failed: list[int] = []  # tried again by the next read until the attempts run out
+
+
+class NotificationAckResult(BaseModel):
+    delivered: int
+    failed: int
+
+
 #
 # TASKS
 #
@@ -205,6 +391,13 @@ class TaskStatus(str, Enum):
     ERROR = "error"
 
 
+# higher is claimed first, task types take turns by weight within a priority (crud.TASK_TYPE_WEIGHTS)
+class TaskPriority(int, Enum):
+    REFRESH = 0  # periodic refresh of every known title
+    NORMAL = 1
+    ONBOARDING = 2  # first scrap of a new user
+
+
 class Task(BaseModel):
     task_id: int
     task_status: TaskStatus
@@ -213,6 +406,8 @@ class Task(BaseModel):
     task_created: datetime
     task_started: Optional[datetime] = None
     task_finished: Optional[datetime] = None
+    task_lease_expires: Optional[datetime] = None
+    task_priority: TaskPriority = TaskPriority.NORMAL
     model_config = ConfigDict(from_attributes=True)
 
 
@@ -223,9 +418,24 @@ class TaskCreate(BaseModel):
     task_created: Optional[datetime] = None
     task_started: Optional[datetime] = None
     task_finished: Optional[datetime] = None
+    task_priority: TaskPriority = TaskPriority.NORMAL  # a duplicate of a queued task raises its priority to this
     model_config = ConfigDict(from_attributes=True)
 
 
+class TaskBulkCreateResult(BaseModel):
+    inserted: int
+    deduplicated: int
+
+
+class TaskQueueStats(BaseModel):
+    task_type: TaskTypes
+    task_priority: TaskPriority
+    queued: int
+    running: int
+    oldest_queued_age: float | None = None  # seconds the oldest queued task is waiting
+    average_wait: float | None = None  # seconds from created to started, crud.TASK_STATS_WINDOW_MINUTES
+
+
 #
 # UTILS
 #
@@ -236,3 +446,7 @@ class DatabaseInfo(BaseModel):
     filmweb_watched_movies: int
     filmweb_watched_series: int
     discord_guilds: int
+    filmweb_movies: int
+    filmweb_series: int
+    tasks: dict[str, int]  # queue depth by task status
+    generated_at: datetime  # snapshot time, the endpoint caches it for a few seconds
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, TypeVar
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+# long-poll of the claim endpoints (?wait=), a request with nothing to return sleeps until a writer
+# of this process wakes it right after its commit, or until the next re-read of the database
+# (tasks/notifications written by another replica are only seen by that re-read)
+# topics are task type values and NOTIFICATIONS_TOPIC
+
+LONG_POLL_MAX_WAIT_SECONDS = 60
+LONG_POLL_RECHECK_SECONDS = float(os.environ.get("LONG_POLL_RECHECK_SECONDS", "5"))
+
+NOTIFICATIONS_TOPIC = "notifications"
+
+T = TypeVar("T")
+
+# topic -> waiting requests, (event loop, event) each, writers run in threadpool threads
+_waiters: dict[str, set[tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+_lock = threading.Lock()
+
+
+# called by crud after the commit, safe from any thread
+def wake(*topics: str):
+    with _lock:
+        waiters = {waiter for topic in topics for waiter in _waiters.get(topic, ())}
+
+    for loop, event in waiters:
+        loop.call_soon_threadsafe(event.set)
+
+
+@contextmanager
+def _listen(topics: Iterable[str]):
+    waiter = (asyncio.get_running_loop(), asyncio.Event())
+    topics = set(topics)
+
+    with _lock:
+        for topic in topics:
+            _waiters.setdefault(topic, set()).add(waiter)
+    try:
+        yield waiter[1]
+    finally:
+        with _lock:
+            for topic in topics:
+                _waiters[topic].discard(waiter)
+                if not _waiters[topic]:
+                    del _waiters[topic]
+
+
+# runs fetch (sync crud) until it returns something or wait seconds pass, wait 0 is a single read
+async def long_poll(db: Session, fetch: Callable[[], T], topics: Iterable[str], wait: float) -> T:
+    deadline = time.monotonic() + wait
+
+    def read() -> T:
+        result = fetch()
+        if not result:
+            # the connection goes back to the pool while waiting, and the next read gets
+            # a fresh snapshot (repeatable read on mariadb would never see the new rows)
+            db.rollback()
+        return result
+
+    while True:
+        # listening before the read, a commit between the read and the wait still wakes us
+        with _listen(topics) as woken:
+            result = await run_in_threadpool(read)
+
+            remaining = deadline - time.monotonic()
+            if result or remaining <= 0:
+                return result
+
+            try:
+                await asyncio.wait_for(woken.wait(), min(remaining, LONG_POLL_RECHECK_SECONDS))
+            except asyncio.TimeoutError:
+                pass
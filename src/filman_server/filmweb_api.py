@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote
+
+import httpx
+from fake_useragent import UserAgent
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# filmweb.pl lookups done by the server itself (nick -> numeric userId on /filmweb me)
+# one pooled async client, the event loop is never blocked by a slow filmweb
+
+FILMWEB_API_URL = "https://www.filmweb.pl/api/v1"
+FILMWEB_LOOKUP_TIMEOUT_SECONDS = float(os.environ.get("FILMWEB_LOOKUP_TIMEOUT_SECONDS", "5"))
+# nicks rarely change owner, unknown nicks are retried sooner (typos fixed, new accounts)
+FILMWEB_LOOKUP_TTL_SECONDS = float(os.environ.get("FILMWEB_LOOKUP_TTL_SECONDS", "86400"))
+FILMWEB_LOOKUP_NEGATIVE_TTL_SECONDS = float(os.environ.get("FILMWEB_LOOKUP_NEGATIVE_TTL_SECONDS", "300"))
+FILMWEB_LOOKUP_CACHE_MAX_SIZE = 10000
+
+_user_agent: str | None = None
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _get_user_agent() -> str:
+    # building UserAgent() reads its whole browser database, do it once per process
+    global _user_agent
+    if _user_agent is None:
+        _user_agent = UserAgent().random
+    return _user_agent
+
+
+def _get_client() -> httpx.AsyncClient:
+    # the client is bound to the loop it was created on (tests run a loop per TestClient)
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            base_url=FILMWEB_API_URL,
+            headers={"User-Agent": _get_user_agent()},
+            timeout=FILMWEB_LOOKUP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close_client():
+    global _client, _client_loop
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+class LookupCache:
+    # nick -> (expires, userId or None), None is a cached "no such user"
+    def __init__(self, max_size: int = FILMWEB_LOOKUP_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._data: dict[str, tuple[float, int | None]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, filmweb_id: str) -> tuple[bool, int | None]:
+        entry = self._data.get(filmweb_id)
+        if entry is None or entry[0] < time.monotonic():
+            return False, None
+        return True, entry[1]
+
+    def set(self, filmweb_id: str, user_id: int | None):
+        ttl = FILMWEB_LOOKUP_TTL_SECONDS if user_id is not None else FILMWEB_LOOKUP_NEGATIVE_TTL_SECONDS
+        if ttl <= 0:
+            return
+        with self._lock:
+            if len(self._data) >= self.max_size:
+                now = time.monotonic()
+                self._data = {k: v for k, v in self._data.items() if v[0] >= now}
+                if len(self._data) >= self.max_size:
+                    self._data.clear()
+            self._data[filmweb_id] = (time.monotonic() + ttl, user_id)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+lookup_cache = LookupCache()
+
+
+class FilmwebUnavailable(Exception):
+    """filmweb.pl could not answer (timeout, 5xx...), the result is unknown and not cached"""
+
+
+async def _request_filmweb_user_id(filmweb_id: str) -> int | None:
+    try:
+        response = await _get_client().get(f"/users/{quote(filmweb_id)}/id")
+    except httpx.HTTPError as exc:
+        raise FilmwebUnavailable(f"Error fetching Filmweb user id for {filmweb_id}: {exc!r}") from exc
+
+    if response.status_code >= 500 or response.status_code == 429:
+        raise FilmwebUnavailable(f"Filmweb user id lookup failed for {filmweb_id}: HTTP {response.status_code}")
+
+    if response.status_code != 200:
+        logging.warning(f"Filmweb user id lookup failed for {filmweb_id}: HTTP {response.status_code}")
+        return None
+
+    try:
+        user_id = response.json().get("userId")
+        return int(user_id) if user_id is not None else None
+    except Exception as exc:
+        logging.error(f"Error parsing Filmweb user id response for {filmweb_id}: {exc}")
+        return None
+
+
+# numeric filmweb userId of a nick, None when filmweb says the user doesn't exist
+# raises FilmwebUnavailable when filmweb can't be reached, that answer is never cached
+# fresh skips the cache (re-validation), the answer still refreshes it
+async def fetch_filmweb_user_id(filmweb_id: str, fresh: bool = False) -> int | None:
+    if not fresh:
+        hit, user_id = lookup_cache.get(filmweb_id)
+        if hit:
+            return user_id
+
+    user_id = await _request_filmweb_user_id(filmweb_id)
+    lookup_cache.set(filmweb_id, user_id)
+    return user_id
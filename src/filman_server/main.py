@@ -13,7 +13,7 @@ from filman_server.cron import Cron
 from filman_server.database import models
 from filman_server.database.migrate import trigger_migrations
 from filman_server.database.db import engine
-from filman_server.routes import discord, filmweb, tasks, users, utils
+from filman_server.routes import discord, filmweb, notifications, recommend, stats, tasks, users, utils
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 logging.basicConfig(
@@ -46,6 +46,9 @@ app.include_router(users.users_router)
 app.include_router(discord.discord_router)
 app.include_router(filmweb.filmweb_router)
 app.include_router(tasks.tasks_router)
+app.include_router(notifications.notifications_router)
+app.include_router(stats.stats_router)
+app.include_router(recommend.recommend_router)
 app.include_router(utils.utils_router)
 
 
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from filman_server.database import async_crud, crud, schemas
+from filman_server.similarity import item_neighbours
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+# item-item recommendations: similarities are rebuilt in a worker process (cron -> /recommend/rebuild),
+# a request only reads the stored neighbours of the titles the user rated
+
+RECOMMEND_NEIGHBOURS = int(os.environ.get("RECOMMEND_NEIGHBOURS", "30"))  # stored per title
+RECOMMEND_MIN_COMMON = int(os.environ.get("RECOMMEND_MIN_COMMON", "3"))  # users who rated both titles
+RECOMMEND_WORKERS = int(os.environ.get("RECOMMEND_WORKERS", "1"))
+# a guild member's rate counts as much as a rated title of this similarity
+RECOMMEND_GUILD_WEIGHT = float(os.environ.get("RECOMMEND_GUILD_WEIGHT", "0.5"))
+# best candidates by the user's rates only that are scored with guild rates
+RECOMMEND_CANDIDATES = 500
+
+_pool: ProcessPoolExecutor | None = None
+_rebuild_running = False
+_rebuilt_fingerprint: tuple[int, int] | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    # default start method (fork on linux), spawn would import filman_server.main again in the worker
+    # the worker only runs numpy on the arrays it is sent
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RECOMMEND_WORKERS)
+    return _pool
+
+
+# one rebuild at a time, and only when something was watched or rated since the last one
+def claim_rebuild(fingerprint: tuple[int, int], force: bool = False) -> bool:
+    global _rebuild_running
+    if _rebuild_running or (not force and fingerprint == _rebuilt_fingerprint):
+        return False
+    _rebuild_running = True
+    return True
+
+
+# (user, id_media, rate) arrays, nicks become small ints so the worker gets compact arrays
+def _load_rates(db: Session, media_type: schemas.MediaType) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    users: dict[str, int] = {}
+    user_index, id_media, rates = [], [], []
+
+    for rows in crud.iter_filmweb_user_rates(db, media_type):
+        user_index.append(np.fromiter((users.setdefault(row[0], len(users)) for row in rows), np.int64, len(rows)))
+        id_media.append(np.fromiter((row[1] for row in rows), np.int64, len(rows)))
+        rates.append(np.fromiter((row[2] for row in rows), np.float32, len(rows)))
+
+    if not rates:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32)
+    return np.concatenate(user_index), np.concatenate(id_media), np.concatenate(rates)
+
+
+async def _rebuild_media_similarities(db: Session, media_type: schemas.MediaType) -> int:
+    users, id_media, rates = await run_in_threadpool(_load_rates, db, media_type)
+
+    loop = asyncio.get_running_loop()
+    neighbours = await loop.run_in_executor(
+        _get_pool(),
+        item_neighbours,
+        users,
+        id_media,
+        rates,
+        RECOMMEND_NEIGHBOURS,
+        RECOMMEND_MIN_COMMON,
+    )
+
+    return await run_in_threadpool(
+        crud.set_filmweb_media_similarities, db, media_type, *[column.tolist() for column in neighbours]
+    )
+
+
+# background task of the rebuild route, claim_rebuild() must have returned True
+# bind is the engine of the request, the request session is closed by now
+async def rebuild_similarities(bind, fingerprint: tuple[int, int]):
+    global _rebuild_running, _rebuilt_fingerprint
+    try:
+        with Session(bind=bind, autoflush=False) as db:
+            for media_type in schemas.MediaType:
+                written = await _rebuild_media_similarities(db, media_type)
+                logging.info(f"Rebuilt {media_type.value} similarities: {written} pairs")
+        _rebuilt_fingerprint = fingerprint
+    except Exception:
+        logging.exception("Rebuilding similarities failed")
+    finally:
+        _rebuild_running = False
+
+
+# titles the user hasn't watched, from the neighbours of the titles they rated
+# expected rate = weighted mean of the user's rates of similar titles (weight = similarity),
+# the rates of guild members (RECOMMEND_GUILD_WEIGHT each) and the user's mean rate (weight 1)
+# with a guild only titles rated by its members are recommended
+async def recommend(
+    db: AsyncSession,
+    filmweb_id: str,
+    discord_guild_id: int | None,
+    media_type: schemas.MediaType,
+    n: int,
+) -> list[schemas.Recommendation]:
+    mean_rate = await async_crud.get_filmweb_user_mean_rate(db, filmweb_id, media_type)
+    if mean_rate is None:
+        return []
+
+    # id -> (sum of similarity * rate, sum of similarity), best first by expected()
+    candidates = {
+        id_media: (weighted_sum, weight)
+        for id_media, weighted_sum, weight in await async_crud.get_filmweb_user_recommend_candidates(
+            db, filmweb_id, media_type, mean_rate, RECOMMEND_CANDIDATES
+        )
+    }
+    ranked = list(candidates)
+
+    def expected(weighted_sum: float, weight: float) -> float:
+        return (weighted_sum + mean_rate) / (weight + 1)
+
+    guild_rates = {}
+    if discord_guild_id is not None:
+        guild_rates = await async_crud.get_guild_rates(db, discord_guild_id, media_type, ranked, filmweb_id)
+        ranked = [id_media for id_media in ranked if id_media in guild_rates]
+
+    scored = []
+    for id_media in ranked:
+        weighted_sum, weight = candidates[id_media]
+        guild_rated, guild_rate_sum = guild_rates.get(id_media, (0, 0))
+        score = expected(
+            weighted_sum + RECOMMEND_GUILD_WEIGHT * guild_rate_sum,
+            weight + RECOMMEND_GUILD_WEIGHT * guild_rated,
+        )
+        scored.append((score, id_media, weighted_sum / weight, guild_rated, guild_rate_sum))
+
+    scored.sort(reverse=True)
+    scored = scored[:n]
+    media = await async_crud.get_media_rows(db, media_type, [row[1] for row in scored])
+
+    recommendations = []
+    for score, id_media, predicted_rate, guild_rated, guild_rate_sum in scored:
+        title = media.get(id_media)
+        recommendations.append(
+            schemas.Recommendation(
+                id_media=id_media,
+                title=title.title if title is not None else None,
+                year=title.year if title is not None else None,
+                poster_url=title.poster_url if title is not None else None,
+                score=round(score, 2),
+                predicted_rate=round(predicted_rate, 2),
+                guild_rated=guild_rated,
+                guild_average_rate=round(guild_rate_sum / guild_rated, 2) if guild_rated else None,
+            )
+        )
+    return recommendations
@@ -3,6 +3,7 @@ import os
 from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
@@ -21,7 +22,7 @@ discord_router = APIRouter(prefix="/discord", tags=["discord"])
     summary="Configure a guild",
     description="Configure a discord guild, this endpoint is connecting a guild text channel to guild id (is used for managing where notifications are sent)",
 )
-async def configure_guild(guild: schemas.DiscordGuildsCreate, db: Session = Depends(get_db)):
+def configure_guild(guild: schemas.DiscordGuildsCreate, db: Session = Depends(get_db)):
     try:
         db_guild = crud.set_guild(db, guild)
         return db_guild
@@ -35,9 +36,9 @@ async def configure_guild(guild: schemas.DiscordGuildsCreate, db: Session = Depe
     summary="Get all guilds",
     description="Get all guilds that are configured in the database",
 )
-async def get_guilds(db: Session = Depends(get_db)):
-    guilds = crud.get_guilds(db)
-    return guilds
+def get_guilds(db: Session = Depends(get_db)):
+    guilds = crud.get_guilds_rows(db)
+    return ORJSONResponse(guilds)
 
 
 @discord_router.get(
@@ -46,6 +47,6 @@ async def get_guilds(db: Session = Depends(get_db)):
     summary="Get all members of provided guild",
     description="Simply returns all members of the provided guild",
 )
-async def get_guild_members(discord_guild_id: int, db: Session = Depends(get_db)):
+def get_guild_members(discord_guild_id: int, db: Session = Depends(get_db)):
     guild_members = crud.get_guild_members(db, discord_guild_id)
     return guild_members
@@ -1,46 +1,36 @@
+import asyncio
+import csv
+import io
+import itertools
+import json
 import logging
 import os
-from typing import List
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Tuple
 from urllib.parse import quote
 
-from fastapi.responses import JSONResponse
-import requests
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from fake_useragent import UserAgent
 
-from filman_server.database import crud, schemas
-from filman_server.database.db import get_db
+from filman_server.database import async_crud, crud, schemas
+from filman_server.database.db import get_async_db, get_db
+from filman_server.filmweb_api import FilmwebUnavailable, fetch_filmweb_user_id
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
 filmweb_router = APIRouter(prefix="/filmweb", tags=["filmweb"])
 
-
-def _fetch_filmweb_user_id(filmweb_id: str) -> int | None:
-    url = f"https://www.filmweb.pl/api/v1/users/{quote(filmweb_id)}/id"
-    try:
-        response = requests.get(url, headers={"User-Agent": UserAgent().random}, timeout=5)
-    except Exception as exc:
-        logging.error(f"Error fetching Filmweb user id for {filmweb_id}: {exc}")
-        return None
-
-    if response.status_code != 200:
-        logging.warning(
-            "Filmweb user id lookup failed for %s: HTTP %s",
-            filmweb_id,
-            response.status_code,
-        )
-        return None
-
-    try:
-        user_id = response.json().get("userId")
-        return int(user_id) if user_id is not None else None
-    except Exception as exc:
-        logging.error(f"Error parsing Filmweb user id response for {filmweb_id}: {exc}")
-        return None
+# stored filmweb userIds are checked against their nick again after this many days
+FILMWEB_USER_ID_REVALIDATE_DAYS = float(os.environ.get("FILMWEB_USER_ID_REVALIDATE_DAYS", "7"))
+# lookups of one revalidation at a time, and the time they get, the cron gives up on the request after 10 s
+FILMWEB_USER_ID_REVALIDATE_CONCURRENCY = 4
+FILMWEB_USER_ID_REVALIDATE_BUDGET_SECONDS = 8
 
 
 #
@@ -56,9 +46,9 @@ def _fetch_filmweb_user_id(filmweb_id: str) -> int | None:
 )
 async def get_movie(
     id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    movie = crud.get_movie_filmweb_id(db, id)
+    movie = await async_crud.get_movie_filmweb_id(db, id)
     if movie is None:
         raise HTTPException(status_code=404, detail="Movie not found")
     return movie
@@ -70,7 +60,7 @@ async def get_movie(
     summary="Update/insert movie to database",
     description="Updates movie in database if it exists, otherwise inserts it",
 )
-async def update_movie(
+def update_movie(
     movie: schemas.FilmWebMovie,
     db: Session = Depends(get_db),
 ):
@@ -81,6 +71,22 @@ async def update_movie(
         raise HTTPException(status_code=400, detail="Integrity error")
 
 
+@filmweb_router.post(
+    "/movie/update_many",
+    response_model=schemas.FilmWebMediaUpdateManyResult,
+    summary="Update/insert many movies to database",
+    description="Updates movies in one transaction, only rows with changed values are written, missing ones are inserted. Returns counts of inserted/changed/unchanged",
+)
+def update_movies_many(
+    movies: List[schemas.FilmWebMovie],
+    db: Session = Depends(get_db),
+):
+    try:
+        return crud.update_filmweb_movies_many(db, movies)
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Integrity error")
+
+
 #
 # SERIES
 #
@@ -94,9 +100,9 @@ async def update_movie(
 )
 async def get_series(
     id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    series = crud.get_series_filmweb_id(db, id)
+    series = await async_crud.get_series_filmweb_id(db, id)
     if series is None:
         raise HTTPException(status_code=404, detail="Series not found")
     return series
@@ -108,7 +114,7 @@ async def get_series(
     summary="Update/insert series to database",
     description="Updates series in database if it exists, otherwise inserts it",
 )
-async def update_series(
+def update_series(
     series: schemas.FilmWebSeries,
     db: Session = Depends(get_db),
 ):
@@ -119,6 +125,22 @@ async def update_series(
         raise HTTPException(status_code=400, detail="Integrity error")
 
 
+@filmweb_router.post(
+    "/series/update_many",
+    response_model=schemas.FilmWebMediaUpdateManyResult,
+    summary="Update/insert many series to database",
+    description="Updates series in one transaction, only rows with changed values are written, missing ones are inserted. Returns counts of inserted/changed/unchanged",
+)
+def update_series_many(
+    series: List[schemas.FilmWebSeries],
+    db: Session = Depends(get_db),
+):
+    try:
+        return crud.update_filmweb_series_many(db, series)
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Integrity error")
+
+
 #
 # FILMWEB USER MAPPING
 #
@@ -134,11 +156,17 @@ async def set_user_mapping(
     user_mapping: schemas.FilmWebUserMappingCreate,
     db: Session = Depends(get_db),
 ):
-    if _fetch_filmweb_user_id(user_mapping.filmweb_id) is None:
+    try:
+        filmweb_user_id = await fetch_filmweb_user_id(user_mapping.filmweb_id)
+    except FilmwebUnavailable as e:
+        logging.error(e)
+        raise HTTPException(status_code=503, detail="Filmweb unavailable")
+
+    if filmweb_user_id is None:
         raise HTTPException(status_code=404, detail="Filmweb user not found")
 
     try:
-        db_user_mapping = crud.set_filmweb_user_mapping(db, user_mapping)
+        db_user_mapping = await run_in_threadpool(crud.set_filmweb_user_mapping, db, user_mapping, filmweb_user_id)
         return db_user_mapping
     except IntegrityError:
         raise HTTPException(status_code=409, detail="User mapping already exists")
@@ -154,7 +182,7 @@ async def get_user_mapping(
     user_id: int | None = None,
     filmweb_id: str | None = None,
     discord_id: int | None = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if user_id is None and filmweb_id is None and discord_id is None:
         raise HTTPException(
@@ -162,7 +190,7 @@ async def get_user_mapping(
             detail="At least one of user_id, filmweb_id or discord_id must be provided",
         )
 
-    user_mapping = crud.get_filmweb_user_mapping(db, user_id, filmweb_id, discord_id)
+    user_mapping = await async_crud.get_filmweb_user_mapping(db, user_id, filmweb_id, discord_id)
     if user_mapping is None:
         raise HTTPException(status_code=404, detail="User mapping not found")
 
@@ -175,7 +203,7 @@ async def get_user_mapping(
     summary="Delete user mapping",
     description="Delete user mapping between discord user and filmweb username, and watched movies of this user",
 )
-async def delete_user_mapping(
+def delete_user_mapping(
     user_id: int | None = None,
     filmweb_id: str | None = None,
     discord_id: int | None = None,
@@ -198,6 +226,128 @@ async def delete_user_mapping(
     return user_mapping
 
 
+@filmweb_router.get(
+    "/user/mapping/revalidate",
+    response_model=schemas.FilmWebUserMappingRevalidateResult,
+    summary="Revalidate filmweb user ids",
+    description="Check the nicks of the least recently checked mappings against filmweb and update their stored numeric user id (cron)",
+)
+async def revalidate_user_mappings(
+    limit: int = Query(20, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
+    checked_before = datetime.now() - timedelta(days=FILMWEB_USER_ID_REVALIDATE_DAYS)
+    mappings = await run_in_threadpool(crud.get_filmweb_user_mappings_to_revalidate, db, checked_before, limit)
+    # plain values, commits below expire the orm objects
+    mappings = [(mapping.id, mapping.filmweb_id, mapping.filmweb_user_id) for mapping in mappings]
+
+    # a few at a time, filmweb is not hammered and a slow batch still answers the cron in time
+    semaphore = asyncio.Semaphore(FILMWEB_USER_ID_REVALIDATE_CONCURRENCY)
+    unavailable = asyncio.Event()
+
+    # (answered, userId), not answered when filmweb is unavailable, the rest of the batch is skipped then
+    async def lookup(filmweb_id: str) -> tuple[bool, int | None]:
+        async with semaphore:
+            if unavailable.is_set():
+                return False, None
+            try:
+                return True, await fetch_filmweb_user_id(filmweb_id, fresh=True)
+            except FilmwebUnavailable as e:
+                if not unavailable.is_set():
+                    logging.error(e)
+                unavailable.set()
+                return False, None
+
+    lookups = {asyncio.ensure_future(lookup(mapping[1])): mapping for mapping in mappings}
+    done, pending = set(), set()
+    if lookups:
+        done, pending = await asyncio.wait(lookups, timeout=FILMWEB_USER_ID_REVALIDATE_BUDGET_SECONDS)
+    for task in pending:
+        task.cancel()
+    if pending:
+        # not marked as checked, they stay first in line for the next run
+        logging.warning(f"{len(pending)} filmweb user id lookups over the time budget, left for the next run")
+
+    checked, changed, not_found = 0, 0, 0
+    results = []
+    for task, (mapping_id, filmweb_id, stored_user_id) in lookups.items():
+        if task not in done:
+            continue
+        answered, filmweb_user_id = task.result()
+        if not answered:
+            continue
+
+        if filmweb_user_id is None:
+            logging.warning(f"Filmweb user {filmweb_id} not found, renamed or deleted (user id {stored_user_id})")
+            not_found += 1
+        elif filmweb_user_id != stored_user_id:
+            logging.info(f"Filmweb user {filmweb_id} user id changed: {stored_user_id} -> {filmweb_user_id}")
+            changed += 1
+
+        results.append((mapping_id, filmweb_user_id))
+        checked += 1
+
+    def store():
+        for mapping_id, filmweb_user_id in results:
+            crud.set_filmweb_user_id(db, mapping_id, filmweb_user_id)
+
+    await run_in_threadpool(store)
+
+    return schemas.FilmWebUserMappingRevalidateResult(checked=checked, changed=changed, not_found=not_found)
+
+
+#
+# WATCHED ETAGS
+#
+
+
+# mapping id keeps the tag unique when a mapping is deleted and created again (version starts from 0)
+# variant tells apart other representations of the same version (export format)
+def _watched_etag(version: tuple[int, int], variant: str | None = None) -> str:
+    return f'W/"{version[0]}-{version[1]}-{variant}"' if variant else f'W/"{version[0]}-{version[1]}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+
+    if if_none_match is None:
+        return False
+
+    # weak comparison, W/ prefixes are ignored
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+# the page cursor is the date and id of the last item, one of them alone can't continue the list
+def _check_watched_cursor(after_date: datetime | None, after_id: int | None):
+    if (after_date is None) != (after_id is None):
+        raise HTTPException(status_code=400, detail="after_date and after_id go together")
+
+
+# sets ETag on the response, returns 304 response when client already has this version
+async def _watched_not_modified(
+    request: Request,
+    response: Response,
+    db: AsyncSession,
+    user_id: int | None,
+    filmweb_id: str | None,
+    discord_id: int | None,
+    not_found_detail: str,
+) -> Response | None:
+    version = await async_crud.get_filmweb_user_watched_version(db, user_id, filmweb_id, discord_id)
+
+    if version is None:
+        raise HTTPException(status_code=404, detail=not_found_detail)
+
+    etag = _watched_etag(version)
+
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    return None
+
+
 #
 # MOVIES WATCHED
 #
@@ -209,7 +359,7 @@ async def delete_user_mapping(
     summary="Add watched movie by user",
     description="Add watched movie by user, if movie does not exist in database it will be added with default values",
 )
-async def add_watched_movie(
+def add_watched_movie(
     user_watched_movie: schemas.FilmWebUserWatchedMovieCreate,
     db: Session = Depends(get_db),
 ):
@@ -224,24 +374,106 @@ async def add_watched_movie(
         raise HTTPException(status_code=400, detail="Movie is already in user watched")
 
 
+@filmweb_router.post(
+    "/user/watched/movies/add_many",
+    response_model=List[schemas.FilmWebUserWatchedUpsertResult],
+    summary="Add/update many watched movies by user",
+    description="Upsert a list of watched movies in one transaction, movies missing in database are added with default values. Returns created/updated/unchanged status for every item. With notify the created ones are announced on discord (notification outbox, same transaction)",
+)
+def add_watched_movies_many(
+    user_watched_movies: List[schemas.FilmWebUserWatchedMovieCreate],
+    notify: bool = False,
+    db: Session = Depends(get_db),
+):
+    try:
+        return crud.create_filmweb_user_watched_movies_many(db, user_watched_movies, notify)
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Integrity error")
+
+
 @filmweb_router.get(
     "/user/watched/movies/get_all",
     response_model=List[schemas.FilmWebUserWatchedMovie],
     summary="Get watched movies by user",
-    description="Get watched movies by user, with movie details",
+    description="Get watched movies by user, with movie details, newest first. Pass limit for a page, and the date and movie id of the last item as after_date/after_id for the next one (both or none, items without a date sort as the oldest and use 0001-01-01T00:00:00). Sends an ETag, If-None-Match with it gives 304 while the list is unchanged",
 )
 async def get_watched_movies(
+    request: Request,
+    response: Response,
     user_id: int | None = None,
     filmweb_id: str | None = None,
     discord_id: int | None = None,
-    db: Session = Depends(get_db),
+    after_date: datetime | None = None,
+    after_id: int | None = None,
+    limit: int | None = Query(None, ge=1, le=1000),
+    order: schemas.WatchedOrder = schemas.WatchedOrder.DESC,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    watched_movies = crud.get_filmweb_user_watched_movies(db, user_id, filmweb_id, discord_id)
+    _check_watched_cursor(after_date, after_id)
+
+    not_modified = await _watched_not_modified(
+        request, response, db, user_id, filmweb_id, discord_id, "User has no watched movies"
+    )
+    if not_modified is not None:
+        return not_modified
+
+    # plain rows encoded by orjson, the response model is only the documented shape
+    watched_movies = await async_crud.get_filmweb_user_watched_movies_rows(
+        db, user_id, filmweb_id, discord_id, after_date, after_id, limit, order
+    )
 
     if watched_movies is None:
         raise HTTPException(status_code=404, detail="User has no watched movies")
 
-    return watched_movies
+    return ORJSONResponse(watched_movies, headers={"ETag": response.headers["ETag"]})
+
+
+@filmweb_router.get(
+    "/user/watched/movies/ids",
+    response_model=List[int] | List[Tuple[int, int | None]],
+    summary="Get ids of movies watched by user",
+    description="Get a flat list of watched movies ids (sorted), with_rate=true returns [id, rate] pairs instead. Supports ETag/If-None-Match",
+)
+async def get_watched_movies_ids(
+    request: Request,
+    response: Response,
+    user_id: int | None = None,
+    filmweb_id: str | None = None,
+    discord_id: int | None = None,
+    with_rate: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    not_modified = await _watched_not_modified(request, response, db, user_id, filmweb_id, discord_id, "User not found")
+    if not_modified is not None:
+        return not_modified
+
+    ids = await async_crud.get_filmweb_user_watched_movies_ids(db, user_id, filmweb_id, discord_id, with_rate)
+
+    if ids is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return ids
+
+
+@filmweb_router.post(
+    "/user/watched/movies/diff",
+    response_model=schemas.FilmWebUserWatchedDiffResult,
+    summary="Diff vote list against watched movies",
+    description="Send ids (optionally with date/rate) from the Filmweb vote list, get back only the ones that are not in database yet or whose date/rate changed",
+)
+async def diff_watched_movies(
+    votes: List[schemas.FilmWebUserWatchedDiffItem],
+    user_id: int | None = None,
+    filmweb_id: str | None = None,
+    discord_id: int | None = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    diff = await async_crud.diff_filmweb_user_watched_movies(db, user_id, filmweb_id, discord_id, votes)
+
+    if diff is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return diff
 
 
 @filmweb_router.get(
@@ -255,7 +487,7 @@ async def get_watched_movie(
     filmweb_id: str | None = None,
     discord_id: int | None = None,
     movie_id: int = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if user_id is None and filmweb_id is None and discord_id is None:
         raise HTTPException(
@@ -263,7 +495,7 @@ async def get_watched_movie(
             detail="At least one of user_id, filmweb_id or discord_id must be provided",
         )
 
-    watched_movie = crud.get_filmweb_user_watched_movie(db, user_id, filmweb_id, discord_id, movie_id)
+    watched_movie = await async_crud.get_filmweb_user_watched_movie(db, user_id, filmweb_id, discord_id, movie_id)
 
     if watched_movie is None:
         raise HTTPException(status_code=404, detail="User has no watched movies")
@@ -282,7 +514,7 @@ async def get_watched_movie(
     summary="Add watched series by user",
     description="Add watched series by user, if series does not exist in database it will be added with default values",
 )
-async def add_watched_series(
+def add_watched_series(
     user_watched_series: schemas.FilmWebUserWatchedSeriesCreate,
     db: Session = Depends(get_db),
 ):
@@ -297,24 +529,106 @@ async def add_watched_series(
         raise HTTPException(status_code=400, detail="Series is already in user watched")
 
 
+@filmweb_router.post(
+    "/user/watched/series/add_many",
+    response_model=List[schemas.FilmWebUserWatchedUpsertResult],
+    summary="Add/update many watched series by user",
+    description="Upsert a list of watched series in one transaction, series missing in database are added with default values. Returns created/updated/unchanged status for every item. With notify the created ones are announced on discord (notification outbox, same transaction)",
+)
+def add_watched_series_many(
+    user_watched_series: List[schemas.FilmWebUserWatchedSeriesCreate],
+    notify: bool = False,
+    db: Session = Depends(get_db),
+):
+    try:
+        return crud.create_filmweb_user_watched_series_many(db, user_watched_series, notify)
+    except IntegrityError:
+        raise HTTPException(status_code=400, detail="Integrity error")
+
+
 @filmweb_router.get(
     "/user/watched/series/get_all",
     response_model=List[schemas.FilmWebUserWatchedSeries],
     summary="Get watched series by user",
-    description="Get watched series by user, with series details",
+    description="Get watched series by user, with series details, newest first. Pass limit for a page, and the date and series id of the last item as after_date/after_id for the next one (both or none, items without a date sort as the oldest and use 0001-01-01T00:00:00). Sends an ETag, If-None-Match with it gives 304 while the list is unchanged",
 )
 async def get_watched_series_all(
+    request: Request,
+    response: Response,
     user_id: int | None = None,
     filmweb_id: str | None = None,
     discord_id: int | None = None,
-    db: Session = Depends(get_db),
+    after_date: datetime | None = None,
+    after_id: int | None = None,
+    limit: int | None = Query(None, ge=1, le=1000),
+    order: schemas.WatchedOrder = schemas.WatchedOrder.DESC,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    watched_series = crud.get_filmweb_user_watched_series_all(db, user_id, filmweb_id, discord_id)
+    _check_watched_cursor(after_date, after_id)
+
+    not_modified = await _watched_not_modified(
+        request, response, db, user_id, filmweb_id, discord_id, "User has no watched series"
+    )
+    if not_modified is not None:
+        return not_modified
+
+    # plain rows encoded by orjson, the response model is only the documented shape
+    watched_series = await async_crud.get_filmweb_user_watched_series_rows(
+        db, user_id, filmweb_id, discord_id, after_date, after_id, limit, order
+    )
 
     if watched_series is None:
         raise HTTPException(status_code=404, detail="User has no watched series")
 
-    return watched_series
+    return ORJSONResponse(watched_series, headers={"ETag": response.headers["ETag"]})
+
+
+@filmweb_router.get(
+    "/user/watched/series/ids",
+    response_model=List[int] | List[Tuple[int, int | None]],
+    summary="Get ids of series watched by user",
+    description="Get a flat list of watched series ids (sorted), with_rate=true returns [id, rate] pairs instead. Supports ETag/If-None-Match",
+)
+async def get_watched_series_ids(
+    request: Request,
+    response: Response,
+    user_id: int | None = None,
+    filmweb_id: str | None = None,
+    discord_id: int | None = None,
+    with_rate: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    not_modified = await _watched_not_modified(request, response, db, user_id, filmweb_id, discord_id, "User not found")
+    if not_modified is not None:
+        return not_modified
+
+    ids = await async_crud.get_filmweb_user_watched_series_ids(db, user_id, filmweb_id, discord_id, with_rate)
+
+    if ids is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return ids
+
+
+@filmweb_router.post(
+    "/user/watched/series/diff",
+    response_model=schemas.FilmWebUserWatchedDiffResult,
+    summary="Diff vote list against watched series",
+    description="Send ids (optionally with date/rate) from the Filmweb vote list, get back only the ones that are not in database yet or whose date/rate changed",
+)
+async def diff_watched_series(
+    votes: List[schemas.FilmWebUserWatchedDiffItem],
+    user_id: int | None = None,
+    filmweb_id: str | None = None,
+    discord_id: int | None = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    diff = await async_crud.diff_filmweb_user_watched_series(db, user_id, filmweb_id, discord_id, votes)
+
+    if diff is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return diff
 
 
 @filmweb_router.get(
@@ -328,7 +642,7 @@ async def get_watched_series(
     filmweb_id: str | None = None,
     discord_id: int | None = None,
     series_id: int = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if user_id is None and filmweb_id is None and discord_id is None:
         raise HTTPException(
@@ -336,73 +650,165 @@ async def get_watched_series(
             detail="At least one of user_id, filmweb_id or discord_id must be provided",
         )
 
-    watched_series = crud.get_filmweb_user_watched_series(db, user_id, filmweb_id, discord_id, series_id)
+    watched_series = await async_crud.get_filmweb_user_watched_series(db, user_id, filmweb_id, discord_id, series_id)
 
     if watched_series is None:
         raise HTTPException(status_code=404, detail="User has no watched series")
 
     return watched_series
 
+
 #
 # WATCHED EXPORT
 #
 
+# same layout the bot used to build on its side
+EXPORT_CSV_HEADER = [
+    "typ",
+    "id",
+    "tytuł",
+    "rok",
+    "rok_końca",
+    "ocena_użytkownika",
+    "komentarz",
+    "ulubiony",
+    "data_obejrzenia",
+    "ocena_społeczności",
+    "ocena_krytyków",
+]
+
+EXPORT_MEDIA_TYPES = {
+    schemas.ExportFormat.JSON: "application/json; charset=utf-8",
+    schemas.ExportFormat.NDJSON: "application/x-ndjson; charset=utf-8",
+    schemas.ExportFormat.CSV: "text/csv; charset=utf-8",
+}
+
+# text is encoded (and compressed) in chunks of about this size
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _export_item(row, media_type: str) -> dict:
+    item = {
+        "type": media_type,
+        "id": row.id,
+        "title": row.title,
+        "year": row.year,
+        "poster_url": row.poster_url,
+        "community_rate": row.community_rate,
+        "critics_rate": row.critics_rate,
+        "user_rate": row.rate,
+        "user_comment": row.comment,
+        "favorite": row.favorite,
+        "date_watched": row.date.isoformat() if row.date else None,
+    }
+    if media_type == "series":
+        item["other_year"] = row.other_year
+    return item
+
+
+def _export_csv_row(item: dict) -> list:
+    return [
+        "film" if item["type"] == "movie" else "serial",
+        item["id"],
+        item["title"],
+        item["year"],
+        item.get("other_year") or "",
+        item["user_rate"],
+        item["user_comment"] or "",
+        item["favorite"],
+        item["date_watched"],
+        item["community_rate"],
+        item["critics_rate"],
+    ]
+
+
+def _export_lines(format: schemas.ExportFormat, movies, series, total_movies: int, total_series: int):
+    if format == schemas.ExportFormat.JSON:
+        # same document as before, written one item per line
+        for key, items in (("movies", movies), ("series", series)):
+            yield '{"movies": [' if key == "movies" else '\n], "series": ['
+            for i, item in enumerate(items):
+                yield ("," if i else "") + "\n" + json.dumps(item, ensure_ascii=False)
+        yield f'\n], "total_movies": {total_movies}, "total_series": {total_series}}}\n'
+
+    elif format == schemas.ExportFormat.NDJSON:
+        for item in itertools.chain(movies, series):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    else:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=";")
+        writer.writerow(EXPORT_CSV_HEADER)
+        for item in itertools.chain(movies, series):
+            writer.writerow(_export_csv_row(item))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+
+def _export_chunks(lines, compress: bool):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None  # gzip container
+
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    parts, size = [], 0
+    for line in lines:
+        parts.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield encode("".join(parts))
+            parts, size = [], 0
+
+    yield encode("".join(parts))
+    if compressor:
+        yield compressor.flush()
+
+
 @filmweb_router.get(
     "/user/watched/export",
     summary="Export user watched movies and series",
-    description="Export all watched movies and series for a user as JSON",
+    description="Stream all watched movies and series for a user as JSON, NDJSON (one item per line) or CSV, gzip=true compresses the file. Totals are in X-Total-Movies/X-Total-Series headers",
 )
-async def export_user_watched(
+def export_user_watched(
+    request: Request,
     user_id: int | None = None,
     filmweb_id: str | None = None,
     discord_id: int | None = None,
+    format: schemas.ExportFormat = schemas.ExportFormat.JSON,
+    gzip: bool = False,
     db: Session = Depends(get_db),
 ):
-    movies = crud.get_filmweb_user_watched_movies(db, user_id, filmweb_id, discord_id)
-    series = crud.get_filmweb_user_watched_series_all(db, user_id, filmweb_id, discord_id)
-
-    if not movies and not series:
+    mapping = crud.get_filmweb_user_mapping(db, user_id, filmweb_id, discord_id)
+    if mapping is None:
         raise HTTPException(status_code=404, detail="No watched media found for user")
 
-    def serialize_movie(m):
-        return {
-            "type": "movie",
-            "id": m.movie.id,
-            "title": m.movie.title,
-            "year": m.movie.year,
-            "poster_url": m.movie.poster_url,
-            "community_rate": m.movie.community_rate,
-            "critics_rate": m.movie.critics_rate,
-            "user_rate": m.rate,
-            "user_comment": m.comment,
-            "favorite": m.favorite,
-            "date_watched": m.date.isoformat() if m.date else None,
-        }
-
-    def serialize_series(s):
-        return {
-            "type": "series",
-            "id": s.series.id,
-            "title": s.series.title,
-            "year": s.series.year,
-            "other_year": s.series.other_year,
-            "poster_url": s.series.poster_url,
-            "community_rate": s.series.community_rate,
-            "critics_rate": s.series.critics_rate,
-            "user_rate": s.rate,
-            "user_comment": s.comment,
-            "favorite": s.favorite,
-            "date_watched": s.date.isoformat() if s.date else None,
-        }
-    
-    data = {
-        "movies": [serialize_movie(m) for m in movies] if movies else [],
-        "series": [serialize_series(s) for s in series] if series else [],
-        "total_movies": len(movies) if movies else 0,
-        "total_series": len(series) if series else 0,
-    }
+    etag = _watched_etag((mapping.id, mapping.watched_version), f"export-{format.value}" + ("-gzip" if gzip else ""))
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    filmweb_id = mapping.filmweb_id
+    total_movies = crud.count_filmweb_user_watched_movies(db, filmweb_id)
+    total_series = crud.count_filmweb_user_watched_series(db, filmweb_id)
+
+    if total_movies == 0 and total_series == 0:
+        raise HTTPException(status_code=404, detail="No watched media found for user")
 
-    return JSONResponse(
-        content=data,
-        media_type="application/json; charset=utf-8",
-    )
\ No newline at end of file
+    # generators, the rows are read while the response is being sent
+    movies = (_export_item(row, "movie") for row in crud.iter_filmweb_user_watched_movies_export(db, filmweb_id))
+    series = (_export_item(row, "series") for row in crud.iter_filmweb_user_watched_series_export(db, filmweb_id))
+
+    filename = f"filman_export_{filmweb_id}.{format.value}" + (".gz" if gzip else "")
+
+    return StreamingResponse(
+        _export_chunks(_export_lines(format, movies, series, total_movies, total_series), gzip),
+        media_type="application/gzip" if gzip else EXPORT_MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{quote(filename)}"',
+            "X-Total-Movies": str(total_movies),
+            "X-Total-Series": str(total_series),
+            "ETag": etag,
+        },
+    )
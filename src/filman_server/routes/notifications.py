@@ -0,0 +1,50 @@
+import logging
+import os
+from typing import List
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from filman_server.database import crud, schemas
+from filman_server.database.db import get_db
+from filman_server.database.wakeup import LONG_POLL_MAX_WAIT_SECONDS, NOTIFICATIONS_TOPIC, long_poll
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+notifications_router = APIRouter(prefix="/notifications", tags=["notifications"])
+
+
+@notifications_router.get(
+    "",
+    response_model=List[schemas.Notification],
+    summary="Get pending notifications",
+    description="Pending notifications with id greater than after, oldest first. Pass the id of the last one as after for the next page, ack them with POST /notifications/ack. With wait the request blocks up to wait seconds until there is one (long-poll)",
+)
+async def get_notifications(
+    after: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=LONG_POLL_MAX_WAIT_SECONDS),
+    db: Session = Depends(get_db),
+):
+    return await long_poll(db, lambda: crud.get_notifications(db, after, limit), [NOTIFICATIONS_TOPIC], wait)
+
+
+@notifications_router.post(
+    "/ack",
+    response_model=schemas.NotificationAckResult,
+    summary="Ack notifications",
+    description="Mark notifications as delivered, or count a failed attempt (pending again until the attempts run out). Returns number of changed notifications",
+)
+def ack_notifications(ack: schemas.NotificationAck, db: Session = Depends(get_db)):
+    return crud.ack_notifications(db, ack)
+
+
+@notifications_router.get(
+    "/delete/old/{days}",
+    response_model=int,
+    summary="Delete old notifications",
+    description="Delete delivered and failed notifications older than X days, returns number of deleted notifications",
+)
+def delete_old_notifications(days: int, db: Session = Depends(get_db)):
+    return crud.delete_old_notifications(db, days)
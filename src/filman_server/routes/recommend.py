@@ -0,0 +1,58 @@
+import logging
+import os
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from filman_server import recommend
+from filman_server.database import crud, schemas
+from filman_server.database.db import get_async_db, get_db
+from filman_server.database.identity import resolve_identity_async
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+recommend_router = APIRouter(prefix="/recommend", tags=["recommend"])
+
+
+@recommend_router.get(
+    "",
+    response_model=list[schemas.Recommendation],
+    summary="Recommend titles to a user",
+    description="Titles the user hasn't watched, similar to the ones they rated and scored with the rates of guild members (only titles rated in the guild when guild_id is set). Best first",
+)
+async def get_recommendations(
+    discord_id: int,
+    guild_id: int | None = None,
+    n: int = Query(10, ge=1, le=100),
+    media_type: schemas.MediaType = schemas.MediaType.MOVIE,
+    db: AsyncSession = Depends(get_async_db),
+):
+    identity = await resolve_identity_async(db, None, None, discord_id)
+
+    if identity is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return await recommend.recommend(db, identity.filmweb_id, guild_id, media_type, n)
+
+
+@recommend_router.get(
+    "/rebuild",
+    response_model=schemas.RecommendRebuildResult,
+    summary="Rebuild title similarities",
+    description="Start recomputing the title similarities in a background worker process (cron). Skipped when a rebuild is running or nothing was watched since the last one, unless force",
+)
+async def rebuild_similarities(
+    background_tasks: BackgroundTasks,
+    force: bool = False,
+    db: Session = Depends(get_db),
+):
+    fingerprint = await run_in_threadpool(crud.get_watched_fingerprint, db)
+
+    if not recommend.claim_rebuild(fingerprint, force):
+        return schemas.RecommendRebuildResult(started=False)
+
+    background_tasks.add_task(recommend.rebuild_similarities, db.get_bind(), fingerprint)
+    return schemas.RecommendRebuildResult(started=True)
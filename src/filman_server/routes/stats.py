@@ -0,0 +1,184 @@
+import logging
+import os
+import time
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from filman_server import compatibility
+from filman_server.database import async_crud, crud, schemas
+from filman_server.database.db import get_async_db, get_db
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+stats_router = APIRouter(prefix="/stats", tags=["stats"])
+
+# leaderboards move slowly, a guild asking again within the TTL gets the same answer
+GUILD_STATS_TTL_SECONDS = float(os.environ.get("GUILD_STATS_TTL_SECONDS", "60"))
+GUILD_STATS_CACHE_MAX_SIZE = 1000
+
+guild_stats_cache: dict[tuple, tuple[float, list]] = {}
+
+
+async def _cached_guild_stats(key: tuple, fetch):
+    entry = guild_stats_cache.get(key)
+    if entry is not None and entry[0] >= time.monotonic():
+        return entry[1]
+
+    value = await fetch()
+    if GUILD_STATS_TTL_SECONDS > 0:
+        if len(guild_stats_cache) >= GUILD_STATS_CACHE_MAX_SIZE:
+            guild_stats_cache.clear()
+        guild_stats_cache[key] = (time.monotonic() + GUILD_STATS_TTL_SECONDS, value)
+    return value
+
+
+@stats_router.get(
+    "/user",
+    response_model=schemas.FilmWebUserStats,
+    summary="Get user stats",
+    description="Get watched movies and series statistics of a user: counts, average rate, rate histogram, favorites, first/last watched and counts per month",
+)
+async def get_user_stats(
+    user_id: int | None = None,
+    filmweb_id: str | None = None,
+    discord_id: int | None = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    stats = await async_crud.get_filmweb_user_stats(db, user_id, filmweb_id, discord_id)
+
+    if stats is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return stats
+
+
+@stats_router.post(
+    "/rebuild",
+    response_model=int,
+    summary="Rebuild stats",
+    description="Recompute stats from the watched tables, of one user (filmweb_id) or everyone. Needed once after upgrading to a version with stats. Returns number of rebuilt stats rows",
+)
+def rebuild_stats(
+    filmweb_id: str | None = None,
+    db: Session = Depends(get_db),
+):
+    return crud.rebuild_filmweb_user_stats(db, filmweb_id)
+
+
+@stats_router.get(
+    "/guild/raters",
+    response_model=list[schemas.GuildRater],
+    summary="Get most active raters of a guild",
+    description="Guild members ordered by number of rates given in the period, then by watched. Read from per day rollups, cached for a short time",
+)
+async def get_guild_raters(
+    discord_guild_id: int,
+    period: schemas.StatsPeriod = schemas.StatsPeriod.WEEK,
+    media_type: schemas.MediaType | None = None,
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await _cached_guild_stats(
+        ("raters", discord_guild_id, period, media_type, limit),
+        lambda: async_crud.get_guild_raters(db, discord_guild_id, period, media_type, limit),
+    )
+
+
+@stats_router.get(
+    "/guild/top_rated",
+    response_model=list[schemas.GuildTitle],
+    summary="Get highest rated titles of a guild",
+    description="Titles watched by guild members in the period ordered by their average rate, only titles rated by at least min_rates members. Cached for a short time",
+)
+async def get_guild_top_rated(
+    discord_guild_id: int,
+    period: schemas.StatsPeriod = schemas.StatsPeriod.MONTH,
+    media_type: schemas.MediaType = schemas.MediaType.MOVIE,
+    min_rates: int = Query(2, ge=1),
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await _cached_guild_stats(
+        ("top_rated", discord_guild_id, period, media_type, min_rates, limit),
+        lambda: async_crud.get_guild_titles(db, discord_guild_id, period, media_type, True, min_rates, limit),
+    )
+
+
+@stats_router.get(
+    "/guild/most_watched",
+    response_model=list[schemas.GuildTitle],
+    summary="Get most watched titles of a guild",
+    description="Titles watched by the most guild members in the period. Cached for a short time",
+)
+async def get_guild_most_watched(
+    discord_guild_id: int,
+    period: schemas.StatsPeriod = schemas.StatsPeriod.MONTH,
+    media_type: schemas.MediaType = schemas.MediaType.MOVIE,
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await _cached_guild_stats(
+        ("most_watched", discord_guild_id, period, media_type, limit),
+        lambda: async_crud.get_guild_titles(db, discord_guild_id, period, media_type, False, 1, limit),
+    )
+
+
+@stats_router.get(
+    "/guild/activity",
+    response_model=list[schemas.GuildActivityDay],
+    summary="Get daily activity of a guild",
+    description="Watched and rated per day by guild members (activity heatmap), days without activity are left out. Read from per day rollups, cached for a short time",
+)
+async def get_guild_activity(
+    discord_guild_id: int,
+    period: schemas.StatsPeriod = schemas.StatsPeriod.YEAR,
+    media_type: schemas.MediaType | None = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await _cached_guild_stats(
+        ("activity", discord_guild_id, period, media_type),
+        lambda: async_crud.get_guild_activity(db, discord_guild_id, period, media_type),
+    )
+
+
+@stats_router.get(
+    "/guild/compatibility",
+    response_model=list[schemas.TasteCompatibility],
+    summary="Get most compatible members of a guild",
+    description="Pairs of guild members with the most similar taste: Pearson correlation of their rates of the titles both rated (at least min_common), cosine similarity alongside. Recomputed when a member's watched data changes",
+)
+async def get_guild_compatibility(
+    discord_guild_id: int,
+    media_type: schemas.MediaType = schemas.MediaType.MOVIE,
+    min_common: int = Query(5, ge=2),
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    guild = await compatibility.get_guild_compatibility(db, discord_guild_id, media_type)
+    return compatibility.top_pairs(guild, min_common, limit)
+
+
+@stats_router.get(
+    "/guild/compatibility/matches",
+    response_model=list[schemas.TasteCompatibility],
+    summary="Get closest taste matches of a guild member",
+    description="Other guild members ordered by how similar their taste is to the member's (Pearson correlation over the titles both rated, at least min_common)",
+)
+async def get_guild_compatibility_matches(
+    discord_guild_id: int,
+    discord_id: int,
+    media_type: schemas.MediaType = schemas.MediaType.MOVIE,
+    min_common: int = Query(5, ge=2),
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    guild = await compatibility.get_guild_compatibility(db, discord_guild_id, media_type)
+    matches = compatibility.closest_matches(guild, discord_id, min_common, limit)
+
+    if matches is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    return matches
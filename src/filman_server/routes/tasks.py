@@ -12,6 +12,7 @@ from sqlalchemy.orm import Session
 
 from filman_server.database import crud, schemas
 from filman_server.database.db import get_db
+from filman_server.database.wakeup import LONG_POLL_MAX_WAIT_SECONDS, long_poll
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -34,16 +35,29 @@ def create_task(task: schemas.TaskCreate, db: Session = Depends(get_db)):
     return db_task
 
 
+@tasks_router.post(
+    "/create_many",
+    response_model=schemas.TaskBulkCreateResult,
+    summary="Create many tasks",
+    description="Create many tasks in one request, tasks with the same type and job as an already queued/running task are skipped",
+)
+def create_tasks_many(tasks: List[schemas.TaskCreate], db: Session = Depends(get_db)):
+    return crud.create_tasks_many(db, tasks)
+
+
 @tasks_router.head(
     "/get/to_do",
     summary="Check if is any task to do",
-    description="Check if is any task to do for given task types (only check)",
+    description="Check if is any task to do for given task types (only check), wait blocks up to wait seconds until there is one",
 )
-def get_task_to_do_head(
+async def get_task_to_do_head(
     task_types: List[schemas.TaskTypes] = Query(...),
+    wait: float = Query(0, ge=0, le=LONG_POLL_MAX_WAIT_SECONDS),
     db: Session = Depends(get_db),
 ):
-    db_task = crud.get_task_to_do(db, task_types, head=True)
+    db_task = await long_poll(
+        db, lambda: crud.get_task_to_do(db, task_types, head=True), [task_type.value for task_type in task_types], wait
+    )
     if db_task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     return JSONResponse(content={"task_id": db_task.task_id})
@@ -53,18 +67,42 @@ def get_task_to_do_head(
     "/get/to_do",
     response_model=schemas.Task,
     summary="Get task to do",
-    description="Get task to do for given task types",
+    description="Get task to do for given task types, wait blocks up to wait seconds until there is one",
 )
-def get_task_to_do(
+async def get_task_to_do(
     task_types: List[schemas.TaskTypes] = Query(...),
+    wait: float = Query(0, ge=0, le=LONG_POLL_MAX_WAIT_SECONDS),
     db: Session = Depends(get_db),
 ):
-    db_task = crud.get_task_to_do(db, task_types, head=False)
+    db_task = await long_poll(
+        db, lambda: crud.get_task_to_do(db, task_types, head=False), [task_type.value for task_type in task_types], wait
+    )
     if db_task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     return db_task
 
 
+@tasks_router.post(
+    "/lease",
+    response_model=List[schemas.Task],
+    summary="Lease tasks to do",
+    description="Atomically claim up to n queued tasks (oldest first) for given task types, leased for lease_seconds. With wait the request blocks up to wait seconds until there is at least one (long-poll), instead of returning an empty list",
+)
+async def lease_tasks(
+    task_types: List[schemas.TaskTypes] = Query(...),
+    n: int = Query(50, ge=1, le=500),
+    lease_seconds: int = Query(crud.DEFAULT_TASK_LEASE_SECONDS, ge=1),
+    wait: float = Query(0, ge=0, le=LONG_POLL_MAX_WAIT_SECONDS),
+    db: Session = Depends(get_db),
+):
+    return await long_poll(
+        db,
+        lambda: crud.lease_tasks(db, task_types, n, lease_seconds),
+        [task_type.value for task_type in task_types],
+        wait,
+    )
+
+
 @tasks_router.get(
     "/update/status/{task_id}/{task_status}",
     response_model=schemas.Task,
@@ -96,7 +134,7 @@ def update_stuck_tasks(minutes: int, db: Session = Depends(get_db)):
     "/update/old/{minutes}",
     response_model=bool,
     summary="Update old tasks",
-    description="Update old tasks, remove tasks older than X minutes",
+    description="Update old tasks, remove completed/failed tasks older than X minutes (queued and running ones are kept), and all tasks of retired task types",
 )
 def update_old_tasks(minutes: int, db: Session = Depends(get_db)):
     db_tasks = crud.update_old_tasks(db, minutes)
@@ -106,6 +144,16 @@ def update_old_tasks(minutes: int, db: Session = Depends(get_db)):
     return True
 
 
+@tasks_router.get(
+    "/stats",
+    response_model=List[schemas.TaskQueueStats],
+    summary="Get task queue stats",
+    description="Queued/running tasks by task type and priority, how long the oldest queued one waits and the average wait (created to started) of the recently started ones, in seconds",
+)
+def get_task_queue_stats(db: Session = Depends(get_db)):
+    return crud.get_task_queue_stats(db)
+
+
 #
 # MULTIPLE TASKS CREATION
 #
@@ -113,55 +161,85 @@ def update_old_tasks(minutes: int, db: Session = Depends(get_db)):
 
 @tasks_router.get(
     "/new/scrap/filmweb/users/movies",
-    response_model=bool,
+    response_model=int,
     summary="Add scrap users task",
-    description="Add task to scrap users movies (watched movies)",
+    description="Add task to scrap users movies (watched movies), returns number of created tasks",
 )
 def create_scrap_users_movies_task(db: Session = Depends(get_db)):
-    db_task = crud.create_scrap_filmweb_users_movies_task(db)
+    created = crud.create_scrap_filmweb_users_movies_task(db)
 
-    if db_task is None:
+    if created is None:
         raise HTTPException(status_code=400, detail="Tasks not created! Something went wrong")
-    return True
+    return created
 
 
 @tasks_router.get(
     "/new/scrap/filmweb/movies",
-    response_model=bool,
+    response_model=int,
     summary="Add scrap movies task",
-    description="Add task to scrap movies",
+    description="Add task to scrap movies, returns number of created tasks",
 )
 def create_scrap_movies_task(db: Session = Depends(get_db)):
-    db_task = crud.create_scrap_filmweb_movies_task(db)
+    created = crud.create_scrap_filmweb_movies_task(db)
 
-    if db_task is None:
+    if created is None:
         raise HTTPException(status_code=400, detail="Tasks not created! Something went wrong")
-    return True
+    return created
 
 
 @tasks_router.get(
     "/new/scrap/filmweb/series",
-    response_model=bool,
+    response_model=int,
     summary="Add scrap series task",
-    description="Add task to scrap series",
+    description="Add task to scrap series, returns number of created tasks",
 )
 def create_scrap_series_task(db: Session = Depends(get_db)):
-    db_task = crud.create_scrap_filmweb_series_task(db)
+    created = crud.create_scrap_filmweb_series_task(db)
 
-    if db_task is None:
+    if created is None:
         raise HTTPException(status_code=400, detail="Tasks not created! Something went wrong")
-    return True
+    return created
+
+
+@tasks_router.get(
+    "/new/refresh/filmweb/movies",
+    response_model=int,
+    summary="Plan movies refresh",
+    description="Add tasks to scrap the movies whose next refresh is due, spread evenly over the refresh window (called by the cron every few minutes), returns number of created tasks",
+)
+def plan_movies_refresh(db: Session = Depends(get_db)):
+    return crud.plan_filmweb_movies_refresh(db)
+
+
+@tasks_router.get(
+    "/new/refresh/filmweb/series",
+    response_model=int,
+    summary="Plan series refresh",
+    description="Add tasks to scrap the series whose next refresh is due, spread evenly over the refresh window (called by the cron every few minutes), returns number of created tasks",
+)
+def plan_series_refresh(db: Session = Depends(get_db)):
+    return crud.plan_filmweb_series_refresh(db)
+
+
+@tasks_router.get(
+    "/new/refresh/filmweb/users",
+    response_model=int,
+    summary="Plan users scrap",
+    description="Add tasks to scrap watched movies and series of the users whose next scrap is due, the interval grows while a user rates nothing and is shorter with a discord destination (called by the cron every minute), returns number of created tasks",
+)
+def plan_users_scrap(db: Session = Depends(get_db)):
+    return crud.plan_filmweb_users_scrap(db)
 
 
 @tasks_router.get(
     "/new/scrap/filmweb/users/series",
-    response_model=bool,
+    response_model=int,
     summary="Add scrap users series task",
-    description="Add task to scrap users series (watched series)",
+    description="Add task to scrap users series (watched series), returns number of created tasks",
 )
 def create_scrap_users_series_task(db: Session = Depends(get_db)):
-    db_task = crud.create_scrap_filmweb_users_series_task(db)
+    created = crud.create_scrap_filmweb_users_series_task(db)
 
-    if db_task is None:
+    if created is None:
         raise HTTPException(status_code=400, detail="Tasks not created! Something went wrong")
-    return True
+    return created
@@ -3,11 +3,13 @@ import os
 from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from filman_server.database import crud, schemas
-from filman_server.database.db import get_db
+from filman_server.database import async_crud, crud, schemas
+from filman_server.database.db import get_async_db, get_db
 
 LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -21,7 +23,7 @@ users_router = APIRouter(prefix="/users", tags=["users"])
     summary="Create a user",
     description="Create a user using discord user id",
 )
-async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     try:
         db_user = crud.create_user(db, user)
         return db_user
@@ -39,7 +41,7 @@ async def get_user(
     user_id: int | None = None,
     filmweb_id: str | None = None,
     discord_id: int | None = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if user_id is None and filmweb_id is None and discord_id is None:
         raise HTTPException(
@@ -47,7 +49,7 @@ async def get_user(
             detail="Either user_id, filmweb_id or discord_id is required",
         )
 
-    user = crud.get_user(db, user_id, filmweb_id, discord_id)
+    user = await async_crud.get_user(db, user_id, filmweb_id, discord_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
@@ -59,13 +61,13 @@ async def get_user(
     summary="Get all users",
     description="Get all users",
 )
-async def get_all_users(
+def get_all_users(
     db: Session = Depends(get_db),
 ):
-    users = crud.get_users(db)
+    users = crud.get_users_rows(db)
     if users is None:
         raise HTTPException(status_code=404, detail="No users found")
-    return users
+    return ORJSONResponse(users)
 
 
 #
@@ -82,17 +84,13 @@ async def get_all_users(
 async def get_channels(
     user_id: int | None = None,
     discord_id: int | None = None,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    user = crud.get_user(db, user_id, None, discord_id)
+    user = await async_crud.get_user(db, user_id, None, discord_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    discord_destinations = crud.get_user_destinations(db, user_id, discord_id)
-    if discord_destinations is None or len(discord_destinations) == 0:
-        raise HTTPException(status_code=404, detail="User not found in any guild")
-
-    discord_channels = crud.get_user_destinations_channels(db, user_id, discord_id)
+    discord_channels = await async_crud.get_user_destinations_channels(db, user.id, None)
     if discord_channels is None or len(discord_channels) == 0:
         raise HTTPException(status_code=404, detail="User not found in any guild")
 
@@ -105,7 +103,7 @@ async def get_channels(
     summary="Get all user guilds",
     description="Get all guilds user is in",
 )
-async def get_guilds(
+def get_guilds(
     user_id: int | None = None,
     discord_id: int | None = None,
     db: Session = Depends(get_db),
@@ -127,7 +125,7 @@ async def get_guilds(
     summary="Add user to discord guild",
     description="Add user to discord guild (guild must be in db first)",
 )
-async def add_to_guild(
+def add_to_guild(
     discord_id: int,
     discord_guild_id: int,
     db: Session = Depends(get_db),
@@ -159,7 +157,7 @@ async def add_to_guild(
     summary="Remove user from discord guild",
     description="Remove user from discord (the message destination for notifications)",
 )
-async def remove_from_guild(
+def remove_from_guild(
     user_id: int | None = None,
     discord_user_id: int | None = None,
     discord_guild_id: int = None,
@@ -192,7 +190,7 @@ async def remove_from_guild(
     summary="Remove user from all guilds",
     description="Remove user from all guilds (the message destinations for notifications)",
 )
-async def remove_from_all_guilds(
+def remove_from_all_guilds(
     user_id: int | None = None,
     discord_user_id: int | None = None,
     db: Session = Depends(get_db),
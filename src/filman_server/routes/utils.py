@@ -1,5 +1,7 @@
 import logging
 import os
+import threading
+import time
 
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
@@ -12,22 +14,27 @@ logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s - %(name)s - %(levelnam
 
 utils_router = APIRouter(prefix="/utils", tags=["utils"])
 
+# /info database in the bot is public, the snapshot is shared by everyone calling within the TTL
+DATABASE_INFO_TTL_SECONDS = float(os.environ.get("DATABASE_INFO_TTL_SECONDS", "30"))
+
+_database_info: schemas.DatabaseInfo | None = None
+_database_info_expires = 0.0
+_database_info_lock = threading.Lock()
+
 
 @utils_router.get(
     "/database_info",
     response_model=schemas.DatabaseInfo,
     summary="Get database info",
-    description="Get database info, count of users, mappings, guilds and tasks",
+    description="Get database info, count of users, watched media, media, guilds and tasks by status. Cached for a short time",
 )
 def get_database_info(db: Session = Depends(get_db)):
-    users_count = len(crud.get_users(db))
-    filmweb_watched_movies = len(crud.get_filmweb_watched_movies_all(db))
-    filmweb_watched_series = len(crud.get_filmweb_watched_series_all(db))
-    guilds_count = len(crud.get_guilds(db))
-
-    return schemas.DatabaseInfo(
-        users_count=users_count,
-        filmweb_watched_movies=filmweb_watched_movies,
-        filmweb_watched_series=filmweb_watched_series,
-        discord_guilds=guilds_count,
-    )
+    global _database_info, _database_info_expires
+
+    # one request refreshes the snapshot, the others wait for it instead of counting too
+    with _database_info_lock:
+        if _database_info is None or time.monotonic() >= _database_info_expires:
+            _database_info = crud.get_database_info(db)
+            _database_info_expires = time.monotonic() + DATABASE_INFO_TTL_SECONDS
+
+        return _database_info
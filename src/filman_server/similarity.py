@@ -0,0 +1,118 @@
+import numpy as np
+from scipy import sparse
+
+# item-item similarities of titles from user rates, run in a worker process (see recommend.py)
+# only numpy/scipy here, the worker never imports the server
+
+# a block of titles is compared to all titles at once, bounds the worker memory on big catalogs
+BLOCK_CELLS = 4_000_000
+
+
+# adjusted cosine: rates are centered on each user's mean, a title both loved and hated
+# by the same users ends up dissimilar, not just "watched together"
+# returns (id_media, id_similar, similarity) arrays, at most k positive neighbours per title
+# pairs rated by fewer than min_common users are dropped, one shared user is noise
+def item_neighbours(
+    users: np.ndarray,
+    items: np.ndarray,
+    rates: np.ndarray,
+    k: int,
+    min_common: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+    if len(rates) == 0:
+        return empty
+
+    user_ids, user_index = np.unique(users, return_inverse=True)
+    item_ids, item_index = np.unique(items, return_inverse=True)
+    shape = (len(user_ids), len(item_ids))
+
+    rates = rates.astype(np.float32)
+    user_mean = np.bincount(user_index, weights=rates) / np.bincount(user_index)
+    centered = rates - user_mean[user_index].astype(np.float32)
+
+    x = sparse.csc_matrix((centered, (user_index, item_index)), shape=shape, dtype=np.float32)
+    rated = sparse.csc_matrix((np.ones_like(rates), (user_index, item_index)), shape=shape, dtype=np.float32)
+    x_rows = x.tocsr()
+    rated_rows = rated.tocsr()
+
+    norms = np.sqrt(np.asarray(x.multiply(x).sum(axis=0)).ravel())
+    # titles without any spread (single rater, everyone at their mean) have no direction
+    norms[norms == 0] = np.inf
+
+    n_items = len(item_ids)
+    block = max(1, BLOCK_CELLS // n_items)
+    out_items, out_neighbours, out_similarities = [], [], []
+
+    # products stay sparse, a block only costs the pairs that were actually rated together
+    for start in range(0, n_items, block):
+        stop = min(start + block, n_items)
+
+        common = (rated[:, start:stop].T @ rated_rows).tocsr()
+        common.data = (common.data >= min_common).astype(np.float32)
+        common.eliminate_zeros()
+
+        similarity = (x[:, start:stop].T @ x_rows).multiply(common).tocoo()
+        rows, cols = similarity.row, similarity.col
+        values = similarity.data / (norms[start + rows] * norms[cols])
+
+        keep = (values > 0) & (cols != start + rows)
+        rows, cols, values = rows[keep], cols[keep], values[keep]
+
+        # best first within each title (similarity is in (0, 1], it only breaks ties between equal rows)
+        # then the first k of each title
+        order = np.argsort(rows + (1 - values.astype(np.float64)) / 2)
+        rows, cols, values = rows[order], cols[order], values[order]
+        top = np.arange(len(rows)) - np.searchsorted(rows, rows) < k
+
+        out_items.append(item_ids[start + rows[top]])
+        out_neighbours.append(item_ids[cols[top]])
+        out_similarities.append(values[top].astype(np.float32))
+
+    return np.concatenate(out_items), np.concatenate(out_neighbours), np.concatenate(out_similarities)
+
+
+# taste compatibility of every pair of users, over the titles both of them rated
+# users are row numbers 0..n_users-1, returns (pearson, cosine, common) n_users x n_users arrays
+# pearson/cosine are nan where undefined (nothing in common, one of them rates everything the same)
+def user_compatibility(
+    users: np.ndarray,
+    items: np.ndarray,
+    rates: np.ndarray,
+    n_users: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # a title rated by a single user is in no pair
+    _, item_index, raters = np.unique(items, return_inverse=True, return_counts=True)
+    kept = raters > 1
+    shared = kept[item_index]
+    item_index = (np.cumsum(kept) - 1)[item_index[shared]]
+    shape = (n_users, int(kept.sum()))
+    x = sparse.csc_matrix((rates[shared], (users[shared], item_index)), shape=shape, dtype=np.float32)
+
+    # [i, j] sums over the titles rated by both i and j, sum_x.T is j's side of sum_x
+    # guild sized, dense blocks of titles on BLAS beat sparse products whose result is dense anyway
+    # rates are small ints, float32 sums stay exact
+    common = np.zeros((n_users, n_users))
+    sum_x = np.zeros((n_users, n_users))
+    sum_xx = np.zeros((n_users, n_users))
+    sum_xy = np.zeros((n_users, n_users))
+    block = max(1, BLOCK_CELLS // max(n_users, 1))
+    for start in range(0, shape[1], block):
+        x_block = x[:, start : start + block].toarray()
+        rated = (x_block > 0).astype(np.float32)
+        common += rated @ rated.T
+        sum_x += x_block @ rated.T
+        sum_xx += (x_block * x_block) @ rated.T
+        sum_xy += x_block @ x_block.T
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        covariance = sum_xy - sum_x * sum_x.T / common
+        variance = sum_xx - sum_x**2 / common
+        pearson = covariance / np.sqrt(variance * variance.T)
+        cosine = sum_xy / np.sqrt(sum_xx * sum_xx.T)
+
+    # rounding leaves a tiny variance instead of 0 for constant rates, and values a hair outside [-1, 1]
+    pearson[~(variance * variance.T > 1e-9)] = np.nan
+    pearson[common < 2] = np.nan
+    cosine[common == 0] = np.nan
+    return np.clip(pearson, -1, 1), np.clip(cosine, -1, 1), common.astype(np.int64)
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from filman_server.compatibility import compatibility_cache, member_rates_cache
+from filman_server.database.crud import task_type_turns
+from filman_server.database.identity import identity_cache
+from filman_server.filmweb_api import lookup_cache
+from filman_server.routes.stats import guild_stats_cache
+
+
+# test databases are recreated with the same ids, cached identities must not leak between tests
+@pytest.fixture(autouse=True)
+def clear_identity_cache():
+    identity_cache.clear()
+    yield
+    identity_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_filmweb_lookup_cache():
+    lookup_cache.clear()
+    yield
+    lookup_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_guild_stats_cache():
+    guild_stats_cache.clear()
+    yield
+    guild_stats_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_compatibility_cache():
+    compatibility_cache.clear()
+    member_rates_cache.clear()
+    yield
+    compatibility_cache.clear()
+    member_rates_cache.clear()
+
+
+# claims take turns from where the previous claim stopped, every test starts a fresh round
+@pytest.fixture(autouse=True)
+def clear_task_type_turns():
+    task_type_turns.clear()
+    yield
+    task_type_turns.clear()
+
+
+# aware dates are stored as local wall-clock time, tests of that run in a zone that is not UTC
+@pytest.fixture
+def local_timezone(monkeypatch):
+    monkeypatch.setenv("TZ", "Europe/Warsaw")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
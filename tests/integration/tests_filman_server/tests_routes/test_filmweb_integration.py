@@ -1,15 +1,32 @@
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import json
+import threading
+import time
+from unittest.mock import AsyncMock, patch
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
+import filman_server.routes.filmweb as filmweb_routes
 from filman_server.database import models
-from filman_server.database.db import Base, get_db
+from filman_server.database.db import Base, get_async_db, get_db
+from filman_server.database.wakeup import LONG_POLL_RECHECK_SECONDS
 from filman_server.main import app
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# TestClient runs every request in a fresh event loop, so async connections can't be pooled
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=NullPool)
+TestingAsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 
 # Override the get_db dependency to use the test database
@@ -21,7 +38,13 @@ def override_get_db():
         db.close()
 
 
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_async_db] = override_get_async_db
 
 models.Base.metadata.create_all(bind=engine)
 
@@ -882,4 +905,595 @@ def test_export_user_watched_utf8_encoding(test_client):
 def test_export_user_watched_no_parameters(test_client):
     """Test export without any parameters - should return 404"""
     response = test_client.get("/filmweb/user/watched/export")
-    assert response.status_code == 404
\ No newline at end of file
+    assert response.status_code == 404
+
+
+def test_add_watched_movies_many(test_client):
+    # mapping created directly, /user/mapping/set needs filmweb.pl
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, discord_id=123456789))
+    db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    db.commit()
+    db.close()
+
+    items = [
+        {"id_media": 628, "filmweb_id": "arek", "date": "2024-01-01T12:00:00", "rate": 8, "favorite": False},
+        {"id_media": 629, "filmweb_id": "arek", "date": "2024-01-02T12:00:00", "rate": 5, "favorite": True},
+    ]
+
+    response = test_client.post("/filmweb/user/watched/movies/add_many", json=items)
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id_media": 628, "filmweb_id": "arek", "status": "created"},
+        {"id_media": 629, "filmweb_id": "arek", "status": "created"},
+    ]
+
+    items[1]["rate"] = 6
+    response = test_client.post("/filmweb/user/watched/movies/add_many", json=items)
+    assert [item["status"] for item in response.json()] == ["unchanged", "updated"]
+
+    response = test_client.get("/filmweb/user/watched/movies/get", params={"filmweb_id": "arek", "movie_id": 629})
+    assert response.status_code == 200
+    assert response.json()["rate"] == 6
+    assert response.json()["movie"]["title"] is None
+
+
+def test_add_watched_series_many(test_client):
+    response = test_client.post("/filmweb/user/watched/series/add_many", json=[])
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_update_movies_many(test_client):
+    movies = [
+        {"id": 628, "title": "Matrix", "year": 1999, "community_rate": 7.7},
+        {"id": 629, "title": "Matrix Reaktywacja", "year": 2003, "community_rate": 6.6},
+    ]
+
+    response = test_client.post("/filmweb/movie/update_many", json=movies)
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 2, "changed": 0, "unchanged": 0}
+
+    movies[1]["community_rate"] = 6.7
+    response = test_client.post("/filmweb/movie/update_many", json=movies)
+    assert response.json() == {"inserted": 0, "changed": 1, "unchanged": 1}
+
+    response = test_client.get("/filmweb/movie/get", params={"id": 629})
+    assert response.json()["community_rate"] == 6.7
+
+
+def test_update_series_many(test_client):
+    series = [{"id": 430668, "title": "Breaking Bad", "year": 2008, "other_year": 2013}]
+
+    response = test_client.post("/filmweb/series/update_many", json=series)
+    assert response.json() == {"inserted": 1, "changed": 0, "unchanged": 0}
+
+    response = test_client.post("/filmweb/series/update_many", json=series)
+    assert response.json() == {"inserted": 0, "changed": 0, "unchanged": 1}
+
+
+def test_get_watched_movies_ids(test_client):
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, discord_id=123456789))
+    db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    db.commit()
+    db.close()
+
+    response = test_client.get("/filmweb/user/watched/movies/ids", params={"filmweb_id": "arek"})
+    assert response.status_code == 200
+    assert response.json() == []
+
+    items = [
+        {
+            "id_media": media_id,
+            "filmweb_id": "arek",
+            "date": "2024-01-01T12:00:00",
+            "rate": media_id // 10,
+            "favorite": False,
+        }
+        for media_id in [30, 10, 20]
+    ]
+    test_client.post("/filmweb/user/watched/movies/add_many", json=items)
+
+    response = test_client.get("/filmweb/user/watched/movies/ids", params={"filmweb_id": "arek"})
+    assert response.json() == [10, 20, 30]
+
+    response = test_client.get("/filmweb/user/watched/movies/ids", params={"discord_id": 123456789, "with_rate": True})
+    assert response.json() == [[10, 1], [20, 2], [30, 3]]
+
+    response = test_client.get("/filmweb/user/watched/series/ids", params={"filmweb_id": "nobody"})
+    assert response.status_code == 404
+
+
+def test_diff_watched_movies(test_client):
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, discord_id=123456789))
+    db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    db.commit()
+    db.close()
+
+    votes = [{"id_media": 10, "date": "2024-01-01T12:00:00", "rate": 1}, {"id_media": 20}]
+    response = test_client.post("/filmweb/user/watched/movies/diff", params={"filmweb_id": "arek"}, json=votes)
+    assert response.status_code == 200
+    assert response.json() == {"ids": [10, 20], "has_watched": False}
+
+    items = [
+        {"id_media": media_id, "filmweb_id": "arek", "date": "2024-01-01T12:00:00", "rate": 1, "favorite": False}
+        for media_id in [10, 20]
+    ]
+    test_client.post("/filmweb/user/watched/movies/add_many", json=items)
+
+    votes = [
+        {"id_media": 30},
+        {"id_media": 10, "date": "2024-01-01T12:00:00.500000", "rate": 1},
+        {"id_media": 20, "rate": 5},
+    ]
+    response = test_client.post("/filmweb/user/watched/movies/diff", params={"discord_id": 123456789}, json=votes)
+    assert response.json() == {"ids": [30, 20], "has_watched": True}
+
+    response = test_client.post("/filmweb/user/watched/series/diff", params={"filmweb_id": "nobody"}, json=votes)
+    assert response.status_code == 404
+
+
+def test_get_watched_movies_paginated(test_client):
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, discord_id=123456789))
+    db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    db.commit()
+    db.close()
+
+    items = [
+        {"id_media": media_id, "filmweb_id": "arek", "date": f"2024-01-{media_id:02d}T12:00:00", "favorite": False}
+        for media_id in range(1, 6)
+    ]
+    test_client.post("/filmweb/user/watched/movies/add_many", json=items)
+
+    response = test_client.get("/filmweb/user/watched/movies/get_all", params={"filmweb_id": "arek", "limit": 2})
+    assert response.status_code == 200
+    assert [w["movie"]["id"] for w in response.json()] == [5, 4]
+
+    last = response.json()[-1]
+    response = test_client.get(
+        "/filmweb/user/watched/movies/get_all",
+        params={"filmweb_id": "arek", "limit": 2, "after_date": last["date"], "after_id": last["movie"]["id"]},
+    )
+    assert [w["movie"]["id"] for w in response.json()] == [3, 2]
+
+    # half a cursor can't continue the list
+    response = test_client.get(
+        "/filmweb/user/watched/movies/get_all", params={"filmweb_id": "arek", "limit": 2, "after_id": 4}
+    )
+    assert response.status_code == 400
+
+    response = test_client.get("/filmweb/user/watched/movies/get_all", params={"filmweb_id": "arek", "order": "asc"})
+    assert [w["movie"]["id"] for w in response.json()] == [1, 2, 3, 4, 5]
+
+    response = test_client.get("/filmweb/user/watched/movies/get_all", params={"filmweb_id": "arek", "limit": 0})
+    assert response.status_code == 422
+
+
+def test_export_user_watched_formats(test_client):
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, discord_id=123456789))
+    db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    db.add(models.FilmWebMovie(id=99999, title="Łowca androidów", year=1982))
+    db.add(models.FilmWebSeries(id=430668, title="Breaking Bad", year=2008, other_year=2013))
+    db.commit()
+    db.close()
+
+    test_client.post(
+        "/filmweb/user/watched/movies/add_many",
+        json=[
+            {
+                "id_media": 99999,
+                "filmweb_id": "arek",
+                "date": "2024-03-01T15:00:00",
+                "rate": 10,
+                "comment": "Żółć gęślą jaźń",
+                "favorite": True,
+            }
+        ],
+    )
+    test_client.post(
+        "/filmweb/user/watched/series/add",
+        json={"id_media": 430668, "filmweb_id": "arek", "date": "2024-03-02T15:00:00", "rate": 9, "favorite": False},
+    )
+
+    response = test_client.get("/filmweb/user/watched/export", params={"discord_id": 123456789})
+    assert response.status_code == 200
+    assert response.headers["x-total-movies"] == "1"
+    assert response.headers["x-total-series"] == "1"
+    data = response.json()
+    assert data["movies"][0]["user_comment"] == "Żółć gęślą jaźń"
+    assert data["series"][0]["other_year"] == 2013
+    assert (data["total_movies"], data["total_series"]) == (1, 1)
+
+    response = test_client.get("/filmweb/user/watched/export", params={"filmweb_id": "arek", "format": "ndjson"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(item["type"], item["id"]) for item in lines] == [("movie", 99999), ("series", 430668)]
+
+    response = test_client.get("/filmweb/user/watched/export", params={"filmweb_id": "arek", "format": "csv"})
+    assert response.headers["content-type"] == "text/csv; charset=utf-8"
+    rows = list(csv.reader(io.StringIO(response.text), delimiter=";"))
+    assert rows[0][2] == "tytuł"
+    assert rows[1] == [
+        "film",
+        "99999",
+        "Łowca androidów",
+        "1982",
+        "",
+        "10",
+        "Żółć gęślą jaźń",
+        "True",
+        "2024-03-01T15:00:00",
+        "",
+        "",
+    ]
+    assert rows[2][:5] == ["serial", "430668", "Breaking Bad", "2008", "2013"]
+
+    response = test_client.get(
+        "/filmweb/user/watched/export", params={"filmweb_id": "arek", "format": "csv", "gzip": True}
+    )
+    assert response.headers["content-type"] == "application/gzip"
+    assert "filman_export_arek.csv.gz" in response.headers["content-disposition"]
+    assert gzip.decompress(response.content).decode("utf-8").splitlines()[1].startswith("film;99999;")
+
+
+def test_watched_etag(test_client):
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, discord_id=123456789))
+    db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    db.commit()
+    db.close()
+
+    item = {"id_media": 10, "filmweb_id": "arek", "date": "2024-01-01T12:00:00", "rate": 5, "favorite": False}
+    test_client.post("/filmweb/user/watched/movies/add_many", json=[item])
+
+    response = test_client.get("/filmweb/user/watched/movies/get_all", params={"filmweb_id": "arek"})
+    etag = response.headers["etag"]
+    assert len(response.json()) == 1
+
+    for path in ["/filmweb/user/watched/movies/get_all", "/filmweb/user/watched/series/ids"]:
+        response = test_client.get(path, params={"discord_id": 123456789}, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+
+    # the export has a tag of its own for every format
+    export_etag = test_client.get("/filmweb/user/watched/export", params={"filmweb_id": "arek"}).headers["etag"]
+    assert export_etag != etag
+    response = test_client.get(
+        "/filmweb/user/watched/export", params={"filmweb_id": "arek"}, headers={"If-None-Match": export_etag}
+    )
+    assert response.status_code == 304
+    for params in [{"format": "csv"}, {"gzip": True}]:
+        response = test_client.get(
+            "/filmweb/user/watched/export",
+            params={"filmweb_id": "arek", **params},
+            headers={"If-None-Match": export_etag},
+        )
+        assert response.status_code == 200
+
+    # unchanged upsert keeps the version, a changed rate or media details bump it
+    test_client.post("/filmweb/user/watched/movies/add_many", json=[item])
+    response = test_client.get(
+        "/filmweb/user/watched/movies/ids", params={"user_id": 1}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+    test_client.post("/filmweb/movie/update_many", json=[{"id": 10, "title": "Matrix"}])
+    response = test_client.get(
+        "/filmweb/user/watched/movies/get_all", params={"user_id": 1}, headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json()[0]["movie"]["title"] == "Matrix"
+    assert response.headers["etag"] != etag
+
+    response = test_client.get("/filmweb/user/watched/movies/get_all", params={"filmweb_id": "nobody"})
+    assert response.status_code == 404
+
+
+def test_revalidate_user_mappings(test_client):
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, discord_id=123456789))
+    db.add(models.User(id=2, discord_id=987654321))
+    db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    db.add(models.FilmWebUserMapping(user_id=2, filmweb_id="renamed", filmweb_user_id=55))
+    db.commit()
+    db.close()
+
+    lookup = AsyncMock(side_effect=lambda filmweb_id, fresh: {"arek": 123}.get(filmweb_id))
+
+    with patch("filman_server.routes.filmweb.fetch_filmweb_user_id", lookup):
+        response = test_client.get("/filmweb/user/mapping/revalidate")
+        assert response.json() == {"checked": 2, "changed": 1, "not_found": 1}
+
+        # checked mappings wait for the next revalidation period
+        response = test_client.get("/filmweb/user/mapping/revalidate")
+        assert response.json() == {"checked": 0, "changed": 0, "not_found": 0}
+
+    response = test_client.get("/filmweb/user/mapping/get", params={"filmweb_id": "arek"})
+    assert response.json()["filmweb_user_id"] == 123
+
+    # a renamed account keeps its user id, its votes are still scraped
+    response = test_client.get("/filmweb/user/mapping/get", params={"filmweb_id": "renamed"})
+    assert response.json()["filmweb_user_id"] == 55
+
+
+def test_revalidate_user_mappings_time_budget(test_client, monkeypatch):
+    db = TestingSessionLocal()
+    for user_id in range(1, 7):
+        db.add(models.User(id=user_id, discord_id=user_id))
+        db.add(models.FilmWebUserMapping(user_id=user_id, filmweb_id=f"user{user_id}"))
+    db.commit()
+    db.close()
+
+    # one nick hangs, the others answer at once and concurrently
+    async def lookup(filmweb_id, fresh):
+        if filmweb_id == "user6":
+            await asyncio.sleep(10)
+        return int(filmweb_id[4:])
+
+    monkeypatch.setattr(filmweb_routes, "FILMWEB_USER_ID_REVALIDATE_BUDGET_SECONDS", 0.2)
+    with patch("filman_server.routes.filmweb.fetch_filmweb_user_id", lookup):
+        response = test_client.get("/filmweb/user/mapping/revalidate")
+        assert response.json() == {"checked": 5, "changed": 5, "not_found": 0}
+
+    # the one over the budget was not marked as checked
+    response = test_client.get("/filmweb/user/mapping/get", params={"filmweb_id": "user6"})
+    assert response.json()["filmweb_user_id"] is None
+    db = TestingSessionLocal()
+    assert db.query(models.FilmWebUserMapping).filter_by(filmweb_id="user6").one().filmweb_user_id_checked_at is None
+    db.close()
+
+
+def test_user_stats(test_client):
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, discord_id=123456789))
+    db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    db.commit()
+    db.close()
+
+    items = [
+        {"id_media": 10, "filmweb_id": "arek", "date": "2024-01-01T12:00:00", "rate": 8, "favorite": True},
+        {"id_media": 11, "filmweb_id": "arek", "date": "2024-02-01T12:00:00", "rate": 5, "favorite": False},
+    ]
+    test_client.post("/filmweb/user/watched/movies/add_many", json=items)
+
+    response = test_client.get("/stats/user", params={"discord_id": 123456789})
+    assert response.status_code == 200
+    movies = response.json()["movies"]
+    assert (movies["watched"], movies["rated"], movies["average_rate"], movies["favorites"]) == (2, 2, 6.5, 1)
+    assert movies["rate_histogram"] == [0, 0, 0, 0, 1, 0, 0, 1, 0, 0]
+    assert movies["months"] == [{"month": "2024-01", "watched": 1}, {"month": "2024-02", "watched": 1}]
+    assert response.json()["series"]["watched"] == 0
+
+    response = test_client.post("/stats/rebuild")
+    assert response.json() == 1
+    assert test_client.get("/stats/user", params={"filmweb_id": "arek"}).json()["movies"] == movies
+
+    response = test_client.get("/stats/user", params={"filmweb_id": "nobody"})
+    assert response.status_code == 404
+
+
+def test_guild_stats(test_client):
+    db = TestingSessionLocal()
+    db.add(models.DiscordGuilds(discord_guild_id=1, discord_channel_id=10))
+    for user_id, filmweb_id in ((1, "arek"), (2, "maciek"), (3, "tomek")):
+        db.add(models.User(id=user_id, discord_id=100 + user_id))
+        db.add(models.FilmWebUserMapping(user_id=user_id, filmweb_id=filmweb_id))
+    # tomek is not a member of the guild
+    db.add(models.DiscordDestinations(user_id=1, discord_guild_id=1))
+    db.add(models.DiscordDestinations(user_id=2, discord_guild_id=1))
+    db.add(models.FilmWebMovie(id=10, title="Movie 10"))
+    db.commit()
+    db.close()
+
+    today = datetime.datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+    old = today - datetime.timedelta(days=60)
+
+    def item(id_media, filmweb_id, date, rate):
+        return {
+            "id_media": id_media,
+            "filmweb_id": filmweb_id,
+            "date": date.isoformat(),
+            "rate": rate,
+            "favorite": False,
+        }
+
+    items = [
+        item(10, "arek", today, 8),
+        item(11, "arek", today, 6),
+        item(12, "arek", old, 10),
+        item(10, "maciek", today, 10),
+        item(11, "maciek", today, 0),
+        item(10, "tomek", today, 1),
+    ]
+    test_client.post("/filmweb/user/watched/movies/add_many", json=items)
+
+    response = test_client.get("/stats/guild/raters", params={"discord_guild_id": 1})
+    assert response.status_code == 200
+    assert response.json() == [
+        {"discord_id": 101, "filmweb_id": "arek", "watched": 2, "rated": 2, "average_rate": 7.0},
+        {"discord_id": 102, "filmweb_id": "maciek", "watched": 2, "rated": 1, "average_rate": 10.0},
+    ]
+
+    response = test_client.get("/stats/guild/top_rated", params={"discord_guild_id": 1})
+    titles = [(title["id_media"], title["title"], title["rated"], title["average_rate"]) for title in response.json()]
+    assert titles == [(10, "Movie 10", 2, 9.0)]
+
+    response = test_client.get("/stats/guild/most_watched", params={"discord_guild_id": 1, "period": "year"})
+    assert [(title["id_media"], title["watched"]) for title in response.json()] == [(10, 2), (11, 2), (12, 1)]
+
+    response = test_client.get("/stats/guild/activity", params={"discord_guild_id": 1})
+    assert response.json() == [
+        {"day": old.date().isoformat(), "watched": 1, "rated": 1},
+        {"day": today.date().isoformat(), "watched": 4, "rated": 3},
+    ]
+
+    assert test_client.get("/stats/guild/activity", params={"discord_guild_id": 2}).json() == []
+
+
+def test_guild_compatibility(test_client):
+    db = TestingSessionLocal()
+    db.add(models.DiscordGuilds(discord_guild_id=1, discord_channel_id=10))
+    for user_id, filmweb_id in ((1, "arek"), (2, "maciek"), (3, "tomek"), (4, "ola"), (5, "kuba")):
+        db.add(models.User(id=user_id, discord_id=100 + user_id))
+        db.add(models.FilmWebUserMapping(user_id=user_id, filmweb_id=filmweb_id))
+        # kuba is not a member of the guild
+        if user_id != 5:
+            db.add(models.DiscordDestinations(user_id=user_id, discord_guild_id=1))
+    db.commit()
+    db.close()
+
+    def rates(filmweb_id, rates):
+        return [
+            {
+                "id_media": id_media,
+                "filmweb_id": filmweb_id,
+                "date": "2024-01-01T12:00:00",
+                "rate": rate,
+                "favorite": False,
+            }
+            for id_media, rate in rates.items()
+        ]
+
+    # maciek rates like arek, tomek the other way around, ola rated a single title
+    items = rates("arek", {1: 9, 2: 8, 3: 3, 4: 2, 5: 5})
+    items += rates("maciek", {1: 10, 2: 9, 3: 2, 4: 1})
+    items += rates("tomek", {1: 2, 2: 3, 3: 9, 4: 10})
+    items += rates("ola", {1: 5})
+    items += rates("kuba", {1: 9, 2: 8, 3: 3, 4: 2})
+    test_client.post("/filmweb/user/watched/movies/add_many", json=items)
+
+    params = {"discord_guild_id": 1, "min_common": 3}
+    pairs = test_client.get("/stats/guild/compatibility", params=params).json()
+    assert [(pair["filmweb_id"], pair["other_filmweb_id"], pair["common"]) for pair in pairs] == [
+        ("arek", "maciek", 4),
+        ("arek", "tomek", 4),
+        ("maciek", "tomek", 4),
+    ]
+    assert pairs[0]["pearson"] > 0.9 and pairs[0]["cosine"] > 0.9
+    assert pairs[2]["pearson"] < -0.99
+
+    response = test_client.get("/stats/guild/compatibility/matches", params={**params, "discord_id": 103})
+    assert [(match["discord_id"], match["other_discord_id"]) for match in response.json()] == [(103, 101), (103, 102)]
+
+    # a new rate of a member changes the guild's watched version
+    test_client.post("/filmweb/user/watched/movies/add_many", json=rates("maciek", {5: 6}))
+    pairs = test_client.get("/stats/guild/compatibility", params=params).json()
+    assert pairs[0]["common"] == 5
+
+    assert test_client.get("/stats/guild/compatibility", params={"discord_guild_id": 1}).json()[0]["common"] == 5
+    response = test_client.get("/stats/guild/compatibility/matches", params={**params, "discord_id": 105})
+    assert response.status_code == 404
+
+
+def test_recommend(test_client):
+    db = TestingSessionLocal()
+    db.add(models.DiscordGuilds(discord_guild_id=1, discord_channel_id=10))
+    for user_id in range(1, 8):
+        db.add(models.User(id=user_id, discord_id=100 + user_id))
+        db.add(models.FilmWebUserMapping(user_id=user_id, filmweb_id=f"user{user_id}"))
+        if user_id <= 3:
+            db.add(models.DiscordDestinations(user_id=user_id, discord_guild_id=1))
+    for id_media in range(1, 7):
+        db.add(models.FilmWebMovie(id=id_media, title=f"Movie {id_media}"))
+    db.commit()
+    db.close()
+
+    # users 2-7 love 1-3 and dislike 4-6, user 1 rated 1 and 2 only
+    items = [
+        {
+            "id_media": id_media,
+            "filmweb_id": f"user{user_id}",
+            "date": "2024-01-01T12:00:00",
+            "rate": 9 if id_media <= 3 else 2 + user_id % 2,
+            "favorite": False,
+        }
+        for user_id in range(2, 8)
+        for id_media in range(1, 7)
+    ]
+    items += [
+        {"id_media": 1, "filmweb_id": "user1", "date": "2024-01-01T12:00:00", "rate": 10, "favorite": False},
+        {"id_media": 2, "filmweb_id": "user1", "date": "2024-01-01T12:00:00", "rate": 8, "favorite": False},
+    ]
+    test_client.post("/filmweb/user/watched/movies/add_many", json=items)
+
+    # the rebuild runs as a background task, the test client waits for it
+    response = test_client.get("/recommend/rebuild", params={"force": True})
+    assert response.json() == {"started": True}
+
+    response = test_client.get("/recommend", params={"discord_id": 101, "guild_id": 1, "n": 1})
+    assert response.status_code == 200
+    recommendation = response.json()[0]
+    assert (recommendation["id_media"], recommendation["title"], recommendation["guild_rated"]) == (3, "Movie 3", 2)
+    assert recommendation["guild_average_rate"] == 9.0
+    assert 8 < recommendation["score"] <= 10
+
+    # nothing changed since the last rebuild
+    assert test_client.get("/recommend/rebuild").json() == {"started": False}
+
+    assert test_client.get("/recommend", params={"discord_id": 102}).json() == []
+    assert test_client.get("/recommend", params={"discord_id": 999}).status_code == 404
+
+
+def test_notification_outbox(test_client):
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, discord_id=101))
+    db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    db.commit()
+    db.close()
+
+    def watched(id_media):
+        return {"id_media": id_media, "filmweb_id": "arek", "date": "2024-01-01T12:00:00", "rate": 7, "favorite": True}
+
+    # first scrap of a user, nothing to announce
+    test_client.post("/filmweb/user/watched/movies/add_many", json=[watched(1)])
+    assert test_client.get("/notifications").json() == []
+
+    response = test_client.post(
+        "/filmweb/user/watched/movies/add_many", params={"notify": True}, json=[watched(1), watched(2), watched(3)]
+    )
+    assert [result["status"] for result in response.json()] == ["unchanged", "created", "created"]
+
+    notifications = test_client.get("/notifications", params={"limit": 1}).json()
+    assert len(notifications) == 1
+    notification = notifications[0]
+    assert (notification["filmweb_id"], notification["media_type"], notification["media_id"]) == ("arek", "movie", 2)
+    assert notification["payload"] == {"date": "2024-01-01T12:00:00", "rate": 7, "comment": None, "favorite": True}
+    assert (notification["status"], notification["attempts"]) == ("pending", 0)
+
+    after = test_client.get("/notifications", params={"after": notification["id"]}).json()
+    assert [n["media_id"] for n in after] == [3]
+
+    ack = {"delivered": [notification["id"]], "failed": [after[0]["id"]]}
+    response = test_client.post("/notifications/ack", json=ack)
+    assert response.json() == {"delivered": 1, "failed": 1}
+
+    pending = test_client.get("/notifications").json()
+    assert [(n["media_id"], n["attempts"]) for n in pending] == [(3, 1)]
+
+    assert test_client.get("/notifications/delete/old/0").json() == 1
+
+
+# the bot waits for notifications with ?wait, the watched insert wakes it
+def test_notifications_wait(test_client):
+    db = TestingSessionLocal()
+    db.add(models.User(id=1, discord_id=101))
+    db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    db.commit()
+    db.close()
+
+    responses = []
+    waiting = threading.Thread(target=lambda: responses.append(test_client.get("/notifications", params={"wait": 10})))
+
+    start = time.monotonic()
+    waiting.start()
+    time.sleep(0.5)
+
+    watched = {"id_media": 1, "filmweb_id": "arek", "date": "2024-01-01T12:00:00", "rate": 7, "favorite": True}
+    test_client.post("/filmweb/user/watched/movies/add_many", params={"notify": True}, json=[watched])
+    waiting.join()
+
+    assert time.monotonic() - start < LONG_POLL_RECHECK_SECONDS
+    assert [n["media_id"] for n in responses[0].json()] == [1]
@@ -1,4 +1,5 @@
 import logging
+import threading
 import time
 
 import pytest
@@ -9,6 +10,7 @@ from sqlalchemy.orm import sessionmaker
 
 from filman_server.database import models, schemas
 from filman_server.database.db import Base, get_db
+from filman_server.database.wakeup import LONG_POLL_RECHECK_SECONDS
 from filman_server.main import app
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"  # memory db is not working for some reason
@@ -21,7 +23,7 @@ def override_get_db():
         db = TestingSessionLocal()
         yield db
     finally:
-        db.close_all()
+        db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
@@ -226,7 +228,7 @@ def test_tasks_new_scrap_filmweb_users_movies(test_client: TestClient):
     response = test_client.get("/tasks/new/scrap/filmweb/users/movies")
     assert response.status_code == 200
 
-    assert response.json() is True
+    assert response.json() == 0
 
     # check if there are any tasks in the database
     response = test_client.head("/tasks/get/to_do", params={"task_types": ["scrap_filmweb_user"]})
@@ -262,7 +264,7 @@ def test_tasks_new_scrap_filmweb_users_movies(test_client: TestClient):
 
     response = test_client.get("/tasks/new/scrap/filmweb/users/movies")
     assert response.status_code == 200
-    assert response.json() is True
+    assert response.json() == 4
 
     response = test_client.head("/tasks/get/to_do", params={"task_types": ["scrap_filmweb_user_watched_movies"]})
     assert response.status_code == 200
@@ -313,7 +315,7 @@ def test_tasks_new_scrap_filmweb_movies(test_client: TestClient):
     response = test_client.get("/tasks/new/scrap/filmweb/movies")
     assert response.status_code == 200
 
-    assert response.json() is True
+    assert response.json() == 0
 
     # check if there are any tasks in the database
     response = test_client.head("/tasks/get/to_do", params={"task_types": ["scrap_filmweb_movie"]})
@@ -354,7 +356,12 @@ def test_tasks_new_scrap_filmweb_movies(test_client: TestClient):
 
     response = test_client.get("/tasks/new/scrap/filmweb/movies")
     assert response.status_code == 200
-    assert response.json() is True
+    assert response.json() == 3
+
+    # same movies are already queued
+    response = test_client.get("/tasks/new/scrap/filmweb/movies")
+    assert response.status_code == 200
+    assert response.json() == 0
 
     response = test_client.head("/tasks/get/to_do", params={"task_types": ["scrap_filmweb_movie"]})
     assert response.status_code == 200
@@ -388,3 +395,126 @@ def test_tasks_new_scrap_filmweb_movies(test_client: TestClient):
         response = test_client.get("/tasks/get/to_do", params={"task_types": ["scrap_filmweb_movie"]})
         assert response.status_code == 200
         assert response.json()["task_id"] == 2
+
+
+# post /tasks/lease
+def test_tasks_lease(test_client: TestClient):
+    for i in range(5):
+        response = test_client.post(
+            "/tasks/create",
+            json={
+                "task_status": "queued",
+                "task_type": "scrap_filmweb_movie",
+                "task_job": str(i),
+            },
+        )
+        assert response.status_code == 200
+
+    response = test_client.post("/tasks/lease", params={"task_types": ["scrap_filmweb_movie"], "n": 3})
+    assert response.status_code == 200
+
+    tasks = response.json()
+    assert [task["task_job"] for task in tasks] == ["0", "1", "2"]
+    assert all(task["task_status"] == "running" for task in tasks)
+    assert all(task["task_lease_expires"] is not None for task in tasks)
+
+    response = test_client.post("/tasks/lease", params={"task_types": ["scrap_filmweb_movie"], "n": 3})
+    assert response.status_code == 200
+    assert [task["task_job"] for task in response.json()] == ["3", "4"]
+
+    response = test_client.post("/tasks/lease", params={"task_types": ["scrap_filmweb_movie"], "n": 3})
+    assert response.status_code == 200
+    assert response.json() == []
+
+    response = test_client.post("/tasks/lease", params={"task_types": ["scrap_filmweb_movie"], "n": 0})
+    assert response.status_code == 422
+
+
+# post /tasks/lease?wait, long-poll
+def test_tasks_lease_wait(test_client: TestClient):
+    params = {"task_types": ["scrap_filmweb_movie"], "n": 3, "wait": 10}
+    responses = []
+    waiting = threading.Thread(target=lambda: responses.append(test_client.post("/tasks/lease", params=params)))
+
+    start = time.monotonic()
+    waiting.start()
+    time.sleep(0.5)
+
+    # a task of another type doesn't end the wait
+    test_client.post(
+        "/tasks/create", json={"task_status": "queued", "task_type": "scrap_filmweb_series", "task_job": "1"}
+    )
+    test_client.post(
+        "/tasks/create", json={"task_status": "queued", "task_type": "scrap_filmweb_movie", "task_job": "2"}
+    )
+    waiting.join()
+
+    # woken by the commit, not found by the fallback re-read
+    assert time.monotonic() - start < LONG_POLL_RECHECK_SECONDS
+    assert responses[0].status_code == 200
+    assert [task["task_job"] for task in responses[0].json()] == ["2"]
+
+    # nothing queued, an empty list once the wait is over
+    start = time.monotonic()
+    response = test_client.post("/tasks/lease", params={**params, "wait": 0.5})
+    assert response.json() == []
+    assert time.monotonic() - start >= 0.5
+
+    response = test_client.head("/tasks/get/to_do", params={"task_types": ["scrap_filmweb_series"], "wait": 0.5})
+    assert response.status_code == 200
+
+    response = test_client.post("/tasks/lease", params={**params, "wait": 3600})
+    assert response.status_code == 422
+
+
+# post /tasks/create_many
+def test_tasks_create_many(test_client: TestClient):
+    tasks = [
+        {"task_status": "queued", "task_type": "scrap_filmweb_movie", "task_job": "1"},
+        {"task_status": "queued", "task_type": "scrap_filmweb_movie", "task_job": "2"},
+        {"task_status": "queued", "task_type": "scrap_filmweb_movie", "task_job": "2"},
+        {"task_status": "queued", "task_type": "send_discord_notification", "task_job": "maciek,movie,1"},
+    ]
+
+    response = test_client.post("/tasks/create_many", json=tasks)
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 3, "deduplicated": 1}
+
+    response = test_client.post("/tasks/create_many", json=tasks)
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 0, "deduplicated": 4}
+
+    response = test_client.post("/tasks/lease", params={"task_types": ["scrap_filmweb_movie"], "n": 10})
+    assert [task["task_job"] for task in response.json()] == ["1", "2"]
+
+    response = test_client.post("/tasks/create_many", json=[])
+    assert response.status_code == 200
+    assert response.json() == {"inserted": 0, "deduplicated": 0}
+
+    # only the known priorities
+    for priority in (99, -5):
+        response = test_client.post("/tasks/create_many", json=[{**tasks[0], "task_priority": priority}])
+        assert response.status_code == 422
+
+
+# get /tasks/stats
+def test_tasks_stats(test_client: TestClient):
+    tasks = [
+        {"task_status": "queued", "task_type": "scrap_filmweb_movie", "task_job": "1"},
+        {"task_status": "queued", "task_type": "scrap_filmweb_movie", "task_job": "2", "task_priority": 2},
+        {"task_status": "queued", "task_type": "scrap_filmweb_user_watched_movies", "task_job": "arek"},
+    ]
+    test_client.post("/tasks/create_many", json=tasks)
+    test_client.post("/tasks/lease", params={"task_types": ["scrap_filmweb_user_watched_movies"]})
+
+    response = test_client.get("/tasks/stats")
+    assert response.status_code == 200
+
+    stats = [(row["task_type"], row["task_priority"], row["queued"], row["running"]) for row in response.json()]
+    assert stats == [
+        ("scrap_filmweb_movie", 2, 1, 0),
+        ("scrap_filmweb_movie", 1, 1, 0),
+        ("scrap_filmweb_user_watched_movies", 1, 0, 1),
+    ]
+    assert all(row["oldest_queued_age"] >= 0 for row in response.json()[:2])
+    assert response.json()[2]["average_wait"] >= 0
@@ -3,8 +3,10 @@ from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+from filman_server.database import models
 from filman_server.database.db import Base, get_db
 from filman_server.main import app
+from filman_server.routes import utils
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
@@ -38,3 +40,27 @@ def test_get_database_info(test_client):
     assert "filmweb_watched_movies" in data
     assert "filmweb_watched_series" in data
     assert "discord_guilds" in data
+
+
+def test_get_database_info_counts(test_client):
+    # test.db is shared with other modules, compare against a fresh snapshot
+    utils._database_info = None
+    before = test_client.get("/utils/database_info").json()
+
+    db = TestingSessionLocal()
+    db.add(models.User(discord_id=111222333))
+    db.add(models.FilmWebMovie(id=987654, title="Matrix"))
+    db.add(models.Task(task_status="queued", task_type="scrap_filmweb_movie", task_job="987654"))
+    db.commit()
+    db.close()
+
+    # served from the snapshot until it expires
+    assert test_client.get("/utils/database_info").json() == before
+
+    utils._database_info_expires = 0
+    data = test_client.get("/utils/database_info").json()
+    assert data["users_count"] == before["users_count"] + 1
+    assert data["filmweb_movies"] == before["filmweb_movies"] + 1
+    assert data["filmweb_series"] == before["filmweb_series"]
+    assert data["tasks"]["queued"] == before["tasks"]["queued"] + 1
+    assert set(data["tasks"]) == {"queued", "running", "completed", "error"}
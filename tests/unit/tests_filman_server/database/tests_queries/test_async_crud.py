@@ -0,0 +1,201 @@
+import asyncio
+import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import filman_server.database.async_crud as async_crud
+import filman_server.database.models as models
+import filman_server.database.schemas as schemas
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "async.db"
+
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    session.add(models.User(id=1, discord_id=123456789))
+    session.add(models.User(id=2, discord_id=987654321))
+    session.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    session.add(models.FilmWebMovie(id=628, title="Matrix", year=1999, community_rate=7.7))
+    session.add(models.FilmWebSeries(id=430668, title="Breaking Bad", year=2008, other_year=2013))
+    session.add(
+        models.FilmWebUserWatchedMovie(
+            id_media=628, filmweb_id="arek", date=datetime.datetime(2024, 1, 1), rate=9, favorite=True
+        )
+    )
+    session.add(
+        models.FilmWebUserWatchedSeries(
+            id_media=430668, filmweb_id="arek", date=datetime.datetime(2024, 1, 2), rate=10, favorite=False
+        )
+    )
+    session.add(models.DiscordGuilds(discord_guild_id=1, discord_channel_id=11))
+    session.add(models.DiscordGuilds(discord_guild_id=2, discord_channel_id=22))
+    session.add(models.DiscordDestinations(user_id=1, discord_guild_id=1))
+    session.add(models.DiscordDestinations(user_id=1, discord_guild_id=2))
+    session.commit()
+    session.close()
+    engine.dispose()
+
+    yield path
+
+
+def run(db_path, query):
+    async def _run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+        try:
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                return await query(db)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(_run())
+
+
+def test_get_user(db_path):
+    assert run(db_path, lambda db: async_crud.get_user(db, 1, None, None)).discord_id == 123456789
+    assert run(db_path, lambda db: async_crud.get_user(db, None, "arek", None)).id == 1
+    assert run(db_path, lambda db: async_crud.get_user(db, None, None, 987654321)).id == 2
+    assert run(db_path, lambda db: async_crud.get_user(db, None, "nobody", None)) is None
+    assert run(db_path, lambda db: async_crud.get_user(db, None, None, None)) is None
+
+
+def test_get_user_destinations_channels(db_path):
+    assert sorted(run(db_path, lambda db: async_crud.get_user_destinations_channels(db, 1, None))) == [11, 22]
+    assert sorted(run(db_path, lambda db: async_crud.get_user_destinations_channels(db, None, 123456789))) == [11, 22]
+    assert run(db_path, lambda db: async_crud.get_user_destinations_channels(db, 2, None)) == []
+    assert run(db_path, lambda db: async_crud.get_user_destinations_channels(db, None, 1)) == []
+
+
+def test_get_filmweb_user_mapping(db_path):
+    assert run(db_path, lambda db: async_crud.get_filmweb_user_mapping(db, None, None, 123456789)).filmweb_id == "arek"
+    assert run(db_path, lambda db: async_crud.get_filmweb_user_mapping(db, 2, None, None)) is None
+
+
+def test_get_filmweb_user_watched_movie(db_path):
+    # relationship is loaded before the session closes
+    watched = run(db_path, lambda db: async_crud.get_filmweb_user_watched_movie(db, None, None, 123456789, 628))
+    assert watched.movie.title == "Matrix"
+    assert watched.rate == 9
+
+    assert run(db_path, lambda db: async_crud.get_filmweb_user_watched_movie(db, None, "arek", None, 1)) is None
+    assert run(db_path, lambda db: async_crud.get_filmweb_user_watched_movie(db, 2, None, None, 628)) is None
+
+
+def test_get_filmweb_user_watched_movies(db_path):
+    watched = run(db_path, lambda db: async_crud.get_filmweb_user_watched_movies(db, 1, None, None))
+    assert [w.movie.title for w in watched] == ["Matrix"]
+
+    assert run(db_path, lambda db: async_crud.get_filmweb_user_watched_movies(db, 2, None, None)) is None
+
+
+def test_get_filmweb_user_watched_series(db_path):
+    watched = run(db_path, lambda db: async_crud.get_filmweb_user_watched_series(db, None, "arek", None, 430668))
+    assert watched.series.other_year == 2013
+
+    watched = run(db_path, lambda db: async_crud.get_filmweb_user_watched_series_all(db, None, "arek", None))
+    assert [w.series.title for w in watched] == ["Breaking Bad"]
+
+
+def test_get_media(db_path):
+    assert run(db_path, lambda db: async_crud.get_movie_filmweb_id(db, 628)).title == "Matrix"
+    assert run(db_path, lambda db: async_crud.get_series_filmweb_id(db, 430668)).title == "Breaking Bad"
+    assert run(db_path, lambda db: async_crud.get_movie_filmweb_id(db, 1)) is None
+
+
+def test_get_filmweb_user_watched_ids(db_path):
+    assert run(db_path, lambda db: async_crud.get_filmweb_user_watched_movies_ids(db, None, "arek", None)) == [628]
+    assert run(db_path, lambda db: async_crud.get_filmweb_user_watched_movies_ids(db, 1, None, None, True)) == [
+        (628, 9)
+    ]
+    assert run(db_path, lambda db: async_crud.get_filmweb_user_watched_series_ids(db, None, None, 123456789)) == [
+        430668
+    ]
+    assert run(db_path, lambda db: async_crud.get_filmweb_user_watched_series_ids(db, 2, None, None)) is None
+
+
+def test_diff_filmweb_user_watched(db_path):
+    items = [
+        schemas.FilmWebUserWatchedDiffItem(id_media=1),
+        schemas.FilmWebUserWatchedDiffItem(id_media=628, date=datetime.datetime(2024, 1, 1), rate=9),
+        schemas.FilmWebUserWatchedDiffItem(id_media=1),
+    ]
+    diff = run(db_path, lambda db: async_crud.diff_filmweb_user_watched_movies(db, None, "arek", None, items))
+    assert diff.ids == [1]
+    assert diff.has_watched
+
+    items = [schemas.FilmWebUserWatchedDiffItem(id_media=430668, date=datetime.datetime(2024, 1, 3))]
+    diff = run(db_path, lambda db: async_crud.diff_filmweb_user_watched_series(db, 1, None, None, items))
+    assert diff.ids == [430668]
+
+    assert run(db_path, lambda db: async_crud.diff_filmweb_user_watched_movies(db, 2, None, None, items)) is None
+
+
+def test_diff_filmweb_user_watched_dates(db_path, local_timezone):
+    engine = create_engine(f"sqlite:///{db_path}")
+    session = sessionmaker(bind=engine)()
+    session.add(models.FilmWebMovie(id=1))
+    session.add(models.FilmWebUserWatchedMovie(id_media=1, filmweb_id="arek", date=None, rate=5, favorite=False))
+    session.commit()
+    session.close()
+    engine.dispose()
+
+    # the same instant with an offset is unchanged, a stored NULL date is changed
+    warsaw = datetime.timezone(datetime.timedelta(hours=1))
+    items = [
+        schemas.FilmWebUserWatchedDiffItem(id_media=628, date=datetime.datetime(2024, 1, 1, tzinfo=warsaw), rate=9),
+        schemas.FilmWebUserWatchedDiffItem(id_media=1, date=datetime.datetime(2024, 1, 1), rate=5),
+    ]
+    diff = run(db_path, lambda db: async_crud.diff_filmweb_user_watched_movies(db, None, "arek", None, items))
+    assert diff.ids == [1]
+
+
+def test_get_filmweb_user_watched_movies_paginated(db_path):
+    engine = create_engine(f"sqlite:///{db_path}")
+    session = sessionmaker(bind=engine)()
+    for media_id, day in [(1, 5), (2, 3), (3, 3), (4, 1), (5, None), (6, None)]:
+        date = datetime.datetime(2024, 2, day) if day is not None else None
+        session.add(models.FilmWebMovie(id=media_id))
+        session.add(models.FilmWebUserWatchedMovie(id_media=media_id, filmweb_id="arek", date=date, favorite=False))
+    session.commit()
+    session.close()
+    engine.dispose()
+
+    def page(**kwargs):
+        watched = run(db_path, lambda db: async_crud.get_filmweb_user_watched_movies(db, 1, None, None, **kwargs))
+        return [w.id_media for w in watched]
+
+    assert page() == [1, 3, 2, 4, 628, 6, 5]
+    assert page(limit=2) == [1, 3]
+    assert page(after_date=datetime.datetime(2024, 2, 3), after_id=3, limit=2) == [2, 4]
+    assert page(order=schemas.WatchedOrder.ASC, limit=3) == [5, 6, 628]
+    assert page(order=schemas.WatchedOrder.ASC, after_date=datetime.datetime(2024, 2, 3), after_id=2) == [3, 1]
+
+    # rows without a date sort as the oldest, they are reached page by page too
+    assert page(after_date=datetime.datetime(2024, 1, 1), after_id=628) == [6, 5]
+    assert page(after_date=async_crud.WATCHED_NULL_DATE, after_id=6) == [5]
+    assert page(order=schemas.WatchedOrder.ASC, after_date=async_crud.WATCHED_NULL_DATE, after_id=5, limit=2) == [
+        6,
+        628,
+    ]
+
+    with pytest.raises(ValueError):
+        page(after_date=datetime.datetime(2024, 2, 3), limit=2)
+
+
+def test_get_filmweb_user_watched_rows(db_path):
+    # fast path rows match the response model of the ORM path
+    watched = run(db_path, lambda db: async_crud.get_filmweb_user_watched_movies(db, 1, None, None))
+    rows = run(db_path, lambda db: async_crud.get_filmweb_user_watched_movies_rows(db, 1, None, None))
+    assert rows == [schemas.FilmWebUserWatchedMovie.model_validate(w).model_dump() for w in watched]
+
+    watched = run(db_path, lambda db: async_crud.get_filmweb_user_watched_series_all(db, None, "arek", None))
+    rows = run(db_path, lambda db: async_crud.get_filmweb_user_watched_series_rows(db, None, "arek", None))
+    assert rows == [schemas.FilmWebUserWatchedSeries.model_validate(w).model_dump() for w in watched]
+
+    assert run(db_path, lambda db: async_crud.get_filmweb_user_watched_movies_rows(db, 2, None, None)) is None
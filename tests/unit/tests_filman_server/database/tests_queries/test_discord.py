@@ -9,6 +9,7 @@ from sqlalchemy.orm import sessionmaker
 
 import filman_server.database.crud as crud
 import filman_server.database.models as models
+import filman_server.database.schemas as schemas
 
 
 @pytest.fixture(scope="module")
@@ -146,6 +147,11 @@ def test_get_guilds(test_db):
     assert len(result) == 5
 
 
+def test_get_guilds_rows(test_db):
+    result = crud.get_guilds_rows(test_db)
+    assert result == [schemas.DiscordGuilds.model_validate(guild).model_dump() for guild in crud.get_guilds(test_db)]
+
+
 def test_get_guild_members(test_db):
     result = crud.get_guild_members(test_db, discord_guild_id=123456789)
     assert len(result) == 3
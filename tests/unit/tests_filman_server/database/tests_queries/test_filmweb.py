@@ -4,11 +4,13 @@ import datetime
 import logging
 
 import pytest
-from sqlalchemy import create_engine
+from freezegun import freeze_time
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 
 import filman_server.database.crud as crud
 import filman_server.database.models as models
+import filman_server.database.schemas as schemas
 
 
 @pytest.fixture(scope="module")
@@ -840,3 +842,283 @@ def test_delete_filmweb_watched_series_all(test_db):
     )
 
     assert len(result) == 0
+
+
+#
+# BULK WATCHED
+#
+
+
+@pytest.fixture
+def bulk_db():
+    engine = create_engine("sqlite:///:memory:")
+    models.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    session.add(models.User(id=1, discord_id=123456789))
+    session.add(models.FilmWebUserMapping(id=1, user_id=1, filmweb_id="arek"))
+    session.add(models.FilmWebMovie(id=628, title="Matrix", year=1999))
+    session.commit()
+
+    yield session
+
+    session.close()
+    models.Base.metadata.drop_all(engine)
+
+
+def watched_movie(id_media: int, rate: int, comment: str | None = None) -> schemas.FilmWebUserWatchedMovieCreate:
+    return schemas.FilmWebUserWatchedMovieCreate(
+        id_media=id_media,
+        filmweb_id="arek",
+        date=datetime.datetime(2024, 1, 1, 12, 0, 0),
+        rate=rate,
+        comment=comment,
+        favorite=False,
+    )
+
+
+def test_create_filmweb_user_watched_movies_many(bulk_db):
+    results = crud.create_filmweb_user_watched_movies_many(
+        bulk_db, [watched_movie(628, 8), watched_movie(1, 5), watched_movie(2, 6)]
+    )
+
+    assert [(r.id_media, r.status) for r in results] == [
+        (628, schemas.WatchedUpsertStatus.CREATED),
+        (1, schemas.WatchedUpsertStatus.CREATED),
+        (2, schemas.WatchedUpsertStatus.CREATED),
+    ]
+
+    # placeholders for unknown movies, known one untouched
+    assert bulk_db.query(models.FilmWebMovie).count() == 3
+    assert crud.get_movie_filmweb_id(bulk_db, 628).title == "Matrix"
+    assert crud.get_movie_filmweb_id(bulk_db, 1).title is None
+
+    results = crud.create_filmweb_user_watched_movies_many(
+        bulk_db, [watched_movie(628, 8), watched_movie(1, 7, "meh"), watched_movie(3, 10)]
+    )
+
+    assert {r.id_media: r.status for r in results} == {
+        628: schemas.WatchedUpsertStatus.UNCHANGED,
+        1: schemas.WatchedUpsertStatus.UPDATED,
+        3: schemas.WatchedUpsertStatus.CREATED,
+    }
+
+    updated = crud.get_filmweb_user_watched_movie(bulk_db, None, "arek", None, 1)
+    bulk_db.refresh(updated)
+    assert updated.rate == 7
+    assert updated.comment == "meh"
+
+    assert bulk_db.query(models.FilmWebUserWatchedMovie).count() == 4
+
+
+def test_create_filmweb_user_watched_series_many_duplicates(bulk_db):
+    item = schemas.FilmWebUserWatchedSeriesCreate(
+        id_media=430668,
+        filmweb_id="arek",
+        date=datetime.datetime(2024, 1, 1, 12, 0, 0),
+        rate=6,
+        favorite=False,
+    )
+
+    # same series twice in one batch, last one wins
+    results = crud.create_filmweb_user_watched_series_many(bulk_db, [item, item.model_copy(update={"rate": 9})])
+
+    assert len(results) == 1
+    assert results[0].status == schemas.WatchedUpsertStatus.CREATED
+    assert crud.get_filmweb_user_watched_series(bulk_db, None, "arek", None, 430668).rate == 9
+
+    assert crud.create_filmweb_user_watched_series_many(bulk_db, []) == []
+
+
+def test_create_filmweb_user_watched_movies_many_dates_to_the_second(bulk_db):
+    # stored the way MariaDB DATETIME keeps it, the crawler sends the vote timestamp with milliseconds
+    crud.create_filmweb_user_watched_movies_many(bulk_db, [watched_movie(628, 8)])
+    version = crud.get_filmweb_user_watched_version(bulk_db, 1, None, None)[1]
+
+    resent = watched_movie(628, 8).model_copy(update={"date": datetime.datetime(2024, 1, 1, 12, 0, 0, 345000)})
+    results = crud.create_filmweb_user_watched_movies_many(bulk_db, [resent])
+    assert results[0].status == schemas.WatchedUpsertStatus.UNCHANGED
+    assert crud.get_filmweb_user_watched_version(bulk_db, 1, None, None)[1] == version
+
+    moved = watched_movie(628, 8).model_copy(update={"date": datetime.datetime(2024, 1, 1, 12, 0, 1)})
+    results = crud.create_filmweb_user_watched_movies_many(bulk_db, [moved])
+    assert results[0].status == schemas.WatchedUpsertStatus.UPDATED
+
+
+def test_create_filmweb_user_watched_movies_many_aware_date_resent(bulk_db, local_timezone):
+    aware = watched_movie(628, 8).model_copy(
+        update={"date": datetime.datetime(2024, 1, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)}
+    )
+    crud.create_filmweb_user_watched_movies_many(bulk_db, [aware])
+    version = crud.get_filmweb_user_watched_version(bulk_db, 1, None, None)[1]
+
+    # stored as local time, the same post again is unchanged
+    watched = crud.get_filmweb_user_watched_movie(bulk_db, 1, None, None, 628)
+    assert watched.date == datetime.datetime(2024, 1, 1, 13, 0, 0)
+
+    results = crud.create_filmweb_user_watched_movies_many(bulk_db, [aware])
+    assert results[0].status == schemas.WatchedUpsertStatus.UNCHANGED
+    assert crud.get_filmweb_user_watched_version(bulk_db, 1, None, None)[1] == version
+
+
+#
+# BULK MEDIA UPDATE
+#
+
+
+def test_update_filmweb_movies_many(bulk_db):
+    matrix = schemas.FilmWebMovie(id=628, title="Matrix", year=1999)
+
+    result = crud.update_filmweb_movies_many(
+        bulk_db,
+        [
+            matrix,
+            schemas.FilmWebMovie(id=1, title="Nowy", year=2024, community_rate=7.1),
+            schemas.FilmWebMovie(id=2, title="Drugi", year=2023),
+        ],
+    )
+    assert (result.inserted, result.changed, result.unchanged) == (2, 0, 1)
+
+    result = crud.update_filmweb_movies_many(
+        bulk_db,
+        [
+            matrix,
+            schemas.FilmWebMovie(id=1, title="Nowy", year=2024, community_rate=7.1),
+            schemas.FilmWebMovie(id=2, title="Drugi", year=2023, community_rate=6.5),
+        ],
+    )
+    assert (result.inserted, result.changed, result.unchanged) == (0, 1, 2)
+
+    bulk_db.expire_all()
+    assert crud.get_movie_filmweb_id(bulk_db, 2).community_rate == 6.5
+    assert crud.get_movie_filmweb_id(bulk_db, 1).title == "Nowy"
+
+
+def test_update_filmweb_series_many(bulk_db):
+    series = schemas.FilmWebSeries(id=430668, title="Breaking Bad", year=2008, other_year=2012)
+
+    result = crud.update_filmweb_series_many(bulk_db, [series])
+    assert (result.inserted, result.changed, result.unchanged) == (1, 0, 0)
+
+    result = crud.update_filmweb_series_many(bulk_db, [series.model_copy(update={"other_year": 2013})])
+    assert (result.inserted, result.changed, result.unchanged) == (0, 1, 0)
+
+    bulk_db.expire_all()
+    assert crud.get_series_filmweb_id(bulk_db, 430668).other_year == 2013
+
+
+def test_update_filmweb_movie_skips_unchanged(bulk_db):
+    writes = []
+    event.listen(bulk_db.get_bind(), "before_cursor_execute", lambda *args: writes.append(args[2]))
+
+    # only the scrap time and the next refresh are written
+    crud.update_filmweb_movie(bulk_db, schemas.FilmWebMovie(id=628, title="Matrix", year=1999))
+    updates = [sql for sql in writes if sql.startswith("UPDATE")]
+    assert updates == ["UPDATE filmweb_movies SET last_scraped_at=?, next_refresh_at=? WHERE filmweb_movies.id = ?"]
+    writes.clear()
+
+    crud.update_filmweb_movie(bulk_db, schemas.FilmWebMovie(id=628, title="Matrix", year=1999, community_rate=7.7))
+    assert [sql for sql in writes if sql.startswith("UPDATE")]
+    assert crud.get_movie_filmweb_id(bulk_db, 628).community_rate == 7.7
+
+
+def test_update_filmweb_movies_many_plans_refresh(bulk_db):
+    now = datetime.datetime(2024, 6, 1, 12, 0, 0)
+
+    with freeze_time(now):
+        crud.update_filmweb_movies_many(
+            bulk_db,
+            [
+                schemas.FilmWebMovie(id=628, title="Matrix", year=1999, community_rate=7.7),
+                schemas.FilmWebMovie(id=1, title="Nowy", year=2024, community_rate=7.1),
+            ],
+        )
+
+    bulk_db.expire_all()
+    matrix, new = crud.get_movie_filmweb_id(bulk_db, 628), crud.get_movie_filmweb_id(bulk_db, 1)
+    assert matrix.last_scraped_at == new.last_scraped_at == now
+    assert now + datetime.timedelta(days=30) < matrix.next_refresh_at <= now + datetime.timedelta(days=60)
+    assert now < new.next_refresh_at <= now + datetime.timedelta(days=2)
+
+
+def test_media_refresh_interval():
+    now = datetime.datetime(2024, 6, 1, 12, 0, 0)
+
+    def days(year=1999, rate_change=0.0, raters=0, media_id=1):
+        return crud._media_refresh_interval(media_id, year, rate_change, raters, now) / datetime.timedelta(days=1)
+
+    # old, settled and nobody here rated it
+    assert 45 <= days() <= 60
+    assert days(year=None) <= 2
+    assert days(year=2024) < days(year=2021) < days()
+    assert days(rate_change=0.2) < days(rate_change=0.05) < days(rate_change=None) == days()
+    assert days(raters=30) < days(raters=3) < days()
+    assert days(year=2024, rate_change=0.5, raters=1000) == crud.MEDIA_REFRESH_MIN_HOURS / 24
+    # titles of one batch are spread over the last quarter of their interval
+    assert len({days(media_id=media_id) for media_id in range(100)}) == 100
+
+
+def test_same_value_float_precision():
+    # MariaDB FLOAT gives back single precision values
+    assert crud._same_value(7.699999809265137, 7.7)
+    assert not crud._same_value(7.6, 7.7)
+    assert crud._same_value(None, None)
+    assert not crud._same_value(None, 7.7)
+
+
+def test_watched_version_bumps(bulk_db):
+    def version():
+        return crud.get_filmweb_user_watched_version(bulk_db, 1, None, None)[1]
+
+    assert version() == 0
+
+    crud.create_filmweb_user_watched_movies_many(bulk_db, [watched_movie(628, rate=8)])
+    assert version() == 1
+
+    crud.create_filmweb_user_watched_movies_many(bulk_db, [watched_movie(628, rate=8)])
+    assert version() == 1
+
+    crud.update_filmweb_movie(bulk_db, schemas.FilmWebMovie(id=628, title="Matrix", year=1999, community_rate=7.7))
+    assert version() == 2
+
+    crud.update_filmweb_movies_many(bulk_db, [schemas.FilmWebMovie(id=628, title="Matrix", year=1999)])
+    assert version() == 3
+
+    crud.delete_filmweb_user_watched_movies(bulk_db, 1, None, None)
+    assert version() == 4
+
+
+def test_set_filmweb_mapping_filmweb_user_id(bulk_db):
+    mapping = schemas.FilmWebUserMappingCreate(user_id=1, filmweb_id="arek")
+
+    result = crud.set_filmweb_user_mapping(bulk_db, mapping, 456)
+    assert result.filmweb_user_id == 456
+
+    # same nick without a resolved id keeps the stored one
+    result = crud.set_filmweb_user_mapping(bulk_db, mapping)
+    assert result.filmweb_user_id == 456
+
+    # a new nick drops the id of the old one
+    mapping = schemas.FilmWebUserMappingCreate(user_id=1, filmweb_id="maciek")
+    result = crud.set_filmweb_user_mapping(bulk_db, mapping)
+    assert result.filmweb_user_id is None
+
+
+def test_revalidate_filmweb_user_ids(bulk_db):
+    bulk_db.add(models.User(id=2, discord_id=987654321))
+    bulk_db.add(models.FilmWebUserMapping(id=2, user_id=2, filmweb_id="maciek"))
+    bulk_db.commit()
+
+    now = datetime.datetime.now()
+
+    crud.set_filmweb_user_mapping(bulk_db, schemas.FilmWebUserMappingCreate(user_id=1, filmweb_id="arek"), 456)
+    assert [m.id for m in crud.get_filmweb_user_mappings_to_revalidate(bulk_db, now, 10)] == [2]
+
+    # never checked first, then the oldest
+    later = now + datetime.timedelta(days=1)
+    assert [m.id for m in crud.get_filmweb_user_mappings_to_revalidate(bulk_db, later, 10)] == [2, 1]
+
+    # not found keeps the stored id
+    assert crud.set_filmweb_user_id(bulk_db, 1, None).filmweb_user_id == 456
+    assert crud.set_filmweb_user_id(bulk_db, 2, 789).filmweb_user_id == 789
+    assert crud.get_filmweb_user_mappings_to_revalidate(bulk_db, now, 10) == []
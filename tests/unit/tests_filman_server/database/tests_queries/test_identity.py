@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import filman_server.database.crud as crud
+import filman_server.database.models as models
+import filman_server.database.schemas as schemas
+from filman_server.database.identity import (
+    Identity,
+    IdentityCache,
+    MemoryBackend,
+    identity_cache,
+    resolve_identity,
+)
+
+
+@pytest.fixture
+def test_db():
+    engine = create_engine("sqlite:///:memory:")
+    models.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    session.add(models.User(id=1, discord_id=123456789))
+    session.add(models.User(id=2, discord_id=987654321))
+    session.add(models.FilmWebUserMapping(id=1, user_id=1, filmweb_id="arek"))
+    session.commit()
+
+    yield session
+
+    session.close()
+
+
+def count_queries(db):
+    queries = []
+    event.listen(db.get_bind(), "before_cursor_execute", lambda *args: queries.append(args[2]))
+    return queries
+
+
+def test_resolve_identity(test_db):
+    queries = count_queries(test_db)
+
+    assert resolve_identity(test_db, None, None, 123456789) == Identity(1, 123456789, "arek")
+    assert len(queries) == 1
+
+    # all three keys are cached from one lookup
+    assert resolve_identity(test_db, 1, None, None) == Identity(1, 123456789, "arek")
+    assert resolve_identity(test_db, None, "arek", None) == Identity(1, 123456789, "arek")
+    assert len(queries) == 1
+
+    # no mapping, no identity
+    assert resolve_identity(test_db, 2, None, None) is None
+    assert resolve_identity(test_db, None, None, None) is None
+
+
+def test_mapping_changes_invalidate(test_db):
+    assert crud.get_filmweb_user_mapping(test_db, None, None, 123456789).filmweb_id == "arek"
+
+    crud.set_filmweb_user_mapping(test_db, schemas.FilmWebUserMappingCreate(user_id=1, filmweb_id="maciek"))
+    assert resolve_identity(test_db, None, None, 123456789).filmweb_id == "maciek"
+    assert resolve_identity(test_db, None, "arek", None) is None
+
+    crud.set_filmweb_user_mapping(test_db, schemas.FilmWebUserMappingCreate(user_id=2, filmweb_id="tomek"))
+    assert resolve_identity(test_db, 2, None, None) == Identity(2, 987654321, "tomek")
+
+    crud.delete_filmweb_user_mapping(test_db, None, 987654321, None)
+    assert resolve_identity(test_db, 2, None, None) is None
+    assert resolve_identity(test_db, None, "tomek", None) is None
+
+
+def test_memory_backend_ttl():
+    backend = MemoryBackend(max_size=2)
+    identity = Identity(1, 123456789, "arek")
+
+    backend.set_many(["a", "b"], identity, ttl=60)
+    assert backend.get("a") == identity
+
+    # when full, expired entries are dropped and then everything, it never grows past max_size
+    backend.set_many(["c"], identity, ttl=60)
+    assert backend.get("c") == identity
+    assert len(backend._data) <= 2
+
+    backend.set_many(["d"], identity, ttl=0.01)
+    time.sleep(0.02)
+    assert backend.get("d") is None
+
+
+def test_cache_disabled(test_db, monkeypatch):
+    monkeypatch.setattr(identity_cache, "ttl", 0)
+    queries = count_queries(test_db)
+
+    resolve_identity(test_db, 1, None, None)
+    resolve_identity(test_db, 1, None, None)
+    assert len(queries) == 2
+
+
+def test_blocking_backend_off_the_event_loop():
+    # stands in for redis, records the thread of every call
+    class BlockingBackend(MemoryBackend):
+        blocking = True
+        threads = []
+
+        def get(self, key):
+            self.threads.append(threading.get_ident())
+            return super().get(key)
+
+        def set_many(self, keys, identity, ttl):
+            self.threads.append(threading.get_ident())
+            super().set_many(keys, identity, ttl)
+
+    cache = IdentityCache(BlockingBackend(), ttl=60)
+    identity = Identity(1, 123456789, "arek")
+
+    async def _run():
+        await cache.set_async(identity)
+        return await cache.get_async(None, "arek", None)
+
+    assert asyncio.run(_run()) == identity
+    assert len(BlockingBackend.threads) == 2
+    assert threading.get_ident() not in BlockingBackend.threads
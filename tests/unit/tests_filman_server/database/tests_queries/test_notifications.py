@@ -0,0 +1,106 @@
+import datetime
+
+import pytest
+from freezegun import freeze_time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import filman_server.database.crud as crud
+import filman_server.database.models as models
+import filman_server.database.schemas as schemas
+
+
+@pytest.fixture
+def test_db():
+    engine = create_engine("sqlite:///:memory:")
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+    session.add(models.User(id=1, discord_id=101))
+    session.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    session.commit()
+
+    yield session
+
+    session.close()
+    models.Base.metadata.drop_all(engine)
+
+
+def watched(id_media: int, rate: int = 8) -> schemas.FilmWebUserWatchedMovieCreate:
+    return schemas.FilmWebUserWatchedMovieCreate(
+        id_media=id_media,
+        filmweb_id="arek",
+        date=datetime.datetime(2024, 1, 1, 12, 0, 0),
+        rate=rate,
+        comment="nice",
+        favorite=False,
+    )
+
+
+def test_add_many_writes_outbox_for_created_only(test_db):
+    crud.create_filmweb_user_watched_movies_many(test_db, [watched(1)])
+    assert crud.get_notifications(test_db, 0, 10) == []
+
+    crud.create_filmweb_user_watched_movies_many(test_db, [watched(1, rate=9), watched(2), watched(3)], notify=True)
+    crud.create_filmweb_user_watched_series_many(test_db, [watched(2)], notify=True)
+
+    notifications = crud.get_notifications(test_db, 0, 10)
+    assert [(n.media_type, n.media_id) for n in notifications] == [("movie", 2), ("movie", 3), ("series", 2)]
+    assert schemas.Notification.model_validate(notifications[0]).payload == schemas.NotificationPayload(
+        date=datetime.datetime(2024, 1, 1, 12, 0, 0), rate=8, comment="nice", favorite=False
+    )
+
+    # the title was announced already
+    test_db.query(models.FilmWebUserWatchedMovie).filter_by(id_media=2).delete()
+    test_db.commit()
+    crud.create_filmweb_user_watched_movies_many(test_db, [watched(2)], notify=True)
+    assert len(crud.get_notifications(test_db, 0, 10)) == 3
+
+
+def test_get_notifications_after_cursor(test_db):
+    crud.create_filmweb_user_watched_movies_many(test_db, [watched(i) for i in range(1, 6)], notify=True)
+
+    first = crud.get_notifications(test_db, 0, 2)
+    second = crud.get_notifications(test_db, first[-1].id, 2)
+    assert [n.media_id for n in first + second] == [1, 2, 3, 4]
+
+    crud.ack_notifications(test_db, schemas.NotificationAck(delivered=[n.id for n in first]))
+    assert [n.media_id for n in crud.get_notifications(test_db, 0, 10)] == [3, 4, 5]
+
+
+def test_ack_notifications(test_db):
+    crud.create_filmweb_user_watched_movies_many(test_db, [watched(1), watched(2)], notify=True)
+    delivered, failing = crud.get_notifications(test_db, 0, 10)
+
+    result = crud.ack_notifications(test_db, schemas.NotificationAck(delivered=[delivered.id], failed=[failing.id]))
+    assert result == schemas.NotificationAckResult(delivered=1, failed=1)
+
+    # acked twice, only pending rows change
+    result = crud.ack_notifications(test_db, schemas.NotificationAck(delivered=[delivered.id]))
+    assert result.delivered == 0
+
+    for _ in range(crud.NOTIFICATION_MAX_ATTEMPTS - 1):
+        assert [n.id for n in crud.get_notifications(test_db, 0, 10)] == [failing.id]
+        crud.ack_notifications(test_db, schemas.NotificationAck(failed=[failing.id]))
+
+    assert crud.get_notifications(test_db, 0, 10) == []
+    test_db.refresh(delivered)
+    test_db.refresh(failing)
+    assert (delivered.status, delivered.attempts) == (schemas.NotificationStatus.DELIVERED, 1)
+    assert (failing.status, failing.attempts) == (schemas.NotificationStatus.FAILED, crud.NOTIFICATION_MAX_ATTEMPTS)
+
+
+def test_delete_old_notifications_keeps_pending(test_db):
+    with freeze_time("2024-01-01 12:00:00"):
+        crud.create_filmweb_user_watched_movies_many(test_db, [watched(1), watched(2), watched(3)], notify=True)
+
+    delivered, pending, newest = [n.id for n in crud.get_notifications(test_db, 0, 10)]
+    crud.ack_notifications(test_db, schemas.NotificationAck(delivered=[delivered, newest]))
+
+    assert crud.delete_old_notifications(test_db, 7) == 2
+    assert [n.id for n in test_db.query(models.NotificationOutbox)] == [pending]
+
+    # the newest id is not reused after a cleanup, cursors of consumers stay valid
+    crud.create_filmweb_user_watched_movies_many(test_db, [watched(4)], notify=True)
+    assert [n.media_id for n in crud.get_notifications(test_db, newest, 10)] == [4]
@@ -0,0 +1,172 @@
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+import filman_server.database.crud as crud
+import filman_server.database.models as models
+import filman_server.database.schemas as schemas
+
+
+@pytest.fixture
+def test_db():
+    engine = create_engine("sqlite:///:memory:")
+    models.Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+
+    session.add(models.User(id=1, discord_id=123456789))
+    session.add(models.User(id=2, discord_id=987654321))
+    session.add(models.FilmWebUserMapping(id=1, user_id=1, filmweb_id="arek"))
+    session.add(models.FilmWebUserMapping(id=2, user_id=2, filmweb_id="maciek"))
+    session.commit()
+
+    yield session
+
+    session.close()
+
+
+def watched_movie(id_media: int, month: int, rate: int, favorite: bool = False, filmweb_id: str = "arek"):
+    return schemas.FilmWebUserWatchedMovieCreate(
+        id_media=id_media,
+        filmweb_id=filmweb_id,
+        date=datetime.datetime(2024, month, 1),
+        rate=rate,
+        favorite=favorite,
+    )
+
+
+def stats_rows(db):
+    stats = [
+        {column.name: getattr(row, column.name) for column in models.FilmWebUserStats.__table__.columns}
+        for row in db.scalars(select(models.FilmWebUserStats).order_by("filmweb_id", "media_type"))
+    ]
+    months = [
+        (row.filmweb_id, row.media_type, row.month, row.watched)
+        for row in db.scalars(select(models.FilmWebUserStatsMonthly).order_by("filmweb_id", "media_type", "month"))
+    ]
+    days = [
+        (row.filmweb_id, row.day, row.media_type, row.watched, row.rated, row.rate_sum)
+        for row in db.scalars(select(models.FilmWebUserActivityDaily).order_by("filmweb_id", "day", "media_type"))
+    ]
+    return stats, months, days
+
+
+def test_stats_incremental(test_db):
+    crud.create_filmweb_user_watched_movies_many(
+        test_db,
+        [
+            watched_movie(1, 1, 8, favorite=True),
+            watched_movie(2, 1, 6),
+            watched_movie(3, 3, 0),  # not rated
+            watched_movie(4, 2, 10, filmweb_id="maciek"),
+        ],
+    )
+
+    stats = test_db.get(models.FilmWebUserStats, ("arek", "movie"))
+    assert (stats.watched, stats.rated, stats.rate_sum, stats.favorites) == (3, 2, 14, 1)
+    assert (stats.rate_6, stats.rate_8) == (1, 1)
+    assert stats.first_watched == datetime.datetime(2024, 1, 1)
+    assert stats.last_watched == datetime.datetime(2024, 3, 1)
+
+    # re-rate and move to another month, the old month disappears
+    crud.create_filmweb_user_watched_movies_many(test_db, [watched_movie(3, 2, 7), watched_movie(2, 1, 6)])
+    test_db.expire_all()
+    assert (stats.watched, stats.rated, stats.rate_sum, stats.rate_7) == (3, 3, 21, 1)
+    assert stats.last_watched == datetime.datetime(2024, 2, 1)
+    assert stats_rows(test_db)[1][:2] == [("arek", "movie", "2024-01", 2), ("arek", "movie", "2024-02", 1)]
+    assert stats_rows(test_db)[2][:2] == [
+        ("arek", datetime.date(2024, 1, 1), "movie", 2, 2, 14),
+        ("arek", datetime.date(2024, 2, 1), "movie", 1, 1, 7),
+    ]
+
+    crud.create_filmweb_user_watched_series(
+        test_db,
+        schemas.FilmWebUserWatchedSeriesCreate(
+            id_media=10, filmweb_id="arek", date=datetime.datetime(2023, 5, 5), rate=9, favorite=False
+        ),
+    )
+    assert test_db.get(models.FilmWebUserStats, ("arek", "series")).rate_9 == 1
+
+
+def test_stats_rebuild_matches_incremental(test_db):
+    crud.create_filmweb_user_watched_movies_many(
+        test_db,
+        [watched_movie(i, i % 12 + 1, i % 11, favorite=i % 5 == 0) for i in range(1, 60)]
+        + [watched_movie(i, 1, 5, filmweb_id="maciek") for i in range(1, 5)],
+    )
+    crud.create_filmweb_user_watched_movies_many(test_db, [watched_movie(i, 6, 3) for i in range(1, 20)])
+    incremental = stats_rows(test_db)
+
+    assert crud.rebuild_filmweb_user_stats(test_db) == 2
+    assert stats_rows(test_db) == incremental
+
+    assert crud.rebuild_filmweb_user_stats(test_db, "maciek") == 1
+    assert stats_rows(test_db) == incremental
+
+
+def test_stats_deleted_with_watched(test_db):
+    crud.create_filmweb_user_watched_movies_many(
+        test_db, [watched_movie(1, 1, 8), watched_movie(2, 1, 8, filmweb_id="maciek")]
+    )
+
+    crud.delete_filmweb_user_watched_movies(test_db, None, "arek", None)
+    assert test_db.get(models.FilmWebUserStats, ("arek", "movie")) is None
+
+    crud.delete_filmweb_user_mapping(test_db, 2, None, None)
+    assert stats_rows(test_db) == ([], [], [])
+
+
+def guild_title_rows(db):
+    return [
+        (row.discord_guild_id, row.day, row.id_media, row.watched, row.rated, row.rate_sum)
+        for row in db.scalars(
+            select(models.DiscordGuildTitleDaily).order_by("discord_guild_id", "media_type", "day", "id_media")
+        )
+    ]
+
+
+def test_guild_title_stats(test_db):
+    test_db.add(models.DiscordGuilds(discord_guild_id=100, discord_channel_id=1))
+    test_db.add(models.DiscordGuilds(discord_guild_id=200, discord_channel_id=2))
+    test_db.commit()
+    crud.set_user_destination(test_db, 1, 100)
+    crud.set_user_destination(test_db, 1, 200)
+    crud.set_user_destination(test_db, 2, 100)
+
+    crud.create_filmweb_user_watched_movies_many(
+        test_db, [watched_movie(1, 1, 8), watched_movie(2, 1, 6), watched_movie(1, 1, 10, filmweb_id="maciek")]
+    )
+    jan, feb = datetime.date(2024, 1, 1), datetime.date(2024, 2, 1)
+    assert guild_title_rows(test_db) == [
+        (100, jan, 1, 2, 2, 18),
+        (100, jan, 2, 1, 1, 6),
+        (200, jan, 1, 1, 1, 8),
+        (200, jan, 2, 1, 1, 6),
+    ]
+
+    # re-rate and move to another day
+    crud.create_filmweb_user_watched_movies_many(test_db, [watched_movie(1, 2, 4)])
+    incremental = guild_title_rows(test_db)
+    assert incremental == [
+        (100, jan, 1, 1, 1, 10),
+        (100, jan, 2, 1, 1, 6),
+        (100, feb, 1, 1, 1, 4),
+        (200, jan, 2, 1, 1, 6),
+        (200, feb, 1, 1, 1, 4),
+    ]
+
+    crud.rebuild_filmweb_user_stats(test_db)
+    assert guild_title_rows(test_db) == incremental
+
+    # members leaving and joining
+    crud.delete_user_destination(test_db, 2, None, 100)
+    assert guild_title_rows(test_db)[:1] == [(100, jan, 2, 1, 1, 6)]
+    crud.set_user_destination(test_db, 2, 100)
+    assert guild_title_rows(test_db) == incremental
+
+    crud.delete_filmweb_user_watched_movies(test_db, None, "arek", None)
+    assert guild_title_rows(test_db) == [(100, jan, 1, 1, 1, 10)]
+
+    crud.delete_guild(test_db, 100)
+    assert guild_title_rows(test_db) == []
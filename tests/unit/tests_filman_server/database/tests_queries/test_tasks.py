@@ -0,0 +1,565 @@
+import datetime
+
+import pytest
+from freezegun import freeze_time
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import filman_server.database.crud as crud
+import filman_server.database.models as models
+import filman_server.database.schemas as schemas
+
+
+@pytest.fixture
+def test_db():
+    engine = create_engine("sqlite:///:memory:")
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+    yield session
+
+    session.close()
+    models.Base.metadata.drop_all(engine)
+
+
+def add_task(
+    db,
+    task_type: schemas.TaskTypes,
+    task_job: str,
+    created: datetime.datetime,
+    priority: schemas.TaskPriority = schemas.TaskPriority.NORMAL,
+) -> models.Task:
+    task = models.Task(
+        task_status=schemas.TaskStatus.QUEUED,
+        task_type=task_type,
+        task_job=task_job,
+        task_created=created,
+        task_priority=priority,
+    )
+    db.add(task)
+    db.commit()
+    return task
+
+
+#
+# LEASING
+#
+
+
+def test_lease_tasks_oldest_first(test_db):
+    base = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+    # inserted out of order on purpose
+    add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "3", base + datetime.timedelta(minutes=3))
+    add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1", base + datetime.timedelta(minutes=1))
+    add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "2", base + datetime.timedelta(minutes=2))
+    add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_SERIES, "9", base)
+
+    leased = crud.lease_tasks(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], n=2)
+
+    assert [task.task_job for task in leased] == ["1", "2"]
+    assert all(task.task_status == schemas.TaskStatus.RUNNING for task in leased)
+    assert all(task.task_started is not None for task in leased)
+    assert all(task.task_lease_expires > task.task_started for task in leased)
+
+    leased = crud.lease_tasks(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], n=2)
+    assert [task.task_job for task in leased] == ["3"]
+
+    assert crud.lease_tasks(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], n=2) == []
+
+    # series task was never touched
+    series = test_db.query(models.Task).filter(models.Task.task_job == "9").first()
+    assert series.task_status == schemas.TaskStatus.QUEUED
+
+
+def test_lease_tasks_never_returns_same_task_twice(test_db):
+    base = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+    for i in range(10):
+        add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, str(i), base + datetime.timedelta(seconds=i))
+
+    other_session = sessionmaker(bind=test_db.get_bind())()
+
+    seen = []
+    for db in [test_db, other_session] * 3:
+        seen += [task.task_id for task in crud.lease_tasks(db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], n=3)]
+
+    other_session.close()
+
+    assert len(seen) == 10
+    assert len(set(seen)) == 10
+
+
+def test_get_task_to_do_is_fifo(test_db):
+    base = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+    add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "new", base + datetime.timedelta(hours=1))
+    add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "old", base)
+
+    head = crud.get_task_to_do(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], head=True)
+    assert head.task_job == "old"
+    assert head.task_status == schemas.TaskStatus.QUEUED
+
+    task = crud.get_task_to_do(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE])
+    assert task.task_job == "old"
+    assert task.task_status == schemas.TaskStatus.RUNNING
+
+
+def test_update_stuck_tasks_respects_lease(test_db):
+    add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1", datetime.datetime(2023, 1, 1, 11, 0, 0))
+
+    with freeze_time("2023-01-01 12:00:00") as frozen_time:
+        crud.lease_tasks(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], n=1, lease_seconds=600)
+
+        # older than 1 minute, but the lease is still valid
+        frozen_time.tick(delta=datetime.timedelta(minutes=5))
+        crud.update_stuck_tasks(test_db, minutes=1)
+        assert crud.get_task_to_do(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], head=True) is None
+
+        frozen_time.tick(delta=datetime.timedelta(minutes=6))
+        crud.update_stuck_tasks(test_db, minutes=1)
+
+        task = crud.get_task_to_do(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], head=True)
+        assert task.task_job == "1"
+        assert task.task_started is None
+        assert task.task_lease_expires is None
+
+
+def test_update_old_tasks_removes_finished_only(test_db):
+    created = datetime.datetime(2023, 1, 1, 11, 0, 0)
+    for job, status in [
+        ("queued", schemas.TaskStatus.QUEUED),
+        ("running", schemas.TaskStatus.RUNNING),
+        ("completed", schemas.TaskStatus.COMPLETED),
+        ("error", schemas.TaskStatus.ERROR),
+    ]:
+        add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, job, created, schemas.TaskPriority.REFRESH)
+        test_db.query(models.Task).filter_by(task_job=job).update({"task_status": status})
+    test_db.commit()
+
+    # a refresh waiting behind higher priorities is still served later
+    with freeze_time("2023-01-01 12:00:00"):
+        crud.update_old_tasks(test_db, minutes=20)
+
+    assert {task.task_job for task in test_db.query(models.Task)} == {"queued", "running"}
+
+
+def test_update_old_tasks_removes_retired_types(test_db):
+    # discord notifications moved to the outbox, their queued tasks are never claimed
+    add_task(test_db, schemas.TaskTypes.SEND_DISCORD_NOTIFICATION, "1,arek", datetime.datetime.now())
+    add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "628", datetime.datetime.now())
+    assert crud.lease_tasks(test_db, [schemas.TaskTypes.SEND_DISCORD_NOTIFICATION]) == []
+
+    crud.update_old_tasks(test_db)
+
+    assert [task.task_type for task in test_db.query(models.Task)] == [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE.value]
+
+
+#
+# PRIORITIES
+#
+
+ALL_TYPES = [
+    schemas.TaskTypes.SCRAP_FILMWEB_MOVIE,
+    schemas.TaskTypes.SCRAP_FILMWEB_SERIES,
+    schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_MOVIES,
+]
+
+
+def test_lease_tasks_priority_then_weighted_turns(test_db):
+    base = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+    # thousands of refreshes queued before, they don't hold back anything else
+    for i in range(20):
+        add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_SERIES, str(i), base, schemas.TaskPriority.REFRESH)
+    for i in range(10):
+        add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, str(i), base + datetime.timedelta(minutes=1 + i))
+        user_created = base + datetime.timedelta(hours=1)
+        add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_MOVIES, str(i), user_created)
+
+    leased = crud.lease_tasks(test_db, ALL_TYPES, n=9)
+    types = [task.task_type for task in leased]
+    assert types.count(schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_MOVIES) == 6
+    assert types.count(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE) == 3
+    # oldest first within a type
+    movies = [task.task_job for task in leased if task.task_type == schemas.TaskTypes.SCRAP_FILMWEB_MOVIE]
+    assert movies == ["0", "1", "2"]
+
+    # one task at a time takes turns too
+    types = [crud.lease_tasks(test_db, ALL_TYPES, n=1)[0].task_type for _ in range(6)]
+    assert types.count(schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_MOVIES) == 4
+    assert types.count(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE) == 2
+
+    # the rest of n is filled from lower priorities
+    leased = crud.lease_tasks(test_db, ALL_TYPES, n=10)
+    assert [task.task_type for task in leased].count(schemas.TaskTypes.SCRAP_FILMWEB_SERIES) == 5
+
+
+def test_get_task_to_do_highest_priority(test_db):
+    base = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+    add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "refresh", base, schemas.TaskPriority.REFRESH)
+    add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "new", base + datetime.timedelta(hours=1))
+
+    assert crud.get_task_to_do(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], head=True).task_job == "new"
+    assert crud.get_task_to_do(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE]).task_job == "new"
+
+
+def test_duplicate_raises_priority(test_db):
+    for movie_id in (1, 2):
+        test_db.add(models.FilmWebMovie(id=movie_id))
+    test_db.commit()
+
+    assert crud.create_scrap_filmweb_movies_task(test_db) == 2
+    assert {task.task_priority for task in test_db.query(models.Task)} == {schemas.TaskPriority.REFRESH}
+
+    # a user watched movie 1, its refresh is scraped first now
+    result = crud.create_tasks_many(test_db, [task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1")])
+    assert result.deduplicated == 1
+
+    task = crud.create_task(
+        test_db,
+        schemas.TaskCreate(
+            task_status=schemas.TaskStatus.QUEUED,
+            task_type=schemas.TaskTypes.SCRAP_FILMWEB_MOVIE,
+            task_job="2",
+            task_priority=schemas.TaskPriority.ONBOARDING,
+        ),
+    )
+    assert task.task_priority == schemas.TaskPriority.ONBOARDING
+
+    # never lowered
+    crud.create_tasks_many(test_db, [task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "2")])
+    priorities = {task.task_job: task.task_priority for task in test_db.query(models.Task).populate_existing()}
+    assert priorities == {"1": schemas.TaskPriority.NORMAL, "2": schemas.TaskPriority.ONBOARDING}
+
+
+def test_first_user_scrap_is_onboarding(test_db):
+    test_db.add(models.User(id=1, discord_id=1))
+    test_db.add(models.User(id=2, discord_id=2))
+    test_db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    test_db.add(models.FilmWebUserMapping(user_id=2, filmweb_id="marek", watched_version=3))
+    test_db.commit()
+
+    crud.create_scrap_filmweb_users_movies_task(test_db)
+
+    priorities = {task.task_job: task.task_priority for task in test_db.query(models.Task)}
+    assert priorities == {"arek": schemas.TaskPriority.ONBOARDING, "marek": schemas.TaskPriority.NORMAL}
+
+
+#
+# BULK CREATE
+#
+
+
+def task_create(task_type: schemas.TaskTypes, task_job: str, status=schemas.TaskStatus.QUEUED) -> schemas.TaskCreate:
+    return schemas.TaskCreate(task_status=status, task_type=task_type, task_job=task_job)
+
+
+def test_create_tasks_many_dedupes(test_db):
+    result = crud.create_tasks_many(
+        test_db,
+        [
+            task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1"),
+            task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "2"),
+            task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1"),
+            task_create(schemas.TaskTypes.SCRAP_FILMWEB_SERIES, "1"),
+        ],
+    )
+    assert result.inserted == 3
+    assert result.deduplicated == 1
+
+    # everything is already queued
+    result = crud.create_tasks_many(
+        test_db,
+        [
+            task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1"),
+            task_create(schemas.TaskTypes.SCRAP_FILMWEB_SERIES, "1"),
+            task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "3"),
+        ],
+    )
+    assert result.inserted == 1
+    assert result.deduplicated == 2
+
+    assert test_db.query(models.Task).count() == 4
+
+
+def test_create_tasks_many_running_and_finished(test_db):
+    crud.create_tasks_many(test_db, [task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1")])
+
+    # running task still blocks a duplicate
+    leased = crud.lease_tasks(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], n=1)
+    result = crud.create_tasks_many(test_db, [task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1")])
+    assert result.inserted == 0
+    assert result.deduplicated == 1
+
+    # completed one does not
+    crud.update_task_status(test_db, leased[0].task_id, schemas.TaskStatus.COMPLETED)
+    result = crud.create_tasks_many(test_db, [task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1")])
+    assert result.inserted == 1
+    assert result.deduplicated == 0
+
+
+def test_create_task_returns_active_duplicate(test_db):
+    first = crud.create_task(test_db, task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1"))
+    second = crud.create_task(test_db, task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1"))
+
+    assert first.task_id == second.task_id
+    assert test_db.query(models.Task).count() == 1
+
+
+def test_create_task_concurrent_duplicate(test_db, monkeypatch):
+    first = crud.create_task(test_db, task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1"))
+
+    # the other create committed between this one's check and its insert
+    existing_active_task = crud._existing_active_task
+    checks = []
+
+    def missed_check(db, dedupe_key, priority):
+        checks.append(dedupe_key)
+        return existing_active_task(db, dedupe_key, priority) if len(checks) > 1 else None
+
+    monkeypatch.setattr(crud, "_existing_active_task", missed_check)
+    task = task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1").model_copy(
+        update={"task_priority": schemas.TaskPriority.ONBOARDING}
+    )
+    second = crud.create_task(test_db, task)
+
+    assert second.task_id == first.task_id
+    assert second.task_priority == schemas.TaskPriority.ONBOARDING
+    assert test_db.query(models.Task).count() == 1
+
+
+#
+# MULTIPLE TASKS GENERATION
+#
+
+
+def test_create_scrap_filmweb_movies_task(test_db):
+    for movie_id in range(1, 101):
+        test_db.add(models.FilmWebMovie(id=movie_id))
+    test_db.commit()
+
+    # one of them is already queued
+    crud.create_task(test_db, task_create(schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "50"))
+
+    assert crud.create_scrap_filmweb_movies_task(test_db) == 99
+    assert crud.create_scrap_filmweb_movies_task(test_db) == 0
+
+    jobs = [task.task_job for task in test_db.query(models.Task).all()]
+    assert sorted(jobs, key=int) == [str(movie_id) for movie_id in range(1, 101)]
+
+    task = test_db.query(models.Task).filter(models.Task.task_job == "7").first()
+    assert task.task_status == schemas.TaskStatus.QUEUED
+    assert task.task_type == schemas.TaskTypes.SCRAP_FILMWEB_MOVIE
+    assert task.task_dedupe_key == "scrap_filmweb_movie:7"
+    assert task.task_created is not None
+
+
+def test_plan_filmweb_movies_refresh(test_db):
+    now = datetime.datetime(2024, 6, 1, 12, 0, 0)
+
+    # never scraped, due earlier, due later in the window, not due in the window
+    for movie_id in range(1, 145):
+        test_db.add(models.FilmWebMovie(id=movie_id))
+    for movie_id in range(145, 289):
+        test_db.add(models.FilmWebMovie(id=movie_id, next_refresh_at=now - datetime.timedelta(hours=1)))
+    for movie_id in range(289, 433):
+        test_db.add(models.FilmWebMovie(id=movie_id, next_refresh_at=now + datetime.timedelta(hours=12)))
+    test_db.add(models.FilmWebMovie(id=1000, next_refresh_at=now + datetime.timedelta(days=7)))
+    test_db.commit()
+
+    with freeze_time(now):
+        # this run's share of the 432 titles due within the window
+        assert crud.plan_filmweb_movies_refresh(test_db) == 3
+        # queued ones are not queued again
+        assert crud.plan_filmweb_movies_refresh(test_db) == 3
+
+    tasks = test_db.query(models.Task).order_by(models.Task.task_id).all()
+    assert [task.task_job for task in tasks] == ["1", "2", "3", "4", "5", "6"]
+    assert {task.task_priority for task in tasks} == {schemas.TaskPriority.REFRESH}
+
+    # everything was scraped recently
+    test_db.query(models.FilmWebMovie).update({"next_refresh_at": now + datetime.timedelta(days=30)})
+    test_db.commit()
+    with freeze_time(now):
+        assert crud.plan_filmweb_movies_refresh(test_db) == 0
+
+
+def test_create_scrap_filmweb_users_series_task(test_db):
+    test_db.add(models.User(id=1, discord_id=1))
+    test_db.add(models.User(id=2, discord_id=2))
+    test_db.add(models.FilmWebUserMapping(user_id=1, filmweb_id="arek"))
+    test_db.add(models.FilmWebUserMapping(user_id=2, filmweb_id="marek"))
+    test_db.commit()
+
+    assert crud.create_scrap_filmweb_users_series_task(test_db) == 2
+    assert crud.create_scrap_filmweb_users_series_task(test_db) == 0
+
+    # finished scrap can be queued again
+    task = crud.get_task_to_do(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_SERIES])
+    crud.update_task_status(test_db, task.task_id, schemas.TaskStatus.COMPLETED)
+
+    assert crud.create_scrap_filmweb_users_series_task(test_db) == 1
+
+
+def add_mapping(db, user_id: int, filmweb_id: str, destination: bool = False, **columns) -> models.FilmWebUserMapping:
+    db.add(models.User(id=user_id, discord_id=user_id))
+    mapping = models.FilmWebUserMapping(user_id=user_id, filmweb_id=filmweb_id, **columns)
+    db.add(mapping)
+    if destination:
+        if db.query(models.DiscordGuilds).filter_by(discord_guild_id=1).first() is None:
+            db.add(models.DiscordGuilds(discord_guild_id=1, discord_channel_id=1))
+        db.add(models.DiscordDestinations(user_id=user_id, discord_guild_id=1))
+    db.commit()
+    return mapping
+
+
+def test_user_scrap_interval():
+    now = datetime.datetime(2024, 6, 1, 12, 0, 0)
+
+    minimum = datetime.timedelta(minutes=crud.USER_SCRAP_MIN_MINUTES)
+
+    # rated in the last days, as often as the old sweep
+    assert crud._user_scrap_interval(now, True, now) == minimum
+    assert crud._user_scrap_interval(now - datetime.timedelta(days=2, hours=23), True, now) == minimum
+
+    # then an hour for every day without a rate, between the bounds
+    assert crud._user_scrap_interval(now - datetime.timedelta(days=6), True, now) == datetime.timedelta(hours=3)
+    assert crud._user_scrap_interval(now - datetime.timedelta(days=700), True, now) == datetime.timedelta(
+        hours=crud.USER_SCRAP_MAX_HOURS
+    )
+    assert crud._user_scrap_interval(None, True, now) == datetime.timedelta(hours=crud.USER_SCRAP_MAX_HOURS)
+
+    # nobody is announced about a user without a destination
+    assert crud._user_scrap_interval(now - datetime.timedelta(days=3), False, now) == datetime.timedelta(
+        hours=3 * crud.USER_SCRAP_NO_DESTINATION_FACTOR
+    )
+
+
+def test_plan_filmweb_users_scrap(test_db):
+    now = datetime.datetime(2024, 6, 1, 12, 0, 0)
+    day_ago = now - datetime.timedelta(days=1)
+
+    arek = add_mapping(test_db, 1, "arek", destination=True, last_rated_at=day_ago, watched_version=1)
+    marek = add_mapping(test_db, 2, "marek", last_rated_at=day_ago, watched_version=1)
+    # new user, never scraped
+    darek = add_mapping(test_db, 3, "darek", destination=True)
+    add_mapping(test_db, 4, "jarek", next_scrap_at=now + datetime.timedelta(minutes=5))
+
+    with freeze_time(now):
+        assert crud.plan_filmweb_users_scrap(test_db) == 6
+        # planned already
+        assert crud.plan_filmweb_users_scrap(test_db) == 0
+
+    tasks = test_db.query(models.Task).all()
+    assert {(task.task_type, task.task_job) for task in tasks} == {
+        (task_type, filmweb_id)
+        for task_type in (
+            schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_MOVIES,
+            schemas.TaskTypes.SCRAP_FILMWEB_USER_WATCHED_SERIES,
+        )
+        for filmweb_id in ("arek", "marek", "darek")
+    }
+    assert {task.task_job for task in tasks if task.task_priority == schemas.TaskPriority.ONBOARDING} == {"darek"}
+
+    test_db.expire_all()
+    assert arek.next_scrap_at == now + datetime.timedelta(minutes=crud.USER_SCRAP_MIN_MINUTES)
+    assert marek.next_scrap_at == now + datetime.timedelta(hours=crud.USER_SCRAP_NO_DESTINATION_FACTOR)
+    assert darek.next_scrap_at == now + datetime.timedelta(hours=crud.USER_SCRAP_MAX_HOURS)
+
+
+def test_planned_user_scrap_survives_old_tasks_cleanup(test_db):
+    now = datetime.datetime(2024, 6, 1, 12, 0, 0)
+    add_mapping(test_db, 1, "arek", destination=True, last_rated_at=now - datetime.timedelta(days=30))
+
+    with freeze_time(now) as frozen_time:
+        assert crud.plan_filmweb_users_scrap(test_db) == 2
+
+        # the next scrap is hours away, the queued ones must wait however long it takes
+        frozen_time.tick(delta=datetime.timedelta(minutes=45))
+        crud.update_old_tasks(test_db, minutes=20)
+
+    assert test_db.query(models.Task).filter_by(task_status=schemas.TaskStatus.QUEUED).count() == 2
+
+
+def test_new_rate_resets_user_scrap_interval(test_db):
+    now = datetime.datetime(2024, 6, 1, 12, 0, 0)
+    dormant = add_mapping(
+        test_db,
+        1,
+        "arek",
+        destination=True,
+        last_rated_at=datetime.datetime(2022, 1, 1),
+        next_scrap_at=now + datetime.timedelta(hours=10),
+    )
+
+    def watched(id_media: int, date: datetime.datetime) -> schemas.FilmWebUserWatchedMovieCreate:
+        return schemas.FilmWebUserWatchedMovieCreate(
+            id_media=id_media, filmweb_id="arek", date=date, rate=7, favorite=False
+        )
+
+    with freeze_time(now):
+        # an old vote seen for the first time doesn't make the account active
+        crud.create_filmweb_user_watched_movies_many(test_db, [watched(1, datetime.datetime(2023, 1, 1))])
+        test_db.refresh(dormant)
+        assert dormant.last_rated_at == datetime.datetime(2023, 1, 1)
+        assert dormant.next_scrap_at == now + datetime.timedelta(hours=10)
+
+        crud.create_filmweb_user_watched_movies_many(test_db, [watched(2, now - datetime.timedelta(minutes=5))])
+        test_db.refresh(dormant)
+        assert dormant.last_rated_at == now - datetime.timedelta(minutes=5)
+        assert dormant.next_scrap_at == now + datetime.timedelta(minutes=crud.USER_SCRAP_MIN_MINUTES)
+
+        # an aware date from the client ("...Z") is compared in local time
+        rated_at = datetime.datetime(2024, 6, 1, 11, 58, tzinfo=datetime.timezone.utc)
+        results = crud.create_filmweb_user_watched_movies_many(test_db, [watched(3, rated_at)])
+        assert results[0].status == schemas.WatchedUpsertStatus.CREATED
+        test_db.refresh(dormant)
+        assert dormant.last_rated_at == max(
+            rated_at.astimezone().replace(tzinfo=None), now - datetime.timedelta(minutes=5)
+        )
+
+
+#
+# STATS
+#
+
+
+def test_get_task_queue_stats(test_db):
+    with freeze_time("2024-01-01 12:00:00") as frozen_time:
+        add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "1", datetime.datetime(2024, 1, 1, 11, 0, 0))
+        add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "2", datetime.datetime(2024, 1, 1, 11, 50, 0))
+        add_task(test_db, schemas.TaskTypes.SCRAP_FILMWEB_MOVIE, "3", datetime.datetime(2024, 1, 1, 11, 58, 0))
+        add_task(
+            test_db,
+            schemas.TaskTypes.SCRAP_FILMWEB_SERIES,
+            "1",
+            datetime.datetime(2024, 1, 1, 10, 0, 0),
+            schemas.TaskPriority.REFRESH,
+        )
+
+        # waited 60 and 10 minutes, started in the window
+        crud.lease_tasks(test_db, [schemas.TaskTypes.SCRAP_FILMWEB_MOVIE], n=2)
+        frozen_time.tick(delta=datetime.timedelta(minutes=1))
+
+        stats = crud.get_task_queue_stats(test_db)
+
+    assert stats == [
+        schemas.TaskQueueStats(
+            task_type=schemas.TaskTypes.SCRAP_FILMWEB_MOVIE,
+            task_priority=schemas.TaskPriority.NORMAL,
+            queued=1,
+            running=2,
+            oldest_queued_age=180,
+            average_wait=2100,
+        ),
+        schemas.TaskQueueStats(
+            task_type=schemas.TaskTypes.SCRAP_FILMWEB_SERIES,
+            task_priority=schemas.TaskPriority.REFRESH,
+            queued=1,
+            running=0,
+            oldest_queued_age=7260,
+        ),
+    ]
@@ -12,31 +12,24 @@ def cron():
 
 
 @patch("filman_server.cron.requests.get")
-def test_tasks_new_scrap_filmweb_users_series(mock_get):
+def test_tasks_refresh_filmweb_movies(mock_get):
     mock_get.return_value.status_code = 200
-    Cron.tasks_new_scrap_filmweb_users_series()
-    mock_get.assert_called_once_with("http://localhost:8000/tasks/new/scrap/filmweb/users/series", timeout=10)
+    Cron.tasks_refresh_filmweb_movies()
+    mock_get.assert_called_once_with("http://localhost:8000/tasks/new/refresh/filmweb/movies", timeout=10)
 
 
 @patch("filman_server.cron.requests.get")
-def test_tasks_new_scrap_filmweb_series(mock_get):
+def test_tasks_refresh_filmweb_series(mock_get):
     mock_get.return_value.status_code = 200
-    Cron.tasks_new_scrap_filmweb_series()
-    mock_get.assert_called_once_with("http://localhost:8000/tasks/new/scrap/filmweb/series", timeout=10)
+    Cron.tasks_refresh_filmweb_series()
+    mock_get.assert_called_once_with("http://localhost:8000/tasks/new/refresh/filmweb/series", timeout=10)
 
 
 @patch("filman_server.cron.requests.get")
-def test_tasks_new_scrap_filmweb_users_movies(mock_get):
+def test_tasks_refresh_filmweb_users(mock_get):
     mock_get.return_value.status_code = 200
-    Cron.tasks_new_scrap_filmweb_users_movies()
-    mock_get.assert_called_once_with("http://localhost:8000/tasks/new/scrap/filmweb/users/movies", timeout=10)
-
-
-@patch("filman_server.cron.requests.get")
-def test_tasks_new_scrap_filmweb_movies(mock_get):
-    mock_get.return_value.status_code = 200
-    Cron.tasks_new_scrap_filmweb_movies()
-    mock_get.assert_called_once_with("http://localhost:8000/tasks/new/scrap/filmweb/movies", timeout=10)
+    Cron.tasks_refresh_filmweb_users()
+    mock_get.assert_called_once_with("http://localhost:8000/tasks/new/refresh/filmweb/users", timeout=10)
 
 
 @patch("filman_server.cron.requests.get")
@@ -53,16 +46,31 @@ def test_tasks_update_old_tasks(mock_get):
     mock_get.assert_called_once_with("http://localhost:8000/tasks/update/old/20", timeout=10)
 
 
+@patch("filman_server.cron.requests.get")
+def test_recommend_rebuild_similarities(mock_get):
+    mock_get.return_value.status_code = 200
+    Cron.recommend_rebuild_similarities()
+    mock_get.assert_called_once_with("http://localhost:8000/recommend/rebuild", timeout=10)
+
+
+@patch("filman_server.cron.requests.get")
+def test_notifications_delete_old(mock_get):
+    mock_get.return_value.status_code = 200
+    Cron.notifications_delete_old()
+    mock_get.assert_called_once_with("http://localhost:8000/notifications/delete/old/7", timeout=10)
+
+
 # test exceptions execute_task
 @patch("filman_server.cron.requests.get")
 @patch("filman_server.cron.logging.info")
 def test_execute_task_success(mock_logging_info, mock_get):
     mock_get.return_value.status_code = 200
+    mock_get.return_value.text = "12"
 
     Cron.execute_task("http://localhost:8000/tasks/new/scrap/filmweb/users/series", "test_task")
 
     mock_get.assert_called_once_with("http://localhost:8000/tasks/new/scrap/filmweb/users/series", timeout=10)
-    mock_logging_info.assert_called_once_with("Executed test_task: 200")
+    mock_logging_info.assert_called_once_with("Executed test_task: 200 12")
 
 
 @patch("filman_server.cron.requests.get", side_effect=requests.exceptions.Timeout)
@@ -0,0 +1,47 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+
+import filman_server.filmweb_api as filmweb_api
+from filman_server.filmweb_api import FilmwebUnavailable, fetch_filmweb_user_id, lookup_cache
+
+
+def mock_filmweb(handler):
+    client = httpx.AsyncClient(base_url=filmweb_api.FILMWEB_API_URL, transport=httpx.MockTransport(handler))
+    return patch("filman_server.filmweb_api._get_client", return_value=client)
+
+
+def test_fetch_filmweb_user_id():
+    def handler(request):
+        if request.url.path == "/api/v1/users/arek/id":
+            return httpx.Response(200, json={"userId": 123})
+        return httpx.Response(404)
+
+    with mock_filmweb(handler):
+        assert asyncio.run(fetch_filmweb_user_id("arek")) == 123
+        assert asyncio.run(fetch_filmweb_user_id("nobody")) is None
+
+
+def test_fetch_filmweb_user_id_unavailable():
+    with mock_filmweb(lambda request: httpx.Response(503)):
+        with pytest.raises(FilmwebUnavailable):
+            asyncio.run(fetch_filmweb_user_id("arek"))
+
+    # unknown answers are not cached
+    assert lookup_cache.get("arek") == (False, None)
+
+
+def test_fetch_filmweb_user_id_cached():
+    request = AsyncMock(side_effect=[123, None])
+
+    with patch("filman_server.filmweb_api._request_filmweb_user_id", request):
+        assert asyncio.run(fetch_filmweb_user_id("arek")) == 123
+        assert asyncio.run(fetch_filmweb_user_id("arek")) == 123
+
+        # "no such user" is cached too
+        assert asyncio.run(fetch_filmweb_user_id("nobody")) is None
+        assert asyncio.run(fetch_filmweb_user_id("nobody")) is None
+
+    assert request.await_count == 2
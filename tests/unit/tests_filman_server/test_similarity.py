@@ -0,0 +1,71 @@
+import numpy as np
+
+from filman_server.similarity import item_neighbours, user_compatibility
+
+
+def rates_of(rows):
+    users, items, rates = zip(*rows)
+    return np.array(users), np.array(items), np.array(rates, dtype=np.float32)
+
+
+def neighbours_of(result):
+    neighbours = {}
+    for id_media, id_similar, similarity in zip(*result):
+        neighbours.setdefault(int(id_media), {})[int(id_similar)] = float(similarity)
+    return neighbours
+
+
+def test_item_neighbours_taste_groups():
+    # users 0-4 love 1-3 and dislike 4-6, users 5-9 the other way around
+    rows = []
+    for user in range(10):
+        for item in range(1, 7):
+            likes = (item <= 3) == (user < 5)
+            rows.append((user, item, 9 if likes else 2 + (user + item) % 2))
+
+    neighbours = neighbours_of(item_neighbours(*rates_of(rows), k=2, min_common=3))
+
+    assert set(neighbours[1]) == {2, 3}
+    assert set(neighbours[5]) == {4, 6}
+    assert all(0 < similarity <= 1 for similarity in neighbours[1].values())
+
+
+def test_item_neighbours_filters():
+    # 1 and 2 are rated together by two users only, 3 has a single rate
+    rows = [(0, 1, 8), (0, 2, 8), (0, 3, 1), (1, 1, 9), (1, 2, 9), (1, 4, 2), (2, 4, 9), (2, 1, 1)]
+
+    assert neighbours_of(item_neighbours(*rates_of(rows), k=5, min_common=3)) == {}
+    assert 2 in neighbours_of(item_neighbours(*rates_of(rows), k=5, min_common=2))[1]
+
+    assert [len(column) for column in item_neighbours(*rates_of([(0, 1, 5)]), k=5, min_common=1)] == [0, 0, 0]
+    empty = np.array([])
+    assert [len(column) for column in item_neighbours(empty, empty, empty, k=5, min_common=1)] == [0, 0, 0]
+
+
+def test_user_compatibility_matches_pairwise():
+    rng = np.random.default_rng(0)
+    ratings = np.where(rng.random((8, 40)) < 0.5, rng.integers(1, 11, (8, 40)), 0)
+    ratings[3] = 0
+    ratings[3, :6] = 7  # same rate everywhere, no correlation with anyone
+    users, items = np.nonzero(ratings)
+
+    pearson, cosine, common = user_compatibility(users, items * 10 + 5, ratings[users, items], 8)
+
+    for a in range(8):
+        for b in range(a + 1, 8):
+            both = (ratings[a] > 0) & (ratings[b] > 0)
+            x, y = ratings[a, both], ratings[b, both]
+            assert common[a, b] == common[b, a] == both.sum()
+            assert np.isclose(cosine[a, b], x @ y / np.linalg.norm(x) / np.linalg.norm(y))
+            if 3 in (a, b):
+                assert np.isnan(pearson[a, b])
+            else:
+                assert np.isclose(pearson[a, b], np.corrcoef(x, y)[0, 1])
+                assert pearson[a, b] == pearson[b, a]
+
+
+def test_user_compatibility_nothing_in_common():
+    pearson, cosine, common = user_compatibility(np.array([0, 1]), np.array([1, 2]), np.array([5, 5]), 3)
+
+    assert common.tolist() == [[0, 0, 0]] * 3
+    assert np.isnan(pearson).all() and np.isnan(cosine).all()